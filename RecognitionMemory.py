@@ -47,12 +47,19 @@ from datetime import date
 import time
 
 import csv
+import sqlite3
+import copy
+import struct
+import zlib
+import hashlib
 import ast
 
 import json
+import re
 from collections import OrderedDict
 
 from multiprocessing.dummy import Pool as ThreadPool 
+import multiprocessing # for running cross validation jobs in parallel
 
 import itertools # for permutations to generate stats (not necessary for code)
 import logging
@@ -60,6 +67,7 @@ import logging
 import qi
 import functools
 import threading
+import atexit # for applying the write-behind queue when the process exits
 import random # for making random choices for the phrases
 
 class RecogniserBN:
@@ -106,7 +114,8 @@ class RecogniserBN:
         self.stats_file = "stats.csv" # statistics file
         self.conf_matrix_file = "confusionMatrix.csv" # confusion matrix
         self.image_save_dir = "images/" # images directory
-        self.previous_files_dir = "LastSaved/" # contains the recognition from the previous recognition
+        self.journal_dir = "Journal/" # journal of the changes of the recognitions (journal.log) and the face recognition databases before them, to revert the recognitions (see revertTo)
+        self.journal_file = self.journal_dir + "journal.log"
         self.faceDB = "faceDB"
         """END OF FILES"""
         
@@ -138,6 +147,9 @@ class RecogniserBN:
                 
         self.period = 30 # time is checked every 30 minutes 
         self.stddev_time = 60/self.period # 60 minutes
+        self.max_curve_tables = 200 # maximum number of tables of Gaussian curves (and of weighted kernels) to keep in memory (see getGaussianCurve)
+        self.stddev_table_steps = 1000 # grid of the confidences of the table of standard deviations (see getStddevFromConfidence)
+        self.max_face_scores_cache = 50 # maximum number of face recognition results aligned to i_labels to keep in memory (see getFaceScores)
         self.time_min = 0
         self.time_max = (7*24*60/self.period) -1 # 7(days)*24(hours)*60(minutes)/self.period ( = num_time_slots)
 
@@ -174,6 +186,9 @@ class RecogniserBN:
         self.apply_weight_method = "pow" # method for applying weight: (pow works best) pow, invpow, mult
         self.apply_accuracy_method = "none" # method for applying accuracy: (none works best) none, pow, invpow, mult. Currently "mult" doesn't effect the results, because face recognition weight is 1.0 and results are normalised)
         self.update_I_method = "equal" # method for updating prior of Identity node in online learning: "equal" (P(I=i) is equal for all i), "sequential" ('sequential updating'), "occurrences" (P(I=i) is higher when the number of occurrences of i is higher)
+        self.isLogSpace = False # evidence in log domain (see setLogSpace)
+        self.inference_method = "closed-form" # "closed-form" or "agrum" (see setInferenceMethod)
+        self.face_likelihood_max_entries = None # maximum number of learned entries per user in the face likelihood, None for all (see setFaceLikelihoodMaxEntries)
         """END OF OTHER PARAMETERS"""
 
         """PARAMETERS FOR MULTIPLE IMAGES FOR EACH RECOGNITION""" 
@@ -189,11 +204,25 @@ class RecogniserBN:
         
         self.isDBinCSV = True # is DB in CSV format or in MongoDB format
         self.isSaveRecogFiles = True # False only for optimisation, otherwise, files should be saved for analysis
+        self.isUserStoreSQLite = True # keep the users in db.sqlite (see setUserStoreSQLite)
+        self.user_store = None # the open user database (see getUserStore)
+        self.persistence_queue = None # write-behind queue (see setWriteBehind), None if the files are written immediately
+        self.isRecogLogBinary = True # append the recognitions to binary logs (see setRecogLogBinary)
+        self.model_mmap_mode = "c" # mode of np.load for the likelihoods of the binary model ("c" maps them to memory, see loadModel)
+        self.isModelBinary = True # save the network as a binary model (see setModelBinary)
+        self.isImageStore = True # store the images in the content-addressed image store (see setImageStore)
+        self.image_store = None # the open image store (see getImageStore)
         self.qualityCoefficient = None # if not None, then the quality formula becomes: quality = (two_largest[0] - two_largest[1]) * self.qualityCoefficient, which replaces the self.num_people
-        self.isSaveLastFiles = True # saves the last recognition files to LastSaved directory (should be False for optimization)
+        self.isSaveLastFiles = True # record the changes of each recognition in the journal (should be False for optimization)
+        self.journal_max_steps = 100 # maximum number of recognitions that can be reverted (the older entries are removed from the journal)
 
         self.isDebugMode = False # print values and errors if True
         self.isLogMode = False # save Analysis.json if True
+        self.isAnalysisLogBinary = True # append the analysis to the analysis log (see setAnalysisLog)
+        self.analysis_sample_rate = 1.0 # fraction of the recognitions whose analysis is saved (e.g. 0.1 saves every 10th recognition)
+        self.analysis_max_records = 1000 # number of analysis records in a segment of the analysis log (None for no limit)
+        self.analysis_max_segments = 10 # number of segments of the analysis log that are kept (the oldest segments are removed, None to keep all segments)
+        self.analysis_log = None # analysis log of the session (see getAnalysisLog)
             
         """ROBOT PARAMETERS"""
         self.useSpanish = False # speak Spanish (for Colombia experiments)
@@ -206,6 +235,20 @@ class RecogniserBN:
         """INITIALISATIONS"""
         self.r_bn = None # Bayesian network
         self.ie = None # Bayesian network inference
+        self.agrum_ie = None # LazyPropagation of pyAgrum that is kept for the version of the network (shared by AgrumInference instances, see getAgrumEngine)
+        self.agrum_ie_bn = None # network of agrum_ie
+        self.agrum_ie_version = -1 # bn_version of agrum_ie
+        self.agrum_evidence = {} # evidence that is set on agrum_ie (None if the CPTs are changed after the evidence is set, then the evidence is set again)
+        self.bn_version = 0 # version of the structure of the network (incremented when the nodes are recreated in syncBN)
+        self.prior_I = None # prior of I, P(I) (the same as in the CPT of I in the network)
+        self.likelihoods = None # likelihood matrices of F, G, A, H, T (num_people x num_states, see resizeLikelihoods)
+        self.likelihood_buffers = None # buffers of the likelihood matrices with capacity for more users
+        self.likelihood_capacity = 0 # number of users the likelihood buffers can hold
+        self.bn_num_people = 0 # number of states of I written to the network (the network is rebuilt in syncBN if it is different from the number of users)
+        self.bn_dirty_rows = set() # indices of the users whose likelihoods are changed since the network was synced
+        self.isPriorChanged = False # is P(I) changed since the network was synced
+        self.journal_entry = None # changes of the current recognition to write to the journal (see beginJournalEntry)
+        self.journal_num_entries = None # number of entries in the journal (None if not counted yet)
         self.identity_est = "" # estimated identity
         self.recog_results = [] # recognition evidence
         self.nonweighted_evidence = [] # nonweighted evidence = recog_results
@@ -217,6 +260,13 @@ class RecogniserBN:
         self.num_recognitions = 0 # number of recognitions
         self.isBNSaved = False # is Bayesian network saved (to avoid saving the BN during execution of the code for time purposes)
         self.i_labels = []
+        self.i_labels_index = {} # index of each ID in i_labels (for O(1) lookup of users)
+        self.stddev_table = None # standard deviations for the confidences i/stddev_table_steps (NaN if not computed yet)
+        self.face_scores_cache = {} # face similarity scores aligned to i_labels for the recent face recognition results (cleared when i_labels changes)
+        self.curve_kernels = {} # weighted Gaussian kernels (pdf values for the offsets from the mean) for each (span, stddev, weight, apply_weight_method, prob_threshold)
+        self.curve_tables = {} # tables of weighted and normalised Gaussian curves for (min_value, max_value, stddev, weight, norm_method, apply_weight_method, prob_threshold), indexed by integer mean
+        self.cross_validation_counts = None # [#correct_known_recognitions, #incorrect_unknown_recognitions] of the network and face recognition in the last cross validation (see runCrossValidation)
+        self.quality_sweep_records = None # the two highest posteriors and the quality of each recognition for the quality threshold sweep (see setQualitySweep), None if not recorded
         """END OF INITIALISATIONS"""
         
 
@@ -340,6 +390,61 @@ class RecogniserBN:
             self.update_prob_method = "none"
             self.update_prob_unknown_method = "none"
 
+    def setInferenceMethod(self, method):
+        """Set inference method: closed-form (default, P(I|e) is computed from the likelihood matrices, as I is the only parent of F, G, A, H and T), 
+        agrum (LazyPropagation of pyAgrum that is reused while the structure of the network is the same, slower, use as reference for validation)"""
+        self.inference_method = method
+
+    def setLogSpace(self, isLogSpace = True):
+        """Set log space (default: False). If True, the evidence is in log domain and fused in log domain (stable for many users and large occurrences):
+        the curves are not clamped to prob_threshold, and the posterior is normalised with logsumexp. The likelihoods in the network are not changed."""
+        self.isLogSpace = isLogSpace
+
+    def setRecogLogBinary(self, isRecogLogBinary = True):
+        """Set binary recognition logs (default: True). If True, the rows of RecogniserBN.csv, InitialRecognition.csv and Comparison.csv are appended to binary logs 
+        (.log files with the same name, see RecognitionLog), and the CSV files are written with exportRecogLogs. If False, the rows are appended to the CSV files."""
+        self.isRecogLogBinary = isRecogLogBinary
+
+    def setImageStore(self, isImageStore = True):
+        """Set the image store (default: True). If True, the images of the recognitions are stored once in images/objects/ with the SHA-1 of the image as the name 
+        and indexed by the number of the recognition and the category (Known_True, Known_False, ..., see ImageStore), and the folders of the categories are written 
+        with exportImages. If False, the images are copied to the folders of the categories."""
+        self.isImageStore = isImageStore
+        self.image_store = None
+
+    def setModelBinary(self, isModelBinary = True):
+        """Set the binary model (default: True). If True, P(I), the likelihoods, the labels, the weights, the thresholds and the occurrences are saved 
+        as raw arrays (RecogniserBN.model, see writeModel) that are loaded with np.load, and the BIF file is written with exportBN. 
+        If False, the network is saved to the BIF file with gum.saveBN. An existing BIF file is loaded if there is no model."""
+        self.isModelBinary = isModelBinary
+
+    def setUserStoreSQLite(self, isUserStoreSQLite = True):
+        """Set the SQLite user database (default: True). If True, the users are kept in an SQLite file next to db.csv (db.sqlite, see SQLiteUserStore), 
+        where the occurrence of a user is updated in place after a recognition, and db.csv is written with exportDB. 
+        If False, db.csv is rewritten after each recognition. An existing db.csv is imported to the SQLite file when it is first opened, or if it is newer (see importChangedDB)."""
+        if isUserStoreSQLite != self.isUserStoreSQLite:
+            self.closeUserStore()
+        self.isUserStoreSQLite = isUserStoreSQLite
+
+    def setWriteBehind(self, isWriteBehind = True):
+        """Set write-behind persistence (default: False). If True, the network, recognition files, database, analysis files and journal entries 
+        are written in order by a background thread (see PersistenceQueue) from a snapshot of the state, so that the recognition returns before the files are written. 
+        Consecutive saves of the network are coalesced. Call flush to wait until the files are written (the files are flushed before they are read, reset or reverted). 
+        The queue is applied when the process exits."""
+        if isWriteBehind and self.persistence_queue is None:
+            self.persistence_queue = PersistenceQueue()
+        elif not isWriteBehind and self.persistence_queue is not None:
+            persistence_queue = self.persistence_queue
+            self.persistence_queue = None
+            persistence_queue.close()
+
+    def setFaceLikelihoodMaxEntries(self, max_entries = None):
+        """Set the maximum number of learned entries per user in the sparse face likelihood (default: None, all entries are kept).
+        If set, only the max_entries values that differ most from the background of the user are kept, and the rest are averaged into the background (approximation)."""
+        self.face_likelihood_max_entries = max_entries
+        if self.likelihood_buffers is not None:
+            self.likelihood_buffers[0].max_entries = max_entries
+
     def setNumRecogMin(self, minrecog=5):
         """Set minimum number of recognitions under which (n<minrecog) the user will be identified as unknown, regardless of the output of the network."""  
         self.num_recog_min = minrecog
@@ -348,6 +453,10 @@ class RecogniserBN:
         """Set whether the face recognition estimate is used to identify the user under minimum number of recognitions (otherwise they are identified as unknown). Default is False, using this function will set it to True."""  
         self.isUseFaceRecogEstForMinRecog = isUseFaceRecog
         
+    def setQualitySweep(self, isQualitySweep=True):
+        """Set whether the two highest posteriors and the quality of the recognitions are recorded (from now on) to get the DIR and FAR for all quality thresholds at once (see getQualitySweep)."""
+        self.quality_sweep_records = [] if isQualitySweep else None
+        
     def setDefinedNumMultRecognitions(self, num_mult_recognitions):
         """Set defined number of recognitions for multiple image recognition (3 default)."""
         self.def_num_mult_recognitions = num_mult_recognitions
@@ -369,9 +478,13 @@ class RecogniserBN:
         self.isSaveRecogFiles = isSaveRecogFiles
 
     def setSaveLastFiles(self, isSaveLastFiles=True):
-        """Set isSaveLastFiles (default: True). If True, the files from the last recognition are saved, make False only for optimisation."""
+        """Set isSaveLastFiles (default: True). If True, the changes of each recognition are recorded in the journal to revert them (see revertTo), make False only for optimisation."""
         self.isSaveLastFiles = isSaveLastFiles
         
+    def setJournalMaxSteps(self, journal_max_steps = 100):
+        """Set the maximum number of recognitions that can be reverted (default: 100). The older entries are removed from the journal (None to keep all entries)"""
+        self.journal_max_steps = journal_max_steps
+        
     def setDebugMode(self, mode = True):
         """Set debug mode. If True, print values and errors"""
         self.isDebugMode = mode
@@ -380,6 +493,19 @@ class RecogniserBN:
         """Set log mode. If True, saves analysis file"""
         self.isLogMode = mode
         
+    def setAnalysisLog(self, isAnalysisLogBinary = True, sample_rate = 1.0, max_records = 1000, max_segments = 10):
+        """Set how the analysis is saved in log mode (see setLogMode). If isAnalysisLogBinary (default), the analysis is appended to the analysis log 
+        (see AnalysisLog), where the likelihoods are referred by their version instead of being copied to each recognition, and the JSON files are written with exportAnalysisLogs. 
+        The log is kept in segments of max_records records, and only the last max_segments segments are kept. 
+        If isAnalysisLogBinary is False, a JSON file is written for each recognition (Analysis<N>.json). 
+        The analysis of sample_rate of the recognitions is saved (e.g. 0.1 saves every 10th recognition)"""
+        self.flush()
+        self.isAnalysisLogBinary = isAnalysisLogBinary
+        self.analysis_sample_rate = sample_rate
+        self.analysis_max_records = max_records
+        self.analysis_max_segments = max_segments
+        self.analysis_log = None
+        
     def setSilentMode(self):
         """When called, the robot does not speak"""
         self.isSpeak = False
@@ -396,13 +522,19 @@ class RecogniserBN:
         self.recog_file = recog_file
         self.recogniser_csv_file = recogniser_csv_file
         start_load_bn = time.time()
+        self.flush()
+        self.analysis_log = None
 
         self.loadDB(self.db_file)
         
         self.num_recognitions = sum([self.occurrences[i][0] for i in range(1, len(self.occurrences))])       
         self.isBNLoaded = True
         
-        if os.path.isfile(recog_file):
+        if self.isModelBinary and self.loadModel(self.getModelFile(recog_file)):
+            if self.isDebugMode:
+                print "time to load model:" + str(time.time() - start_load_bn)
+                
+        elif os.path.isfile(recog_file):
             self.r_bn = gum.loadBN(recog_file)
             self.loadVariables()
             end_load_bn = time.time()
@@ -432,18 +564,153 @@ class RecogniserBN:
 
             if self.isMultipleRecognitions:
                 if num_recog == self.num_mult_recognitions - 1:
-                    gum.saveBN(self.r_bn, recog_file)
+                    self.persistBN(recog_file)
                     if self.isDebugMode:
                         print "time for agrum save:" + str(time.time() - start_save_bn)
             else:
-                gum.saveBN(self.r_bn, recog_file)
+                self.persistBN(recog_file)
                 if self.isDebugMode:
                     print "time for agrum save:" + str(time.time() - start_save_bn)
             
             self.isBNSaved = True
+            
+    def persistBN(self, recog_file):
+        """Write the network to the binary model of recog_file if isModelBinary (see setModelBinary), otherwise to recog_file (BIF)"""
+        if self.isModelBinary:
+            self.persist(self.writeModel, (self.getModelSnapshot(), self.getModelFile(recog_file)), key = ("BN", recog_file))
+        else:
+            self.syncBN()
+            self.persist(self.writeBN, (self.getBNSnapshot(), recog_file), key = ("BN", recog_file))
+    
+    def exportBN(self, bif_file = None):
+        """Write the network to the BIF file (recog_file by default), e.g. to use it with pyAgrum or to load it with setModelBinary(False)"""
+        if self.r_bn is None:
+            return
+        if bif_file is None:
+            bif_file = self.recog_file
+        self.flush()
+        self.syncBN()
+        self.writeBN(self.r_bn, bif_file)
+        
+    def getModelFile(self, recog_file):
+        """Get the binary model of the network file (RecogniserBN.model for RecogniserBN.bif)"""
+        return os.path.splitext(recog_file)[0] + ".model"
+    
+    def getModelSnapshot(self):
+        """Get the header and the arrays of the binary model (see RecognitionModel). The arrays are copied if the files are written in the background (see setWriteBehind)"""
+        num_labels = len(self.i_labels)
+        face_likelihood = self.likelihoods[0]
+        rows, columns, values = face_likelihood.getEntries()
+        arrays = {"prior_I": self.prior_I, "F_diagonal": face_likelihood.diagonal[:num_labels], "F_background": face_likelihood.background[:num_labels], 
+                  "F_rows": rows, "F_columns": columns, "F_values": values}
+        for counter in range(1, len(self.node_names) - 1):
+            arrays[self.node_names[counter + 1]] = self.likelihoods[counter]
+        if self.persistence_queue is not None:
+            arrays = dict((name, np.array(values)) for name, values in arrays.iteritems())
+        header = {"i_labels": list(self.i_labels), "g_labels": list(self.g_labels), "occurrences": copy.deepcopy(self.occurrences), 
+                  "ranges": {"A": [self.age_min, self.age_max], "H": [self.height_min, self.height_max], "T": [self.time_min, self.time_max]},
+                  "weights": list(self.weights), "quality_threshold": self.quality_threshold, "face_recog_threshold": self.face_recog_threshold, 
+                  "prob_threshold": self.prob_threshold, "max_threshold": self.max_threshold, "num_recognitions": self.num_recognitions}
+        return header, arrays
+    
+    def writeModel(self, snapshot, model_file):
+        """Write the snapshot of the model (see getModelSnapshot) to model_file (see RecognitionModel)"""
+        header, arrays = snapshot
+        RecognitionModel(model_file).write(header, arrays)
+        
+    def loadModel(self, model_file):
+        """Load P(I) and the likelihoods from the binary model (see RecognitionModel). The network is created with the nodes of the users in the database, 
+        and its CPTs are written when it is needed (see syncBN). Returns False if there is no model or if its users are not the users in the database 
+        (the other fields of the header are checked with checkModelHeader)"""
+        model = RecognitionModel(model_file).read(self.model_mmap_mode)
+        if model is None:
+            return False
+        header, arrays = model
+        num_labels = len(self.i_labels)
+        if header["i_labels"] != self.i_labels:
+            logging.warning("The users in " + model_file + " are not the users in the database, the model is not loaded.")
+            return False
+        if [arrays[name].shape for name in self.node_names[2:]] != [(num_labels, n_states) for n_states in self.getNumStates()]:
+            logging.warning("The states of the nodes in " + model_file + " are not the states of the network, the model is not loaded.")
+            return False
+        self.checkModelHeader(header, model_file)
+        self.r_bn = gum.BayesNet('RecogniserBN')
+        self.addNodes()
+        self.addArcs()
+        self.prior_I = np.array(arrays["prior_I"], dtype=float)
+        face_likelihood = SparseFaceLikelihood(self.face_likelihood_max_entries)
+        face_likelihood.setSparse(arrays["F_diagonal"], arrays["F_background"], arrays["F_rows"], arrays["F_columns"], arrays["F_values"])
+        # the likelihood matrices of G, A, H, T are used as buffers without reading them (if model_mmap_mode is "c", the pages are read from the file when they are used, 
+        # the changes are kept in memory and the buffers are reallocated when a user is added)
+        self.likelihood_buffers = [face_likelihood] + [arrays[name].view(np.ndarray) for name in self.node_names[2:]]
+        self.likelihood_capacity = num_labels
+        self.resizeLikelihoods(num_labels)
+        # the CPTs are not written to the network yet (bn_num_people is 0)
+        self.bn_dirty_rows = set()
+        self.isPriorChanged = False
+        return True
+
+    def checkModelHeader(self, header, model_file):
+        """Warn if the model was saved with other settings (weights, thresholds and ranges of the nodes), or if the database or the recognition files are ahead of the model, 
+        e.g. if the process was killed before the queued model was written (see setWriteBehind). 
+        The model is saved during the confirmation of a recognition, so it can have learned one recognition more than num_recognitions in its header"""
+        settings = {"weights": list(self.weights), "quality_threshold": self.quality_threshold, "face_recog_threshold": self.face_recog_threshold, 
+                    "prob_threshold": self.prob_threshold, "max_threshold": self.max_threshold, 
+                    "ranges": {"A": [self.age_min, self.age_max], "H": [self.height_min, self.height_max], "T": [self.time_min, self.time_max]}}
+        for name in sorted(settings):
+            if header.get(name) != settings[name]:
+                logging.warning(model_file + " was saved with " + name + " = " + str(header.get(name)) + ", the current value " + str(settings[name]) + " is used.")
+        num_learned = header["num_recognitions"]
+        if self.num_recognitions == num_learned and header["occurrences"] != self.occurrences:
+            logging.warning("The occurrences of the users in " + model_file + " are not the occurrences in " + self.db_file + ".")
+        for recog_file, num_recognitions in [(self.db_file, self.num_recognitions), (self.comparison_file, self.getNumRecogRecords(self.comparison_file, RecognitionLog.COMPARISON))]:
+            if num_recognitions > num_learned + 1:
+                logging.warning("At least " + str(num_recognitions - num_learned - 1) + " of the recognitions in " + recog_file + " are not learned in " + model_file 
+                                + ", use learnFromFile to learn the network from the recognition files.")
+
+    def getBNSnapshot(self):
+        """Get the network to save: a copy of the network if the files are written in the background (see setWriteBehind), the network itself otherwise"""
+        if self.persistence_queue is None:
+            return self.r_bn
+        return gum.BayesNet(self.r_bn)
+            
+    def writeBN(self, bn, recog_file):
+        """Write the network to a temporary file which is renamed to recog_file, so that recog_file is never a partially written network"""
+        root, ext = os.path.splitext(recog_file)
+        tmp_file = root + ".tmp" + ext
+        gum.saveBN(bn, tmp_file)
+        renameFile(tmp_file, recog_file)
+        
+    def writeTextFile(self, file_name, text):
+        """Write the text to a temporary file which is renamed to file_name"""
+        tmp_file = file_name + ".tmp"
+        with open(tmp_file, mode='w') as f:
+            f.write(text)
+        renameFile(tmp_file, file_name)
+        
+    def persist(self, func, args, key = None):
+        """Apply the file write func(*args) in the write-behind queue if it is set (see setWriteBehind), otherwise immediately. 
+        The arguments should be a snapshot of the state to write"""
+        if self.persistence_queue is None:
+            func(*args)
+        else:
+            self.persistence_queue.put(func, args, key)
+            
+    def persistDB(self, func, args, db_file = None):
+        """Apply the write func(*args) of the user database (see persist). In the write-behind queue, db.csv is exported from the SQLite user database after the queued writes"""
+        self.persist(func, args)
+        if self.persistence_queue is not None and self.isUserStoreSQLite:
+            if db_file is None:
+                db_file = self.db_file
+            self.persist(self.getUserStore(db_file).exportToCSV, (db_file,), key = ("DB", db_file))
+    
+    def flush(self):
+        """Wait until the queued file writes are applied (see setWriteBehind)"""
+        if self.persistence_queue is not None:
+            self.persistence_queue.flush()
 
     def loadVariables(self):
-        """Load variables of the network to self.I, self.F, etc. Get their IDs into node_ids. Load the likelihoods into cpt_matrix (for faster execution)"""
+        """Load variables of the network to self.I, self.F, etc. Get their IDs into node_ids. Load the prior and the likelihoods into prior_I and likelihoods (for faster execution)"""
         self.I = self.r_bn.idFromName("I")
         self.F = self.r_bn.idFromName("F")
         self.G = self.r_bn.idFromName("G")
@@ -453,13 +720,12 @@ class RecogniserBN:
 # #         self.L = self.r_bn.idFromName("L")
         
         self.node_ids = {"I": self.I, "F": self.F, "G": self.G, "A": self.A, "H": self.H, "T": self.T}
-        self.cpt_matrix = []
-        for counter in range(0, len(self.i_labels)):
-            person_cpts = []
-            for name_param in self.node_names[1:]:
-                id_v = self.node_ids[name_param]
-                person_cpts.append(self.r_bn.cpt(id_v)[{'I':counter}])
-            self.cpt_matrix.append(person_cpts)
+        self.prior_I = np.array(self.r_bn.cpt(self.I)[:], dtype=float)
+        self.resizeLikelihoods(len(self.i_labels))
+        self.likelihoods[0].setMatrix(self.r_bn.cpt(self.F)[:])
+        for counter in range(1, len(self.node_names) - 1):
+            self.likelihoods[counter][:] = self.r_bn.cpt(self.node_ids[self.node_names[counter + 1]])[:]
+        self.setBNSynced()
 
     def clearDB(self):
         """Clear dabatase and return the old database if exists"""
@@ -487,6 +753,7 @@ class RecogniserBN:
         self.times =[]       
         self.occurrences = []
         self.num_people = 0
+        self.updateLabelIndex()
         if not self.isSaveRecogFiles:
             self.addUnknown()
             self.num_people = len(self.i_labels)
@@ -500,27 +767,27 @@ class RecogniserBN:
 #         self.printDB()
 
     def loadDBFromCSV(self, db_file):
-        """Load db from csv file"""
-        if os.path.isfile(db_file):
-            self.db_df = pandas.read_csv(db_file, dtype={"id": object, "name": object}, converters={"times": ast.literal_eval, "occurrence": ast.literal_eval})
-            self.i_labels = self.db_df['id'].values.tolist()
-            self.names = self.db_df['name'].values.tolist()
-            self.genders = self.db_df['gender'].values.tolist()
-            if 'age' in self.db_df.columns: # for preventing compatibility issues
-                self.ages = self.db_df['age'].values.tolist()
-            elif 'birthYear' in self.db_df.columns:
+        """Load db from the user database of the csv file (see getUserStore)"""
+        if self.isDBFile(db_file):
+            db_df = self.getUserStore(db_file).getUsers()
+            self.i_labels = db_df['id'].values.tolist()
+            self.names = db_df['name'].values.tolist()
+            self.genders = db_df['gender'].values.tolist()
+            if 'age' in db_df.columns: # for preventing compatibility issues
+                self.ages = db_df['age'].values.tolist()
+            elif 'birthYear' in db_df.columns:
                 self.ages = []
-                for birth_year in self.db_df['birthYear'].values.tolist():
+                for birth_year in db_df['birthYear'].values.tolist():
                     self.ages.append(self.getAgeFromBirthYear(birth_year))
-            self.heights = self.db_df['height'].values.tolist()
+            self.heights = db_df['height'].values.tolist()
             self.times = [] 
-            ti = self.db_df['times'].values.tolist()
+            ti = db_df['times'].values.tolist()
             for t in ti:
                 times_users = []
                 for tt in t:
                     times_users.append(tt[:2])
                 self.times.append(times_users)
-            self.occurrences = self.db_df['occurrence'].values.tolist() #[num_occurrence, num_images_for_registering, num_total_images]
+            self.occurrences = db_df['occurrence'].values.tolist() #[num_occurrence, num_images_for_registering, num_total_images]
         
         self.addUnknown()
         
@@ -552,8 +819,7 @@ class RecogniserBN:
     def updateDB(self, db_file, p_id):
         """Update the occurrence of user in db"""
         if self.isDBinCSV:
-            self.db_df.loc[self.db_df['id'] == p_id, 'occurrence'] = str(self.occurrences[self.i_labels.index(p_id)])
-            self.db_df.to_csv(db_file, index=False)
+            self.persistDB(self.getUserStore(db_file).updateOccurrence, (p_id, list(self.occurrences[self.getLabelIndex(p_id)])), db_file)
         else:
             # TODO: fill it here if not using CSV (we suggest CSV for ease of data manipulation and collection)
             pass
@@ -605,6 +871,7 @@ class RecogniserBN:
         self.T = self.r_bn.add(self.time_node)
         
         self.node_ids = {"I": self.I, "F": self.F, "G": self.G, "A": self.A, "H": self.H, "T": self.T}
+        self.bn_num_people = 0 # CPTs are not written yet
 #         gnb.showBN(self.r_bn)
         
 # # #         # Location node
@@ -627,16 +894,17 @@ class RecogniserBN:
         
     def addCpts(self):
         """Initialise likelihoods for unknown state and the remaining users"""
-        self.cpt_matrix = []
+        self.resizeLikelihoods(len(self.i_labels))
         # P(I)
-        self.r_bn.cpt(self.I)[:] = self.updatePriorI()
-        index_unknown = self.i_labels.index(self.unknown_var)
+        self.setPriorI(self.updatePriorI())
+        index_unknown = self.getLabelIndex(self.unknown_var)
         # P(F|I), P(G|I), P(A|I), P(H|I), P(T|I)
         for counter in range(0, len(self.i_labels)):
             if counter == index_unknown:
-                self.addUnknownLikelihood(self.r_bn)
+                self.addUnknownLikelihood()
             else:
                 self.addLikelihoods(counter)
+        self.syncBN()
           
     def addLikelihoods(self, p_index):
         """Initialise likelihoods for users (NOT for unknown): 
@@ -653,7 +921,6 @@ class RecogniserBN:
         The normalisation method is "norm-sum" for all parameters for initialisation.
         """
         
-        person_cpt_list = []
         # P(F|I)  
 
 #         li_f = [ self.applyWeight(self.init_min_threshold,self.weights[0]) for x in range(0, len(self.i_labels))]
@@ -665,9 +932,7 @@ class RecogniserBN:
         li_f[p_index] = self.applyWeight(self.face_recognition_rate, self.weights[0])
         
         li_f = self.normaliseSum(li_f)
-        # what it does: self.r_bn.cpt(self.I)[{'F':0}]=1 SAME THING AS: self.r_bn.cpt(self.I)[{'F':self.unknown_var}]=[0.5,0.5]
-        self.r_bn.cpt(self.F)[{'I':self.i_labels[p_index]}] = li_f[:]
-        person_cpt_list.append(li_f[:])
+        self.setLikelihood(p_index, 0, li_f)
         
         # P(G|I)  
 #         li_g = [self.applyWeight(self.init_min_threshold, self.weights[1]), self.applyWeight(self.init_min_threshold, self.weights[1])]
@@ -682,18 +947,15 @@ class RecogniserBN:
         else:
             li_g[1] = self.applyWeight(self.gender_recognition_rate, self.weights[1])
         li_g = self.normaliseSum(li_g)
-        self.r_bn.cpt(self.G)[{'I':self.i_labels[p_index]}] = li_g[:]
-        person_cpt_list.append(li_g[:])
+        self.setLikelihood(p_index, 1, li_g)
         
         # P(A|I)      
         age_curve_pdf = self.getCurve(mean = self.ages[p_index], stddev = self.stddev_age, min_value = self.age_min, max_value = self.age_max, weight = self.weights[2], norm_method = "norm-sum")
-        self.r_bn.cpt(self.A)[{'I':self.i_labels[p_index]}] = age_curve_pdf[:]
-        person_cpt_list.append(age_curve_pdf[:])
+        self.setLikelihood(p_index, 2, age_curve_pdf)
         
         # P(H|I)        
         height_curve_pdf = self.getCurve(mean = self.heights[p_index], stddev = self.stddev_height, min_value = self.height_min, max_value = self.height_max, weight = self.weights[3], norm_method = "norm-sum")
-        self.r_bn.cpt(self.H)[{'I':self.i_labels[p_index]}] = height_curve_pdf[:]
-        person_cpt_list.append(height_curve_pdf[:])
+        self.setLikelihood(p_index, 3, height_curve_pdf)
         
         # P(T|I)
         time_curve_total_pdf = []
@@ -705,9 +967,7 @@ class RecogniserBN:
                 time_curve_total_pdf = [x + y for x, y in zip(time_curve_total_pdf, time_curve_pdf)]
                 
         time_curve_total_pdf = self.normaliseSum(time_curve_total_pdf)
-        self.r_bn.cpt(self.T)[{'I':self.i_labels[p_index]}] = time_curve_total_pdf[:]
-        person_cpt_list.append(time_curve_total_pdf[:])
-        self.cpt_matrix.append(person_cpt_list)
+        self.setLikelihood(p_index, 4, time_curve_total_pdf)
 
     def addUnknown(self):
         """Add values for unknown state in the database: (the values do not represent anything)
@@ -716,6 +976,7 @@ class RecogniserBN:
         """
         
         self.i_labels.insert(0, self.unknown_var)
+        self.updateLabelIndex()
         self.names.insert(0, "unknown")
         self.genders.insert(0, "not-known")
         self.ages.insert(0, 35)
@@ -732,16 +993,26 @@ class RecogniserBN:
                 count_unknown += 1
                 count_unknown_images += self.occurrences[i][1]
         self.occurrences.insert(0,[count_unknown, 0, count_unknown_images])
+        
+    def updateLabelIndex(self):
+        """Rebuild the index of the IDs in i_labels (call after i_labels is changed other than appending with updateData)"""
+        self.i_labels_index = dict((label, counter) for counter, label in enumerate(self.i_labels))
+        self.face_scores_cache = {}
+        
+    def getLabelIndex(self, p_id):
+        """Get the index of the user ID in i_labels in O(1) (raises ValueError if the user is not in the database, as i_labels.index)"""
+        try:
+            return self.i_labels_index[p_id]
+        except KeyError:
+            raise ValueError(str(p_id) + " is not in i_labels")
              
-    def addUnknownLikelihood(self, bn):
-        """Add likelihoods for unknown state. P(F=f|I='0') is set in the way that is used for the other states.
+    def addUnknownLikelihood(self, isFaceAdded = True):
+        """Add likelihoods for unknown state. P(F=f|I='0') is set in the way that is used for the other states (if isFaceAdded).
         P(G=g|I='0') = 0.5 (equally likely to be Female or Male)
         P(A=a|I='0'),P(H=h|I='0'), P(T=t|I='0') have uniform distributions.
         """
         
-        person_cpt_list = []
-        
-        counter = self.i_labels.index(self.unknown_var)
+        counter = self.getLabelIndex(self.unknown_var)
 
         # DONT USE THIS (0.5 FOR UNKNOWN, 0.5/(1-num_people) FOR THE REST)! IT MAKES FAR (FALSE ALARM RATE) WORSE
         # gives higher false positive! use the other one instead
@@ -749,33 +1020,27 @@ class RecogniserBN:
 #         li_f_unnorm[counter] = self.applyWeight(0.5, self.weights[0])
 
         # P(F|I) same way as the likelihoods for other states 
-        li_f_unnorm = [self.applyWeight((1 - self.face_recognition_rate)/(len(self.i_labels)-1),self.weights[0]) for x in range(0, len(self.i_labels))]
-        li_f_unnorm[counter] = self.applyWeight(self.face_recognition_rate, self.weights[0])
-        li_f = self.normaliseSum(li_f_unnorm)
-        bn.cpt(self.F)[{'I':self.unknown_var}] = li_f[:]
-        person_cpt_list.append(li_f[:])
+        if isFaceAdded:
+            li_f_unnorm = [self.applyWeight((1 - self.face_recognition_rate)/(len(self.i_labels)-1),self.weights[0]) for x in range(0, len(self.i_labels))]
+            li_f_unnorm[counter] = self.applyWeight(self.face_recognition_rate, self.weights[0])
+            li_f = self.normaliseSum(li_f_unnorm)
+            self.setLikelihood(counter, 0, li_f)
         
         # P(G|I) : Equally likely to be male or female
         li_g = [0.5, 0.5]
-        bn.cpt(self.G)[{'I':self.unknown_var}] = li_g[:]
-        person_cpt_list.append(li_g[:])
+        self.setLikelihood(counter, 1, li_g)
             
         # P(A|I) : Uniform distribution for unknown age
         li_a = self.uniformDistribution(self.age_min, self.age_max)
-        bn.cpt(self.A)[{'I':self.unknown_var}] = li_a[:]
-        person_cpt_list.append(li_a[:])
+        self.setLikelihood(counter, 2, li_a)
         
         # P(H|I) : Uniform distribution for unknown height
         li_h = self.uniformDistribution(self.height_min, self.height_max)
-        bn.cpt(self.H)[{'I':self.unknown_var}] = li_h[:]
-        person_cpt_list.append(li_h[:])
+        self.setLikelihood(counter, 3, li_h)
         
         # P(T|I) : Uniform distribution for any time  
         li_t = self.uniformDistribution(self.time_min, self.time_max)
-        bn.cpt(self.T)[{'I':self.unknown_var}] = li_t[:]
-        person_cpt_list.append(li_t[:])
-        
-        self.cpt_matrix.append(person_cpt_list)
+        self.setLikelihood(counter, 4, li_t)
 
     #---------------------------------------------UPDATE NODES/LIKELIHOODS ---------------------------------------------# 
 
@@ -788,7 +1053,7 @@ class RecogniserBN:
         if not self.isBNLoaded:            
             self.loadBN(self.recog_file, self.recogniser_csv_file, self.initial_recognition_file)
 
-        if person[0] in self.i_labels:
+        if person[0] in self.i_labels_index:
             logging.debug("The user is already in the database.")
         else:
             start_time_update_data = time.time()
@@ -809,7 +1074,7 @@ class RecogniserBN:
             self.addCpts()
         elif self.num_people > 2:
             start_add_person_to_nodes = time.time()
-            if self.r_bn.variableFromName("I").toLabelizedVar().isLabel(person[0]):
+            if len(self.likelihoods[0]) == len(self.i_labels):
                 logging.debug("The user is already in the network.")
             else:
                 mid_add_person_to_nodes = time.time()
@@ -825,6 +1090,8 @@ class RecogniserBN:
         """
         
         self.i_labels.append(str(person[0]))
+        self.i_labels_index[self.i_labels[-1]] = len(self.i_labels) - 1
+        self.face_scores_cache = {}
         self.names.append(str(person[1]))
         self.genders.append(person[2])
         if person[3] > 1900: # if is birthyear
@@ -849,88 +1116,188 @@ class RecogniserBN:
 
     def updateNodes(self, p_id):
         """Call the function when a new person added is to the db
-        CPT is a property of the BN and not the variable, therefore, 
-        to add a new state to a node, it is necessary to copy the previous CPT,
-        change it accordingly, 
-        erase the nodes F and I, add a new state to F and I to recreate them, 
-        add the changed node back to the BN, add the arcs, and add the changed CPT to it
-        change the CPT of the child nodes
+        A row and a column are appended to the face likelihood matrix, and a row to the other likelihood matrices 
+        (amortised O(num_people) with the capacity doubling of the buffers, see resizeLikelihoods).
+        The face likelihoods of the previous users are updated for the new state, the likelihoods of the new user are added,
+        and P(I) is updated. The nodes I and F in the network are recreated lazily in syncBN, when the network is needed (e.g. saving the network).
         """
         
-        prev_face_recog_rate = self.face_recognition_rate
-        
-#         init_I_priors = self.r_bn.cpt(self.I)[:]
-
-        # Erase I and F
-        self.r_bn.erase(self.I)
-        self.r_bn.erase(self.F)        
-        
-        # Change and add nodes
-        # Face node
-        self.face_node = gum.LabelizedVariable("F","Face",0)
-
-        for counter in range(0, len(self.i_labels)):
-            self.face_node.addLabel(self.i_labels[counter]) 
-        self.F = self.r_bn.add(self.face_node)
-        self.node_ids["F"] = self.F
-        # Identity node
-        self.identity_node = gum.LabelizedVariable("I","Identity",0)
-        for counter in range(0, len(self.i_labels)):
-            self.identity_node.addLabel(self.i_labels[counter])       
-        self.I = self.r_bn.add(self.identity_node)        
-        self.node_ids["I"] = self.I
-        
-        self.addArcs()
+        num_labels = len(self.i_labels)
+        num_prev = num_labels - 1
+        self.resizeLikelihoods(num_labels)
+        self.updateFaceLikelihoods(num_labels)
         
-        # Change CPT
-        updated_cpt_I = []
+        self.addLikelihoods(num_prev)
         
-        # copy previous likelihoods back into the network for G, A, H, and T
-        self.r_bn.cpt(self.G)[:-1] = [i[1] for i in self.cpt_matrix]
-        self.r_bn.cpt(self.A)[:-1] = [i[2] for i in self.cpt_matrix]
-        self.r_bn.cpt(self.H)[:-1] = [i[3] for i in self.cpt_matrix]
-        self.r_bn.cpt(self.T)[:-1] = [i[4] for i in self.cpt_matrix]
+        # update P(I)
+        self.setPriorI(self.updatePriorI())
+#         self.setPriorI(self.updatePriorI(p_id, init_I_priors))
 
-        for counter in range(0, len(self.i_labels)):
-            if counter < len(self.i_labels) - 1:
-                if self.isUpdateFaceLikelihoodsEqually and ((self.update_prob_unknown_method == "none" and counter == self.i_labels.index(self.unknown_var)) or self.update_prob_method == "none" or (self.update_partial_params is not None and "F" not in self.update_partial_params)):
-                    # THIS UPDATES ALL LIKELIHOODS TO BE (IF NO ONLINE LEARNING):  
-                    # P(F=f|I=i) = face_recognition_rate^weight_F if f=i, P(F=f|I=i) = ((1 - face_recognition_rate)/(num_people-1))^weight_F  if f!=i
-                    # BUT IT DOESN'T PERFORM AS GOOD AS UPDATING AS IN 'ELSE' CONDITION
-                    self.cpt_matrix[counter][0] = self.getEqualFaceLikelihoods(counter)
-                elif not self.isUpdateFaceLikelihoodsEqually and ((self.update_prob_unknown_method == "none" or self.update_prob_method == "none") and counter == self.i_labels.index(self.unknown_var)):
-                    # UPDATES ONLY UNKNOWN LIKELIHOOD TO BE (IF NO ONLINE LEARNING):  
-                    # P(F=f|I=i) = face_recognition_rate^weight_F if f=i, P(F=f|I=i) = ((1 - face_recognition_rate)/(num_people-1))^weight_F  if f!=i
-                    self.cpt_matrix[counter][0] = self.getEqualFaceLikelihoods(counter)
+    def updateFaceLikelihoods(self, num_labels, num_rows = None):
+        """Update the face likelihoods of the first num_rows users (all the previous users by default) for the new state of the user num_labels-1 (see updateNodes)"""
+        prev_face_recog_rate = self.face_recognition_rate
+        num_prev = num_labels - 1
+        if num_rows is None:
+            num_rows = num_prev
+        li_f = self.likelihoods[0]
+        
+        index_unknown = self.getLabelIndex(self.unknown_var)
+        if self.journal_entry is not None:
+            self.journalRows(range(0, num_rows), 0)
+        if self.isUpdateFaceLikelihoodsEqually and (self.update_prob_method == "none" or (self.update_partial_params is not None and "F" not in self.update_partial_params)):
+            # THIS UPDATES ALL LIKELIHOODS TO BE (IF NO ONLINE LEARNING):  
+            # P(F=f|I=i) = face_recognition_rate^weight_F if f=i, P(F=f|I=i) = ((1 - face_recognition_rate)/(num_people-1))^weight_F  if f!=i
+            # BUT IT DOESN'T PERFORM AS GOOD AS UPDATING AS IN 'ELSE' CONDITION
+            equal_rows = np.arange(num_rows)
+        elif (self.isUpdateFaceLikelihoodsEqually and self.update_prob_unknown_method == "none") or \
+                (not self.isUpdateFaceLikelihoodsEqually and (self.update_prob_unknown_method == "none" or self.update_prob_method == "none")):
+            # UPDATES ONLY UNKNOWN LIKELIHOOD TO BE (IF NO ONLINE LEARNING):  
+            # P(F=f|I=i) = face_recognition_rate^weight_F if f=i, P(F=f|I=i) = ((1 - face_recognition_rate)/(num_people-1))^weight_F  if f!=i
+            equal_rows = np.array([index_unknown]) if index_unknown < num_rows else np.array([], dtype=int)
+        else:
+            equal_rows = np.array([], dtype=int)
+        
+        if len(equal_rows) > 0:
+            off_value = self.applyWeight((1 - self.face_recognition_rate)/(num_labels-1),self.weights[0])
+            diag_value = self.applyWeight(self.face_recognition_rate, self.weights[0])
+            sum_row = off_value*(num_labels - 1) + diag_value
+            li_f.setRows(equal_rows, diag_value/sum_row, off_value/sum_row)
+        
+        update_rows = np.setdiff1d(np.arange(num_rows), equal_rows)
+        if len(update_rows) > 0:
+            occurrences = np.array([self.occurrences[counter] for counter in update_rows])
+            isNeverSeen = occurrences[:,0] == 0
+            # If the user is never seen before, update the likelihood of that user to =(1-face_recognition_rate)/(num-people-1)
+            # if the user is previously seen, then update the likelihoods by computing the original likelihood by multiplying with occurrence 
+            # and then adding the new user likelihood, then normalising. 
+            # i.e. P(F=f|I=i)_total = [P(F=f|I=i)*num_occurrence(f)].append(1-face_recognition_rate)/(num_people-1)) and normalise 
+            if self.update_prob_method == "avg":
+                occur = occurrences[:,0] + 1
+            else: #self.update_prob_method == "sum" or self.update_prob_method == "evidence" or self.update_prob_method == "none":
+                occur = occurrences[:,2] + 1
+            occur = np.where(isNeverSeen, 1, occur)
+            
+            new_value = (1-self.face_recognition_rate)/(num_labels-1)
+            li_f.replaceValue(update_rows[isNeverSeen], (1-prev_face_recog_rate)/(num_labels-2), new_value)
+            li_f.appendToRows(update_rows, occur, new_value)
+            
+    def importUsers(self, persons, recognitions = None, isSaveDB = True):
+        """
+        Add the users to the database and the network at once (e.g. the roster of a new deployment), instead of calling addPersonToBN for each user,
+        and learn from their previous recognitions (the rows of RecogniserBN.csv, see learnFromRecognitions). 
+        persons is a list of users in the format of addPersonToBN (e.g. [["1", "Jane", "Female", 26, 175, [["11:00:00", 1]]], ...]).
+        The face likelihoods of the previous users are updated for each new user as in updateNodes, and the likelihoods of the new users are initialised 
+        for all the users in one pass (see addLikelihoodsBatch). If the face weight is not 1, the face likelihoods are initialised one user at a time 
+        as in addPersonToBN (see addFaceLikelihoodsSequentially), so the network is the same as adding the users one by one. The database is written and the network is saved once.
+        The import is not recorded in the journal. Returns the number of users that are added.
+        """
+        if not self.isBNLoaded:
+            self.loadBN(self.recog_file, self.recogniser_csv_file, self.initial_recognition_file)
+        num_prev = len(self.i_labels)
+        new_persons = []
+        for person in persons:
+            if str(person[0]) in self.i_labels_index:
+                logging.debug("The user " + str(person[0]) + " is already in the database.")
+            else:
+                self.updateData(person)
+                new_persons.append(person)
+        num_labels = len(self.i_labels)
+        
+        if self.num_people > 1 and num_labels > num_prev:
+            if self.r_bn is None:
+                # the network is created with the nodes of all the users, the CPTs are written when it is needed (see syncBN)
+                self.r_bn = gum.BayesNet('RecogniserBN')
+                self.addNodes()
+                self.addArcs()
+                num_prev = 0
+            if self.weights[0] == 1:
+                # the face likelihoods of the new users are the same as adding them one by one (the updates of the previous users for the new states 
+                # assume the unweighted values, see updateFaceLikelihoods), so they are initialised at once for all the users
+                if num_prev == 0:
+                    self.resizeLikelihoods(num_labels)
                 else:
-                    # If the user is never seen before, update the likelihood of that user to =(1-face_recognition_rate)/(num-people-1)
-                    if self.occurrences[counter][0] == 0:
-                        for ff in range(0, len(self.i_labels)-1):
-                            if np.isclose(self.cpt_matrix[counter][0][ff], (1-prev_face_recog_rate)/(len(self.i_labels)-2)):
-                                self.cpt_matrix[counter][0][ff] = (1-self.face_recognition_rate)/(len(self.i_labels)-1)
-                        updated_cpt_F = self.cpt_matrix[counter][0][:]
-                    else:
-                        # if the user is previously seen, then update the likelihoods by computing the original likelihood by multiplying with occurrence 
-                        # and then adding the new user likelihood, then normalising. 
-                        # i.e. P(F=f|I=i)_total = [P(F=f|I=i)*num_occurrence(f)].append(1-face_recognition_rate)/(num_people-1)) and normalise 
-                        
-                        if self.update_prob_method == "avg":
-                            occur = self.occurrences[counter][0] + 1
-                        else: #self.update_prob_method == "sum" or self.update_prob_method == "evidence" or self.update_prob_method == "none":
-                            occur = self.occurrences[counter][2] + 1
-    
-                        updated_cpt_F = [i*occur for i in self.cpt_matrix[counter][0] ]
-                    updated_cpt_F = np.append(updated_cpt_F, [(1-self.face_recognition_rate)/(len(self.i_labels)-1)]) 
-                    updated_cpt_F = self.normaliseSum(updated_cpt_F)
-                    self.cpt_matrix[counter][0] = updated_cpt_F[:]
+                    for num_added in range(num_prev + 1, num_labels + 1):
+                        self.resizeLikelihoods(num_added)
+                        self.updateFaceLikelihoods(num_added, num_prev)
+                self.addLikelihoodsBatch(range(num_prev, num_labels))
             else:
-                self.addLikelihoods(counter)
-        self.r_bn.cpt(self.F)[:] = [i[0] for i in self.cpt_matrix]
-        
-        # update P(I)
-        self.r_bn.cpt(self.I)[:] = self.updatePriorI()
-#         self.r_bn.cpt(self.I)[:] = self.updatePriorI(p_id, init_I_priors)
-
+                self.addFaceLikelihoodsSequentially(num_prev, num_labels)
+                self.addLikelihoodsBatch(range(num_prev, num_labels), isFaceAdded = False)
+            
+        learned_users = set()
+        if recognitions is not None and self.likelihoods is not None:
+            learned_users = self.learnFromRecognitions(recognitions)
+        if self.r_bn is not None:
+            self.setPriorI(self.updatePriorI())
+        
+        if self.isDBinCSV and self.isSaveRecogFiles:
+            if isSaveDB and new_persons:
+                self.persistDB(self.getUserStore(self.db_file).addUsers, (copy.deepcopy(new_persons), [list(self.occurrences[self.getLabelIndex(str(person[0]))]) for person in new_persons]))
+            for p_index in sorted(learned_users):
+                if p_index < len(self.i_labels) - len(new_persons):
+                    self.updateDB(self.db_file, self.i_labels[p_index])
+            if self.r_bn is not None:
+                self.persistBN(self.recog_file)
+        return len(new_persons)
+    
+    def addLikelihoodsBatch(self, p_indices, isFaceAdded = True):
+        """Initialise the likelihoods of the users in p_indices at once, as addLikelihoods (and addUnknownLikelihood for the unknown state) for each user 
+        with the number of users in i_labels. The curves of A, H and T are computed once for each distinct value (see getCurves). 
+        If not isFaceAdded, the face likelihoods are not changed (see addFaceLikelihoodsSequentially)"""
+        index_unknown = self.getLabelIndex(self.unknown_var)
+        if index_unknown in p_indices:
+            self.addUnknownLikelihood(isFaceAdded)
+        rows = np.array([p_index for p_index in p_indices if p_index != index_unknown], dtype=int)
+        if len(rows) == 0:
+            return
+        if isFaceAdded:
+            self.likelihoods[0].setRows(rows, *self.getInitialFaceLikelihood(len(self.i_labels), self.weights[0]))
+        for counter in range(1, len(self.likelihoods)):
+            self.likelihoods[counter][rows] = self.getInitialLikelihoods(counter, rows, self.weights[counter])
+        
+        self.bn_dirty_rows.update(rows.tolist())
+        if self.analysis_log is not None:
+            self.analysis_log.dirty_rows.update(rows.tolist())
+
+    def addFaceLikelihoodsSequentially(self, num_prev, num_labels):
+        """Initialise the face likelihoods of the users from num_prev to num_labels-1 one by one, as addPersonToBN (addCpts for the unknown state and the first user, 
+        then updateNodes): the face likelihoods of the previous users are updated for each new user (see updateFaceLikelihoods) and the likelihood 
+        of the new user is initialised with the number of users at that time. Used instead of the closed form when the face weight is not 1"""
+        if num_prev < 2:
+            self.resizeLikelihoods(2)
+            self.likelihoods[0].setRows(np.arange(num_prev, 2), *self.getInitialFaceLikelihood(2, self.weights[0]))
+            num_prev = 2
+        for num_added in range(num_prev + 1, num_labels + 1):
+            self.resizeLikelihoods(num_added)
+            self.updateFaceLikelihoods(num_added)
+            self.likelihoods[0].setRows(np.array([num_added - 1]), *self.getInitialFaceLikelihood(num_added, self.weights[0]))
+
+    def getInitialFaceLikelihood(self, num_labels, weight):
+        """Get P(F=i|I=i) and P(F=f|I=i) for f != i of the initialised face likelihoods (see addLikelihoods) for num_labels users with the weight"""
+        off_value = self.applyWeight((1 - self.face_recognition_rate)/(num_labels-1), weight)
+        diag_value = self.applyWeight(self.face_recognition_rate, weight)
+        sum_row = off_value*(num_labels - 1) + diag_value
+        return diag_value/sum_row, off_value/sum_row
+    
+    def getInitialLikelihoods(self, counter, rows, weight):
+        """Get the initialised likelihoods (see addLikelihoods) of the users in rows (NOT unknown) with the weight as a matrix (number of users x number of states), 
+        for G, A, H or T (counter: 1 for G, 2 for A, 3 for H, 4 for T)"""
+        if counter == 1:
+            # P(G|I)
+            li_g = self.normaliseSum([self.applyWeight(self.gender_recognition_rate, weight), self.applyWeight(1 - self.gender_recognition_rate, weight)])
+            isFirstGender = np.array([self.genders[p_index] == self.g_labels[0] for p_index in rows])
+            return np.where(isFirstGender[:, np.newaxis], li_g, li_g[::-1])
+        elif counter == 2:
+            # P(A|I)
+            return self.getCurves([self.ages[p_index] for p_index in rows], self.stddev_age, self.age_min, self.age_max, weight)
+        elif counter == 3:
+            # P(H|I)
+            return self.getCurves([self.heights[p_index] for p_index in rows], self.stddev_height, self.height_min, self.height_max, weight)
+        # P(T|I): sum of the curves of the times of the user
+        num_times = [len(self.times[p_index]) for p_index in rows]
+        time_curves = self.getCurves([self.getTimeSlot(p_time) for p_index in rows for p_time in self.times[p_index]], self.stddev_time, self.time_min, self.time_max, weight)
+        time_curves = np.add.reduceat(time_curves, np.cumsum([0] + num_times[:-1]), axis=0)
+        return time_curves/np.sum(time_curves, axis=1)[:, np.newaxis]
                     
     def updatePriorI(self, p_id = None, ie = None):
         """
@@ -963,7 +1330,7 @@ class RecogniserBN:
                         prob_values[i_count] = self.init_min_threshold
             prob_values = [i/float(self.num_recognitions) for i in prob_values]
         else:
-            index_name = self.i_labels.index(p_id)
+            index_name = self.getLabelIndex(p_id)
             if sum(prob_values) == 0:
                 prob_values = [self.init_min_threshold for i in range(0,len(self.i_labels))]
                 prob_values[index_name] = 1
@@ -1002,6 +1369,118 @@ class RecogniserBN:
 
         norm_li_f = self.normaliseSum(li_f)
         return norm_li_f
+
+    def setPriorI(self, prior):
+        """Set P(I) in prior_I (written to the network in syncBN)"""
+        self.prior_I = np.array(prior, dtype=float)
+        self.isPriorChanged = True
+        if self.analysis_log is not None:
+            self.analysis_log.isPriorChanged = True
+
+    def setLikelihood(self, p_index, counter, values):
+        """Set the likelihood of the parameter (counter: 0 for F, 1 for G, 2 for A, 3 for H, 4 for T) for user in p_index (written to the network in syncBN)"""
+        if self.journal_entry is not None:
+            self.journalRows([p_index], counter)
+        self.likelihoods[counter][p_index] = values
+        self.bn_dirty_rows.add(p_index)
+        if self.analysis_log is not None:
+            self.analysis_log.dirty_rows.add(p_index)
+
+    def getLikelihoodMatrix(self, counter):
+        """Get the likelihood matrix of the parameter (counter: 0 for F, 1 for G, 2 for A, 3 for H, 4 for T) as a dense array (num_people x num_states)"""
+        if isinstance(self.likelihoods[counter], SparseFaceLikelihood):
+            return self.likelihoods[counter].toarray()
+        return self.likelihoods[counter]
+    
+    def dotLikelihood(self, counter, evidence):
+        """Get sum_x P(X=x|I=i) * e(x) for each user i, for evidence of a parameter (counter: 0 for F, 1 for G, 2 for A, 3 for H, 4 for T) 
+        with shape (num_states) or (num_evidence x num_states)"""
+        if isinstance(self.likelihoods[counter], SparseFaceLikelihood):
+            return self.likelihoods[counter].dot(evidence)
+        return np.dot(evidence, self.likelihoods[counter].T)
+    
+    def marginaliseLikelihood(self, counter, post_I):
+        """Get sum_i P(X=x|I=i) * P(I=i) for each state x of a parameter (counter: 0 for F, 1 for G, 2 for A, 3 for H, 4 for T) for the distribution of I"""
+        if isinstance(self.likelihoods[counter], SparseFaceLikelihood):
+            return self.likelihoods[counter].marginalise(post_I)
+        return np.dot(post_I, self.likelihoods[counter])
+
+    def getNumStates(self):
+        """Get the number of states of G, A, H, T"""
+        return [len(self.g_labels), self.age_max - self.age_min + 1, self.height_max - self.height_min + 1, self.time_max - self.time_min + 1]
+
+    def resizeLikelihoods(self, num_labels):
+        """Resize the likelihood matrices to num_labels users. The buffers are reallocated (with double capacity) only when they are full, 
+        so adding a user costs amortised O(num_people). The face likelihood is sparse (see SparseFaceLikelihood)"""
+        num_states = self.getNumStates()
+        if self.likelihood_buffers is None:
+            self.likelihood_buffers = [SparseFaceLikelihood(self.face_likelihood_max_entries)] + [np.zeros((0, n_states)) for n_states in num_states]
+            self.likelihood_capacity = 0
+        num_prev = len(self.likelihood_buffers[0])
+        if num_labels > self.likelihood_capacity:
+            capacity = max(num_labels, 2*self.likelihood_capacity, 4)
+            buffers = [np.zeros((capacity, n_states)) for n_states in num_states]
+            for counter in range(0, len(buffers)):
+                buffers[counter][:num_prev] = self.likelihood_buffers[counter + 1][:num_prev]
+            self.likelihood_buffers = self.likelihood_buffers[:1] + buffers
+            self.likelihood_capacity = capacity
+        elif num_labels > num_prev:
+            # clear the new rows
+            for counter in range(1, len(self.likelihood_buffers)):
+                self.likelihood_buffers[counter][num_prev:num_labels] = 0.0
+        self.likelihood_buffers[0].resize(num_labels)
+        self.likelihoods = self.likelihood_buffers[:1] + [buffer[:num_labels] for buffer in self.likelihood_buffers[1:]]
+    
+    def syncBN(self):
+        """Write P(I) and the likelihoods that are changed since the last sync into the network. If users were added since then, 
+        the nodes I and F are recreated with the new states (CPT is a property of the BN and not the variable, therefore, 
+        to add a new state to a node, the nodes F and I are erased and added back with the new states, the arcs are added, and all CPTs are written).
+        Called when the network is needed: saving the network and inference with pyAgrum"""
+        if self.r_bn is None or self.likelihoods is None:
+            return
+        num_labels = len(self.i_labels)
+        if self.bn_num_people != num_labels:
+            if self.r_bn.variable(self.I).domainSize() != num_labels:
+                # Erase I and F
+                self.r_bn.erase(self.I)
+                self.r_bn.erase(self.F)        
+                
+                # Change and add nodes
+                # Face node
+                self.face_node = gum.LabelizedVariable("F","Face",0)
+                for counter in range(0, num_labels):
+                    self.face_node.addLabel(self.i_labels[counter]) 
+                self.F = self.r_bn.add(self.face_node)
+                self.node_ids["F"] = self.F
+                # Identity node
+                self.identity_node = gum.LabelizedVariable("I","Identity",0)
+                for counter in range(0, num_labels):
+                    self.identity_node.addLabel(self.i_labels[counter])       
+                self.I = self.r_bn.add(self.identity_node)        
+                self.node_ids["I"] = self.I
+                
+                self.addArcs()
+                self.bn_version += 1
+            self.r_bn.cpt(self.I)[:] = self.prior_I
+            for counter in range(0, len(self.node_names) - 1):
+                self.r_bn.cpt(self.node_ids[self.node_names[counter + 1]])[:] = self.getLikelihoodMatrix(counter)
+        elif self.isPriorChanged or self.bn_dirty_rows:
+            if self.isPriorChanged:
+                self.r_bn.cpt(self.I)[:] = self.prior_I
+            for p_index in self.bn_dirty_rows:
+                for counter in range(0, len(self.node_names) - 1):
+                    self.r_bn.cpt(self.node_ids[self.node_names[counter + 1]])[{'I':self.i_labels[p_index]}] = self.likelihoods[counter][p_index]
+        else:
+            return
+        # the evidence is set again on agrum_ie, so that the new CPTs are used
+        self.agrum_evidence = None
+        self.setBNSynced()
+        
+    def setBNSynced(self):
+        """Mark the network as synced with prior_I and likelihoods"""
+        self.bn_num_people = len(self.i_labels)
+        self.bn_dirty_rows = set()
+        self.isPriorChanged = False
     
     #---------------------------------------------ONLINE LEARNING ---------------------------------------------# 
 
@@ -1010,15 +1489,16 @@ class RecogniserBN:
         
         if self.isMultipleRecognitions and num_mult_recognitions is None:
             num_mult_recognitions = self.num_mult_recognitions
+        p_id_index = self.getLabelIndex(p_id)
 
         if self.update_prob_method == "none":
             # if no online learning, then update the occurrences of the user only
             if not self.isMultipleRecognitions:
-                self.occurrences[self.i_labels.index(p_id)][0] += 1
-                self.occurrences[self.i_labels.index(p_id)][2] += 1                    
+                self.occurrences[p_id_index][0] += 1
+                self.occurrences[p_id_index][2] += 1                    
             elif num_recog == num_mult_recognitions -1:
-                self.occurrences[self.i_labels.index(p_id)][0] += 1
-                self.occurrences[self.i_labels.index(p_id)][2] += num_mult_recognitions
+                self.occurrences[p_id_index][0] += 1
+                self.occurrences[p_id_index][2] += num_mult_recognitions
             return
           
         if p_id == self.unknown_var:
@@ -1033,22 +1513,21 @@ class RecogniserBN:
             iter_list = self.node_names[1:]
 
         if self.update_prob_method == "evidence":
-            ie.setEvidence({"F":evidence[0], "G":evidence[1], "A":evidence[2], "H":evidence[3], "T":evidence[4], "I":p_id})
+            ie.setEvidence(self.getEvidenceDict(evidence, not isinstance(ie, ClosedFormInference), p_id))
             ie.makeInference()
 
         if self.update_I_method != "equal":
             if not self.isMultipleRecognitions:
-                self.r_bn.cpt(self.I)[:] = self.updatePriorI(p_id, ie)
+                self.setPriorI(self.updatePriorI(p_id, ie))
             elif num_recog == num_mult_recognitions -1:
-                self.r_bn.cpt(self.I)[:] = self.updatePriorI(p_id, ie)
+                self.setPriorI(self.updatePriorI(p_id, ie))
                 
-        p_id_index = self.i_labels.index(p_id)
         for name_param in iter_list:
             counter = self.node_names.index(name_param) - 1
             if self.weights[counter] > 0:
                 # there is no point in updating if weight is zero, since all values will be equal
                 if self.isMultipleRecognitions:
-                    prob_values = evidence[counter]
+                    prob_values = self.getLinearEvidence(evidence[counter])
                     if num_recog == 0 and counter == 0:
                         # reset
                         self.prev_update_prob = []
@@ -1061,36 +1540,34 @@ class RecogniserBN:
                             
                         if num_recog == num_mult_recognitions - 1:
                             id_v = self.node_ids[name_param]
-                            cpt_norm = self.cpt_matrix[p_id_index][counter][:]
-                            occur = self.occurrences[self.i_labels.index(p_id)][0] + 1
+                            cpt_norm = self.likelihoods[counter][p_id_index].tolist()
+                            occur = self.occurrences[p_id_index][0] + 1
                             cpt_unnorm = [i*occur for i in cpt_norm]
                             self.prev_update_prob[counter] = self.normaliseSum(self.prev_update_prob[counter])
                             self.prev_update_prob[counter] = list(np.add(self.prev_update_prob[counter], cpt_unnorm))
                             norm_total_prob = self.normaliseSum(self.prev_update_prob[counter])
-                            self.r_bn.cpt(id_v)[{'I':p_id}] = norm_total_prob[:] 
-                            self.cpt_matrix[p_id_index][counter] = norm_total_prob[:]
+                            self.setLikelihood(p_id_index, counter, norm_total_prob)
                             
                     elif self.update_prob_method == "sum":
                         # sum the previous likelihoods, with the current recognition values and normalise to update
                         if num_recog == 0:
                             id_v = self.node_ids[name_param]
-                            prev_prob_norm = self.cpt_matrix[p_id_index][counter][:]
-                            occur = self.occurrences[self.i_labels.index(p_id)][2] + 1
+                            prev_prob_norm = self.likelihoods[counter][p_id_index].tolist()
+                            occur = self.occurrences[p_id_index][2] + 1
                             self.prev_update_prob.append([i*occur for i in prev_prob_norm])
                         
                         self.prev_update_prob[counter] = list(np.add(self.prev_update_prob[counter], prob_values))
                         if num_recog == num_mult_recognitions -1:                        
                             norm_total_prob = self.normaliseSum(self.prev_update_prob[counter])
                             id_v = self.node_ids[name_param]
-                            self.r_bn.cpt(id_v)[{'I':p_id}] = norm_total_prob[:]   
-                            self.cpt_matrix[p_id_index][counter] = norm_total_prob[:]
+                            self.setLikelihood(p_id_index, counter, norm_total_prob)
                               
                     elif self.update_prob_method == "evidence":
                         # use the inference based on the evidence of all the recognition values and the correct identity to update the likelihoods, by summing with the previous likelihoods and normalising
                         id_v = self.node_ids[name_param]
                         if num_recog == 0:
-                            prev_prob_norm = self.cpt_matrix[p_id_index][counter][:]
-                            occur = self.occurrences[self.i_labels.index(p_id)][2] + 1
+                            prev_prob_norm = self.likelihoods[counter][p_id_index].tolist()
+                            occur = self.occurrences[p_id_index][2] + 1
                             self.prev_update_prob.append([i*occur for i in prev_prob_norm])
                         try:
                             prob_values = ie.posterior(id_v)
@@ -1102,19 +1579,18 @@ class RecogniserBN:
     
                         if num_recog == num_mult_recognitions -1:                        
                             norm_total_prob = self.normaliseSum(self.prev_update_prob[counter])
-                            self.r_bn.cpt(id_v)[{'I':p_id}] = norm_total_prob[:]     
-                            self.cpt_matrix[p_id_index][counter] = norm_total_prob[:]
+                            self.setLikelihood(p_id_index, counter, norm_total_prob)
     
                 else:
                     id_v = self.node_ids[name_param]
                     
-                    prev_prob_norm = self.cpt_matrix[p_id_index][counter][:] # faster
+                    prev_prob_norm = self.likelihoods[counter][p_id_index].tolist() # faster
                     
-                    occur = self.occurrences[self.i_labels.index(p_id)][0] + 1
+                    occur = self.occurrences[p_id_index][0] + 1
                     prev_prob = [i*occur for i in prev_prob_norm]                    
                     
                     if self.update_prob_method == "avg" or self.update_prob_method == "sum":
-                        prob_values = evidence[counter]
+                        prob_values = self.getLinearEvidence(evidence[counter])
                     elif self.update_prob_method == "evidence":
                         prob_values = ie.posterior(id_v)
 
@@ -1122,17 +1598,86 @@ class RecogniserBN:
                     
                     norm_total_prob = self.normaliseSum(total_prob)
 
-                    self.r_bn.cpt(id_v)[{"I": p_id}] = norm_total_prob[:]
-
-                    self.cpt_matrix[p_id_index][counter] = norm_total_prob[:]
+                    self.setLikelihood(p_id_index, counter, norm_total_prob)
         
         # update the occurrences such that by multiplying the previous likelihoods, we can obtain the correct overall sum of the recognitions           
         if not self.isMultipleRecognitions:
-            self.occurrences[self.i_labels.index(p_id)][0] += 1
-            self.occurrences[self.i_labels.index(p_id)][2] += 1                    
+            self.occurrences[p_id_index][0] += 1
+            self.occurrences[p_id_index][2] += 1                    
         elif num_recog == num_mult_recognitions -1:
-            self.occurrences[self.i_labels.index(p_id)][0] += 1
-            self.occurrences[self.i_labels.index(p_id)][2] += num_mult_recognitions
+            self.occurrences[p_id_index][0] += 1
+            self.occurrences[p_id_index][2] += num_mult_recognitions
+    
+    def learnFromRecognitions(self, recognitions):
+        """
+        Learn from the previous recognitions of the users in the database (e.g. the recognitions of the users in another deployment), 
+        given as the rows of RecogniserBN.csv ([I, F, G, A, H, T, R, N], e.g. from RecognitionCSV or readRecogFile). The occurrences of the users are updated, 
+        and if online learning is on (update_prob_method is not none), the likelihoods are updated as in updateProbabilities with a single image for each row 
+        (the evidence is computed with all the users in the database). The rows of each user are learned in order, and the k-th rows of all the users at once 
+        (see updateLikelihoodsBatch). The rows of the users that are not in the database are ignored. Returns the indices of the users that are learned.
+        """
+        user_rows = {}
+        num_rows = 0
+        for row in recognitions:
+            p_id = row[0]
+            if isinstance(p_id, float) and not math.isnan(p_id) and p_id.is_integer():
+                p_id = int(p_id)
+            if p_id is None or str(p_id) not in self.i_labels_index:
+                continue
+            user_rows.setdefault(self.getLabelIndex(str(p_id)), []).append(row)
+            num_rows += 1
+        
+        if self.update_prob_method == "none":
+            for p_index, rows in user_rows.iteritems():
+                self.occurrences[p_index][0] += len(rows)
+                self.occurrences[p_index][2] += len(rows)
+        else:
+            num_rounds = max([len(rows) for rows in user_rows.values()] + [0])
+            for row_counter in range(0, num_rounds):
+                p_indices = sorted(p_index for p_index, rows in user_rows.iteritems() if len(rows) > row_counter)
+                evidence_list = [self.getEvidence(user_rows[p_index][row_counter][1:6]) for p_index in p_indices]
+                self.updateLikelihoodsBatch(p_indices, evidence_list)
+                for p_index in p_indices:
+                    self.occurrences[p_index][0] += 1
+                    self.occurrences[p_index][2] += 1
+        self.num_recognitions += num_rows
+        return set(user_rows)
+    
+    def updateLikelihoodsBatch(self, p_indices, evidence_list):
+        """Online learning of the likelihoods of the users in p_indices (each user once) with the evidence of a recognition of each user (see getEvidence), 
+        as updateProbabilities with a single image, for all the users at once. The occurrences are not updated"""
+        index_unknown = self.getLabelIndex(self.unknown_var)
+        p_indices = np.array(p_indices, dtype=int)
+        occur = np.array([self.occurrences[p_index][0] for p_index in p_indices], dtype=float) + 1
+        for counter, name_param in enumerate(self.node_names[1:]):
+            if self.weights[counter] <= 0:
+                # there is no point in updating if weight is zero, since all values will be equal
+                continue
+            # only the face likelihood is learned for the unknown state, and only update_partial_params for the other users (if set)
+            isUpdated = (p_indices != index_unknown) | (name_param == self.node_names[1])
+            if self.update_partial_params is not None and name_param not in self.update_partial_params:
+                isUpdated &= p_indices == index_unknown
+            if not isUpdated.any():
+                continue
+            rows = p_indices[isUpdated]
+            evidence = np.array([evidence_list[k][counter] for k in np.nonzero(isUpdated)[0]], dtype=float)
+            prev_prob = np.array([self.likelihoods[counter][p_index] for p_index in rows], dtype=float)
+            if self.update_prob_method == "evidence":
+                # posterior of the parameter with the evidence and the hard evidence on I (see ClosedFormInference.posterior)
+                if self.isLogSpace:
+                    with np.errstate(divide='ignore'):
+                        log_post = np.log(prev_prob) + evidence
+                    prob_values = np.exp(log_post - np.max(log_post, axis=1)[:, np.newaxis])
+                else:
+                    prob_values = prev_prob * evidence
+                prob_values = prob_values/np.sum(prob_values, axis=1)[:, np.newaxis]
+            else:
+                prob_values = self.getLinearEvidence(evidence)
+            total_prob = prev_prob * occur[isUpdated][:, np.newaxis] + prob_values
+            sum_prob = np.sum(total_prob, axis=1)[:, np.newaxis]
+            total_prob = np.where(sum_prob == 0, 1.0/total_prob.shape[1], total_prob/np.where(sum_prob == 0, 1.0, sum_prob))
+            for k in range(0, len(rows)):
+                self.setLikelihood(rows[k], counter, total_prob[k])
     
     #---------------------------------------------FUNCTIONS TO SET SESSION CONSTANT/VARIABLES ---------------------------------------------# 
 
@@ -1192,7 +1737,7 @@ class RecogniserBN:
             elif identity_est == self.unknown_var:
                 textToSay = self.unknownPerson
             else:
-                identity_say = self.names[self.i_labels.index(identity_est)].split()
+                identity_say = self.names[self.getLabelIndex(identity_est)].split()
                 textToSay = self.askForIdentityConfirmal.replace("XX", str(identity_say[0]))
             if recog_results_from_file is None and self.isSpeak:
                 self.say(textToSay)
@@ -1208,7 +1753,7 @@ class RecogniserBN:
         IMPORTANT: call startRecognition before calling this function, and then ask for name from the person"""
         c_time_t = time.time()
         if self.isSaveLastFiles:
-            self.saveFilesToLastSaved() # save the current files to LastSaved folder (to recover in case of erroneous recognitions)
+            self.beginJournalEntry() # record the changes of the recognition in the journal (to recover in case of erroneous recognitions)
         name = self.setPersonIdentity(isRegistered = self.isRegistered, p_id = p_id, recog_results_from_file = recog_results_from_file, isRobotLearning=isRobotLearning)
         
         if self.isMemoryRobot:
@@ -1239,11 +1784,15 @@ class RecogniserBN:
             identity_real = self.identity_est
         else:
             identity_real = p_id
+        if self.quality_sweep_records is not None:
+            self.recordQualitySweep(identity_real)
         time_before_save = time.time()
         
         if self.isSaveRecogFiles:
             self.saveComparisonCSV(self.comparison_file, identity_real, self.identity_est, self.face_est, self.identity_est_prob, self.face_prob, calc_time, self.quality_estimate)
         self.num_recognitions += 1
+        if self.journal_entry is not None:
+            self.commitJournalEntry()
         if self.isDebugMode:
             print "time to save comparison file: " + str(time.time() - time_before_save)    
     
@@ -1299,16 +1848,14 @@ class RecogniserBN:
                     self.num_mult_recognitions = self.def_num_mult_recognitions
                     return ""
                     
-                self.recog_results_list = [i[0] for i in joint_results]
+                recog_results_list = [i[0] for i in joint_results]
                 self.mult_recognitions_list = [i[1] for i in joint_results]
-                self.ie_list = [i[2] for i in joint_results] 
-                self.identity_est_list = [i[3] for i in joint_results]
-                self.evidence_list = [i[4] for i in joint_results]
                 p_end_time = time.time()
                 if self.isDebugMode: 
                     print "time for parallel recognition: " + str(p_end_time - p_start_time)
             else:
                 #do sequential
+                recog_results_list = []
                 for num_recog in range(0, self.num_mult_recognitions):
                     self.recog_results = self.recognisePerson(num_recog)
                     if not self.recog_results:
@@ -1316,41 +1863,20 @@ class RecogniserBN:
                         self.discarded_data.append(num_recog)
                         continue
                     self.mult_recognitions_list.append(self.recog_results)
-                    self.recog_results_list.append(self.recog_results)
-                    if self.num_people > 1:
-                        self.ie, evidence = self.setEvidence(self.recog_results) # (3)
-                        self.ie_list.append(self.ie)
-                        self.evidence_list.append(evidence)
-                        i_post = np.array(self.ie.posterior(self.I)[:])
-                        self.identity_est, self.quality_estimate = self.getEstimatedIdentity(i_post) # (5)
-                    else:
-                        self.identity_est, self.quality_estimate = self.getEstimatedIdentity() # (5)
-                    self.identity_est_list.append(self.identity_est)
+                    recog_results_list.append(self.recog_results)
                 self.num_mult_recognitions -= len(self.discarded_data)
                 if self.num_mult_recognitions == 0:
                     print "Images are all discarded. No face detected in the images"
                     self.num_mult_recognitions = self.def_num_mult_recognitions
                     return ""
-                    
+            
+            self.recogniseBatch(recog_results_list) # (3), (5)
+            self.face_est, self.face_prob = self.getFaceRecogEstimate() # (4)
             if self.num_people > 1:
-                for r in range(0, self.num_mult_recognitions):
-                    if r== 0:
-                        ie_avg = self.ie_list[r].posterior(self.I)[:]
-                    else:
-                        temp_p = self.ie_list[r].posterior(self.I)[:]
-                        ie_avg = [x + y for x, y in zip(ie_avg, temp_p)]
-                identity_est_prob = self.normaliseSum(ie_avg)
-                self.identity_prob_list = [float("{0:.4f}".format(i)) for i in identity_est_prob]
-                self.face_est, self.face_prob = self.getFaceRecogEstimate() # (4)
-                self.identity_est, self.quality_estimate = self.getEstimatedIdentity(self.identity_prob_list) # (5)
                 if self.isUseFaceRecogEstForMinRecog and self.num_recognitions < self.num_recog_min:
                     self.identity_est = self.face_est
                 if self.isDebugMode:
                     print "self.identity_est:" + str(self.identity_est)
-            else:
-                self.face_est, self.face_prob = self.getFaceRecogEstimate() # (4)
-                self.identity_est, self.quality_estimate = self.getEstimatedIdentity() # (5)
-                self.identity_prob_list = [1.0] # for unknown
         else:
             self.recog_results = self.recognisePerson() # (2)
             if not self.recog_results:
@@ -1376,32 +1902,39 @@ class RecogniserBN:
         self.identity_est_prob = self.identity_prob_list
         return self.identity_est
 
-    def threadedRecognisePerson(self, num_recog):
-        """Threaded recognisePerson with estimation of the identity (during recognise for multipleRecognitions)"""
-        recog_results = self.recognisePerson(num_recog)
-        if not recog_results:
-            return []
-        mult_recognitions = recog_results
-        ie = None
-        evidence = None
+    def recogniseBatch(self, recog_results_list):
+        """
+        Recognise the user from multiple images at once (for multipleRecognitions): the evidence of the images are stacked 
+        and the posteriors of all images are computed in one vectorised call (getPosteriorsBatch).
+        Sets recog_results_list, evidence_list, ie_list, identity_est_list, identity_prob_list, identity_est and quality_estimate.
+        Returns the posteriors of each image (num_images x num_people), the averaged posterior and the quality of the estimation.
+        """
+        self.recog_results_list = recog_results_list
+        self.num_mult_recognitions = len(recog_results_list)
         if self.num_people > 1:
-            ie, evidence = self.setEvidence(recog_results)
-            i_post = np.array(ie.posterior(self.I)[:])
-            identity_est, quality_estimate = self.getEstimatedIdentity(i_post)
+            self.evidence_list = [self.getEvidence(recog_results) for recog_results in recog_results_list]
+            i_posts, self.ie_list = self.getPosteriorsBatch(self.evidence_list)
+            self.identity_est_list = [self.getEstimatedIdentity(i_post)[0] for i_post in i_posts]
+            identity_est_prob = np.array(self.normaliseSum(np.sum(i_posts, axis=0)))
+            self.identity_prob_list = [float("{0:.4f}".format(i)) for i in identity_est_prob]
+            self.identity_est, self.quality_estimate = self.getEstimatedIdentity(self.identity_prob_list)
         else:
-            identity_est, quality_estimate = self.getEstimatedIdentity()
-        
-        return [recog_results, mult_recognitions, ie, identity_est, evidence]
-
+            self.evidence_list = []
+            self.ie_list = []
+            i_posts = np.ones((len(recog_results_list), 1))
+            identity_est_prob = np.ones(1)
+            self.identity_est, self.quality_estimate = self.getEstimatedIdentity()
+            self.identity_est_list = [self.identity_est for _ in recog_results_list]
+            self.identity_prob_list = [1.0] # for unknown
+        return i_posts, identity_est_prob, self.quality_estimate
 
-    def threadedNoEstRecognisePerson(self, num_recog):
-        """Threaded recognisePerson without estimation of the identity (during setPersonIdentity for multipleRecognitions)"""
+    def threadedRecognisePerson(self, num_recog):
+        """Threaded recognisePerson (for multipleRecognitions), the inference is made for all images at once afterwards (recogniseBatch)"""
         recog_results = self.recognisePerson(num_recog)
+        if not recog_results:
+            return []
         mult_recognitions = recog_results
-        ie = None
-        if self.num_people > 1:
-            ie, evidence = self.setEvidence(recog_results)
-        return [recog_results, mult_recognitions, ie, evidence]
+        return [recog_results, mult_recognitions]
 
 
     #---------------------------------------------FUNCTIONS FOR SETTING THE IDENTITY OF THE PERSON AFTER CONFIRMATION---------------------------------------------# 
@@ -1494,7 +2027,8 @@ class RecogniserBN:
                 # (5)
                 start_add_person_time = time.time()
                 self.addPersonToBN(self.personToAdd)
-                time.sleep(0.1)
+                if recog_results_from_file is None:
+                    time.sleep(0.1) # wait for the face database of the robot
                 if self.isDebugMode:
                     print "time to add person" + str(time.time() - start_add_person_time)
             
@@ -1507,7 +2041,7 @@ class RecogniserBN:
                     # PARALLEL
                     p_start_time = time.time()
                     pool = ThreadPool(self.num_mult_recognitions)
-                    joint_results = pool.map(self.threadedNoEstRecognisePerson, [i for i in range(0, self.num_mult_recognitions)])
+                    joint_results = pool.map(self.threadedRecognisePerson, [i for i in range(0, self.num_mult_recognitions)])
                     pool.close()
                     pool.join()
                     num_rr = 0
@@ -1528,8 +2062,6 @@ class RecogniserBN:
                     
                     self.recog_results_list = [i[0] for i in joint_results]
                     self.mult_recognitions_list = [i[1] for i in joint_results]
-                    self.ie_list = [i[2] for i in joint_results]
-                    self.evidence_list = [i[3] for i in joint_results]
                 else:
                     # SEQUENTIAL
                     self.mult_recognitions_list = []
@@ -1590,28 +2122,12 @@ class RecogniserBN:
                 self.evidence_list = []
                 start_posterior_calc = time.time()
                 if self.isMultipleRecognitions:
-                    if recog_results_from_file is not None:
-                        self.ie_list = []
-                        for num_recog in range(0, self.num_mult_recognitions):
-                            self.ie, evidence = self.setEvidence(self.recog_results_list[num_recog])
-                            self.ie_list.append(self.ie)
-                            self.evidence_list.append(evidence)
-                    
-                        if self.isDebugMode:
-                            print "time to calculate posterior after registering:" + str(time.time()- start_posterior_calc)
-                    
-                    start_time_avg_posterior = time.time()
-                    for num_recog in range(0, self.num_mult_recognitions):
-                        if num_recog== 0:
-                            ie_avg = self.ie_list[num_recog].posterior(self.I)[:]
-                        else:
-                            temp_p = self.ie_list[num_recog].posterior(self.I)[:]
-                            ie_avg = [x + y for x, y in zip(ie_avg, temp_p)]
-
+                    self.evidence_list = [self.getEvidence(recog_results) for recog_results in self.recog_results_list]
+                    i_posts, self.ie_list = self.getPosteriorsBatch(self.evidence_list)
                     if self.isDebugMode:
-                        print "time to avg posterior:" + str(time.time() - start_time_avg_posterior)
+                        print "time to calculate posterior after registering:" + str(time.time()- start_posterior_calc)
                         
-                    identity_est_prob = self.normaliseSum(ie_avg)
+                    identity_est_prob = self.normaliseSum(np.sum(i_posts, axis=0))
                 else:
                     self.ie, evidence = self.setEvidence(self.recog_results)
                     self.evidence_list.append(evidence)
@@ -1647,7 +2163,7 @@ class RecogniserBN:
                     if self.isLogMode:
                         self.saveAnalysisFile(self.recog_results, p_id, self.ie, isPrevSavedToAnalysis) # (9)
 
-        return self.names[self.i_labels.index(p_id)]
+        return self.names[self.getLabelIndex(p_id)]
 
     #---------------------------------------------FUNCTIONS FOR GETTING/SETTING EVIDENCE FROM THE RECOGNITION RESULTS (MULTI-MODALITIES)---------------------------------------------# 
 
@@ -1655,10 +2171,22 @@ class RecogniserBN:
     def setEvidence(self, recog_results, param_weights = None):
         """Calculate the evidence for each parameter from the recognition results in terms of probabilities, and set the evidence of the network"""
         # self.printPriors()
+        evidence = self.getEvidence(recog_results, param_weights)
         
+        ie = self.getInferenceEngine()
+        ie.setEvidence(self.getEvidenceDict(evidence, not isinstance(ie, ClosedFormInference)))
+        ie.makeInference()
+
+        return ie, evidence
+    
+    def getEvidence(self, recog_results, param_weights = None):
+        """Calculate the evidence for each parameter (F, G, A, H, T) from the recognition results in terms of probabilities (log probabilities if isLogSpace)"""
         if param_weights is None:
             param_weights = self.weights
         
+        if self.isLogSpace:
+            return self.getLogEvidence(recog_results, param_weights)
+        
         start_time_set_ev1 = time.time()
         # P(e|F)
         face_result = self.setFaceProbabilities(recog_results[0], param_weights[0])
@@ -1677,60 +2205,95 @@ class RecogniserBN:
         
 #         gnb.showInference(self.r_bn,evs={"F":face_result, "G":gender_result, "A":age_result, "H":height_result, "T":time_result})
         evidence = [face_result, gender_result, age_result, height_result, time_result]
+        return evidence
+                        
+    def getLogEvidence(self, recog_results, param_weights):
+        """Calculate the evidence for each parameter (F, G, A, H, T) from the recognition results in log domain: 
+        weights are multiplied with the log values, normalisation is done with logsumexp and pdf values are not clamped to prob_threshold"""
+        # log P(e|F)
+        face_result = self.setFaceProbabilities(recog_results[0], param_weights[0], isLogSpace = True)
+        
+        # log P(e|G)
+        gender_result = np.log(self.setGenderProbabilities(recog_results[1], param_weights[1]))
 
-        ie = gum.LazyPropagation(self.r_bn)
-        ie.setEvidence({"F":face_result, "G":gender_result, "A":age_result, "H":height_result, "T":time_result})
-        ie.makeInference()
+        # log P(e|A)
+        age_result = self.getLogCurve(conf = recog_results[2][1], mean = recog_results[2][0], min_value = self.age_min, max_value = self.age_max, weight = param_weights[2], norm_method = self.evidence_norm_methods[2])
 
-        return ie, evidence
-                        
-    def setFaceProbabilities(self, face_values, weight, isNormalisationOn = True):
+        # log P(e|H)
+        height_result = self.getLogCurve(conf = recog_results[3][1], mean = recog_results[3][0], stddev = self.stddev_height, min_value = self.height_min, max_value = self.height_max, weight = param_weights[3], norm_method = self.evidence_norm_methods[3])
+
+        # log P(e|T)   
+        time_result = self.getLogCurve(mean = self.getTimeSlot(recog_results[4]), stddev = self.stddev_time, min_value = self.time_min, max_value = self.time_max, weight = param_weights[4], norm_method = self.evidence_norm_methods[4])
+        
+        return [face_result, gender_result, age_result, height_result, time_result]
+    
+    def getLinearEvidence(self, values):
+        """Get the evidence values in linear domain (the values are in log domain if isLogSpace)"""
+        if self.isLogSpace:
+            return np.exp(values)
+        return values
+    
+    def getEvidenceDict(self, evidence, isLinear = False, p_id = None):
+        """Get the dictionary of evidence to set on the inference engine (with hard evidence on I if p_id is given). 
+        If isLinear, evidence is converted to linear domain (pyAgrum can not use the evidence in log domain)"""
+        if isLinear:
+            evidence = [self.getLinearEvidence(values) for values in evidence]
+        evs = {"F":evidence[0], "G":evidence[1], "A":evidence[2], "H":evidence[3], "T":evidence[4]}
+        if p_id is not None:
+            evs["I"] = p_id
+        return evs
+        
+    def setFaceProbabilities(self, face_values, weight, isNormalisationOn = True, isLogSpace = False):
         """
         Set face probabilities for evidence using the face similarity scores:
-        Similarity scores are sorted according to the order in the i_labels,
+        Similarity scores are sorted according to the order in the i_labels (see getFaceScores),
         face_recognition_threshold is added for the unknown state,
+        values are clamped to prob_threshold,
         weight is applied to all values,
         and values are normalised
         """
         accuracy_face = face_values[0]
-        face_similarities = []
-        if len(face_values[1]) > 0:
-            face_similarities = face_values[1][:]
-        if len(face_similarities) == 0:
-            face_similarities.append([self.unknown_var, 1.0])
-        elif not (self.unknown_var in (x[0] for x in face_similarities)):
-#             max_similarity = max(face_similarities, key=lambda x: x[1])[1] # maximum similarity score in the face recognition
-#             face_similarities.append([self.unknown_var, 1.0 - max_similarity]) # the similarity score of unknown is 1-max_similarity # don't use, decreases recognition rate
-            face_similarities.append([self.unknown_var, self.face_recog_threshold])
-#             face_similarities.append([self.unknown_var, self.getFaceThreshold(self.face_recog_threshold)]) # don't use, decreases recognition rate
-
-        r_results_names = []
-        for counter in range(0, len(face_similarities)):
-            r_results_names.append(face_similarities[counter][0])
-        
-        r_results_index = []
-        for counter in range(0, len(self.i_labels)):
-            if self.i_labels[counter] in r_results_names:
-                r_results_index.append(r_results_names.index(self.i_labels[counter]))
-            else:
-                # if the person in database is not in face recognition database yet (did not have his/her first session yet)
-                r_results_index.append(-1)
-
-        face_result = []
-        for counter in range(0, len(self.i_labels)):
-            # values are normalised when using this method 
-            if r_results_index[counter] == -1:
-                fr = self.prob_threshold
-            else:
-                fr = face_similarities[r_results_index[counter]][1]
-                if fr < self.prob_threshold:
-                    fr = self.prob_threshold
-            accur = self.applyFaceAccuracy(fr, accuracy_face)
-            face_result.append(self.applyWeight(accur, weight))
-
+        face_scores, isFound = self.getFaceScores(face_values)
+        face_scores = face_scores.copy()
+        unknown_index = self.getLabelIndex(self.unknown_var)
+        if len(face_values[1]) == 0:
+            face_scores[unknown_index] = 1.0
+        elif not isFound[unknown_index]:
+            face_scores[unknown_index] = self.face_recog_threshold
+        
+        # the users that are not in the face recognition database yet (did not have their first session yet) have score 0.0, hence prob_threshold
+        face_result = self.applyFaceAccuracyArray(np.maximum(face_scores, self.prob_threshold), accuracy_face)
+        
+        if isLogSpace:
+            face_result = self.applyLogWeight(np.log(face_result), weight)
+            if isNormalisationOn:
+                face_result = self.normaliseLog(face_result, norm_method = self.evidence_norm_methods[0])
+            return face_result
+
+        face_result = self.applyWeightArray(face_result, weight)
         if isNormalisationOn:
-            face_result = self.normalise(face_result, norm_method = self.evidence_norm_methods[0])
-        return face_result
+            face_result = self.normaliseArray(face_result, norm_method = self.evidence_norm_methods[0])
+        return face_result.tolist()
+    
+    def getFaceScores(self, face_values):
+        """Align the face similarity scores ([accuracy, [['ID', score], ...]]) to i_labels in one pass: the scores are scattered into an array by the index of each ID 
+        (0.0 for the users that are not in the results). Returns the scores and a boolean array of the users that are in the results. 
+        The results are cached, so that the evidence, the non-weighted evidence and the face recognition estimate use the same alignment"""
+        cache_key = tuple((result[0], result[1]) for result in face_values[1])
+        if cache_key in self.face_scores_cache:
+            return self.face_scores_cache[cache_key]
+        face_scores = np.zeros(len(self.i_labels))
+        isFound = np.zeros(len(self.i_labels), dtype=bool)
+        # reversed, so that the first score is used if an ID is repeated
+        results = [(self.i_labels_index[key], score) for key, score in reversed(cache_key) if key in self.i_labels_index]
+        if results:
+            indices, scores = zip(*results)
+            face_scores[list(indices)] = scores
+            isFound[list(indices)] = True
+        if len(self.face_scores_cache) >= self.max_face_scores_cache:
+            self.face_scores_cache = {}
+        self.face_scores_cache[cache_key] = (face_scores, isFound)
+        return face_scores, isFound
 
     def setGenderProbabilities(self, gender_values, weight):
         """Set gender probabilities by applying the weight. P(G='Female'|I=i) = 1 - P(G='Male'|I=i) """
@@ -1772,14 +2335,142 @@ class RecogniserBN:
     
         return [face_result, gender_result, age_result, height_result, time_result] 
 
+    def getUnweightedEvidence(self, recog_results, age_stddev = 0.0):
+        """Get the evidence of F, G, A, H, T from the recognition results before the weights and the normalisation are applied (see getEvidence): 
+        the evidence with weight w is the normalised applyWeightArray(values, w) (see WeightOptimiser). The evidence of A, H, T is None if it is uniform. 
+        The standard deviation of A is obtained from the confidence if age_stddev is 0 (see getAgeCurveStddevs for the standard deviations of many recognitions)"""
+        face_result = np.array(self.setFaceProbabilities(recog_results[0], 1.0, isNormalisationOn = False))
+        gender_result = np.array(self.setGenderProbabilities(recog_results[1], 1.0))
+        
+        curve_results = []
+        # [confidence, mean, stddev, min_value, max_value] of A, H and T (the standard deviation of A is obtained from the confidence, see getCurve)
+        curve_params = [[recog_results[2][1], recog_results[2][0], age_stddev, self.age_min, self.age_max], 
+                        [recog_results[3][1], recog_results[3][0], self.stddev_height, self.height_min, self.height_max], 
+                        [1.0, self.getTimeSlot(recog_results[4]), self.stddev_time, self.time_min, self.time_max]]
+        for conf, mean, stddev, min_value, max_value in curve_params:
+            if conf > self.max_threshold:
+                conf = self.max_threshold
+            if np.isclose(stddev, 0.0) and conf >= self.conf_threshold:
+                stddev = self.getStddevFromConfidence(conf)
+            if conf < self.conf_threshold:
+                curve_results.append(None)
+            else:
+                pdf = self.normpdf(np.arange(min_value, max_value + 1), mean, stddev)
+                pdf[pdf < self.prob_threshold] = self.prob_threshold
+                curve_results.append(pdf)
+        return [face_result, gender_result] + curve_results
     
     def getPosteriorIUsingCalculatedEvidence(self, bn, evidence):
         """Get the posterior of identity node using the current evidence"""
-        ie = gum.LazyPropagation(bn)
-        ie.setEvidence({"F":evidence[0], "G":evidence[1], "A":evidence[2], "H":evidence[3], "T":evidence[4]})
+        ie = self.getInferenceEngine(bn)
+        ie.setEvidence(self.getEvidenceDict(evidence, not isinstance(ie, ClosedFormInference)))
         ie.makeInference()
         post_I = ie.posterior(self.I)[:]
         return post_I
+
+    def getPosteriorsBatch(self, evidence_list):
+        """Get the posteriors of identity node for multiple evidence (e.g. for multiple images in a recognition) in one call:
+        the evidence of each parameter is stacked into (num_images x num_states) array and the posteriors are computed in closed form.
+        Returns the posteriors (num_images x num_people) and the inference engines (with the posteriors set) for each evidence."""
+        ie_list = []
+        if self.inference_method == "agrum":
+            for evidence in evidence_list:
+                ie = AgrumInference(self)
+                ie.setEvidence(self.getEvidenceDict(evidence, True))
+                ie.makeInference()
+                ie_list.append(ie)
+            i_posts = np.array([ie.posterior(self.I)[:] for ie in ie_list])
+            return i_posts, ie_list
+        
+        if self.isLogSpace:
+            # log P(I|e) = log P(I) + sum_X log(sum_x P(X=x|I) * e_X(x)), evidence is scaled by its maximum before leaving the log domain
+            with np.errstate(divide='ignore'):
+                log_posts = np.tile(np.log(self.prior_I), (len(evidence_list), 1))
+                for counter in range(0, len(self.node_names) - 1):
+                    evidence_param = np.array([evidence[counter] for evidence in evidence_list], dtype=float)
+                    max_evidence = np.max(evidence_param, axis=1)[:, np.newaxis]
+                    log_posts = log_posts + np.log(self.dotLikelihood(counter, np.exp(evidence_param - max_evidence))) + max_evidence
+            i_posts = np.exp(log_posts - np.max(log_posts, axis=1)[:, np.newaxis])
+        else:
+            i_posts = np.tile(self.prior_I, (len(evidence_list), 1))
+            for counter in range(0, len(self.node_names) - 1):
+                evidence_param = np.array([evidence[counter] for evidence in evidence_list], dtype=float)
+                i_posts = i_posts * self.dotLikelihood(counter, evidence_param)
+                # rescale to prevent underflow
+                max_posts = np.max(i_posts, axis=1)
+                max_posts[max_posts == 0] = 1.0
+                i_posts = i_posts / max_posts[:, np.newaxis]
+        sum_posts = np.sum(i_posts, axis=1)
+        if not np.all(sum_posts > 0):
+            raise ValueError("Evidence is incompatible with the network")
+        i_posts = i_posts / sum_posts[:, np.newaxis]
+        
+        for num_recog in range(0, len(evidence_list)):
+            evidence = evidence_list[num_recog]
+            ie = ClosedFormInference(self)
+            ie.setEvidence(self.getEvidenceDict(evidence))
+            ie.setPosteriorI(i_posts[num_recog])
+            ie_list.append(ie)
+        return i_posts, ie_list
+
+    def getInferenceEngine(self, bn = None):
+        """Get the inference engine for the network: ClosedFormInference if inference_method is closed-form (default), 
+        otherwise AgrumInference (LazyPropagation of pyAgrum that is reused for the network). For another network than r_bn, a new LazyPropagation is returned."""
+        if bn is None:
+            bn = self.r_bn
+        if bn is not self.r_bn:
+            return gum.LazyPropagation(bn)
+        if self.inference_method == "agrum":
+            return AgrumInference(self)
+        return ClosedFormInference(self)
+    
+    def getAgrumEngine(self):
+        """Get the LazyPropagation for the network (after syncing it). It is created only when the structure of the network is changed 
+        (bn_version, e.g. new user is added), so that the junction tree is compiled once for many recognitions"""
+        self.syncBN()
+        if self.agrum_ie is None or self.agrum_ie_bn is not self.r_bn or self.agrum_ie_version != self.bn_version:
+            self.agrum_ie = gum.LazyPropagation(self.r_bn)
+            self.agrum_ie_bn = self.r_bn
+            self.agrum_ie_version = self.bn_version
+            self.agrum_evidence = {}
+        return self.agrum_ie
+    
+    def setAgrumEvidence(self, evs):
+        """Set the evidence (dictionary of node names and linear evidence values) on the LazyPropagation of the network: 
+        the evidence of the nodes that already have evidence is changed with chgEvidence, the evidence of the remaining nodes is erased"""
+        ie = self.getAgrumEngine()
+        if self.agrum_evidence is None:
+            ie.eraseAllEvidence()
+            self.agrum_evidence = {}
+        for name_param in self.agrum_evidence:
+            if name_param not in evs:
+                ie.eraseEvidence(name_param)
+        for name_param, values in evs.iteritems():
+            if name_param in self.agrum_evidence:
+                ie.chgEvidence(name_param, values)
+            else:
+                ie.addEvidence(name_param, values)
+        self.agrum_evidence = dict(evs)
+        return ie
+
+    def validateInference(self, evidence, p_id = None):
+        """Compare the posteriors of closed-form inference with the posteriors of pyAgrum (LazyPropagation) for the given evidence (and identity p_id, if given).
+        Returns the maximum absolute difference between the posteriors of all nodes."""
+        self.syncBN()
+        ie_closed = ClosedFormInference(self)
+        ie_closed.setEvidence(self.getEvidenceDict(evidence, False, p_id))
+        ie_closed.makeInference()
+        ie_agrum = gum.LazyPropagation(self.r_bn)
+        ie_agrum.setEvidence(self.getEvidenceDict(evidence, True, p_id))
+        ie_agrum.makeInference()
+        max_diff = 0.0
+        for name_param in self.node_names:
+            id_v = self.node_ids[name_param]
+            diff = np.max(np.abs(np.array(ie_closed.posterior(id_v)[:]) - np.array(ie_agrum.posterior(id_v)[:])))
+            max_diff = max(max_diff, diff)
+        if self.isDebugMode:
+            print "maximum difference between closed-form and agrum inference:" + str(max_diff)
+        return max_diff
     
     def getEstimatedProbabilities(self):
         """Get estimated probabilities"""
@@ -1807,24 +2498,82 @@ class RecogniserBN:
             
         if np.isclose(stddev, 0.0) and conf >= self.conf_threshold:
             # applicable to age only
-            stddev = 0.5/self.normppf(conf + (1-conf)/2.0)
+            stddev = self.getStddevFromConfidence(conf)
         
         if conf < self.conf_threshold or weight == 0.0:
             # uniform distribution
             curve = self.uniformDistribution(min_value, max_value)
         else:
             # Gaussian distribution         
-#             norm_curve = norm(loc=observed_height,scale=self.stddev_height )
-            for j in range(min_value, max_value +1):
-#                 j_pdf = norm_curve.pdf(j)
-                j_pdf = self.normpdf(j, mean, stddev)
-                if j_pdf < self.prob_threshold:
-                    j_pdf = self.prob_threshold
-                curve.append(self.applyWeight(j_pdf, weight))
-            curve = self.normalise(curve, norm_method)
+            curve = self.getGaussianCurve(mean, stddev, min_value, max_value, weight, norm_method)
 
         return curve
     
+    def getCurves(self, means, stddev, min_value, max_value, weight):
+        """Get the curves of the means (see getCurve, normalised with norm-sum) as a matrix (number of means x number of states), the curve of each distinct mean is computed once"""
+        unique_means, indices = np.unique(np.array(means, dtype=float), return_inverse=True)
+        curves = np.array([self.getCurve(mean = mean, stddev = stddev, min_value = min_value, max_value = max_value, weight = weight, norm_method = "norm-sum") for mean in unique_means.tolist()])
+        return curves[indices]
+    
+    def getGaussianCurve(self, mean, stddev, min_value, max_value, weight, norm_method = None):
+        """Get the weighted and normalised Gaussian curve for the states from min_value to max_value. 
+        For integer means within the range, the curve is sliced from the weighted kernel of the offsets from the mean, normalised once and 
+        kept in a table (curve_tables), so that the next call with the same parameters is a lookup. Other means are computed on the array of states."""
+        if norm_method is None:
+            norm_method = self.norm_method
+        isTableMean = float(mean).is_integer() and min_value <= mean <= max_value
+        if isTableMean:
+            mean = int(mean)
+            table_key = (min_value, max_value, stddev, weight, norm_method, self.apply_weight_method, self.prob_threshold)
+            table = self.curve_tables.get(table_key)
+            if table is None:
+                if len(self.curve_tables) >= self.max_curve_tables:
+                    self.curve_tables = {}
+                table = {}
+                self.curve_tables[table_key] = table
+            curve = table.get(mean)
+            if curve is None:
+                span = max_value - min_value
+                kernel = self.getWeightedKernel(span, stddev, weight)
+                start = span - (mean - min_value)
+                curve = self.normaliseArray(kernel[start:start + span + 1], norm_method)
+                table[mean] = curve
+            return curve.tolist()
+        
+        pdf = self.normpdf(np.arange(min_value, max_value + 1), mean, stddev)
+        pdf[pdf < self.prob_threshold] = self.prob_threshold
+        return self.normaliseArray(self.applyWeightArray(pdf, weight), norm_method).tolist()
+    
+    def getLogCurve(self, conf = 1.0, mean = 0.0, stddev = 0.0, min_value = 0, max_value = 0, weight = 1.0, norm_method = None):
+        """Get discretised and normalised normal curve in log domain (same as getCurve, without clamping the pdf values to prob_threshold)"""
+        if conf > self.max_threshold:
+            conf = self.max_threshold # decrease the prob. to get a Gaussian distribution
+            
+        if np.isclose(stddev, 0.0) and conf >= self.conf_threshold:
+            # applicable to age only
+            stddev = self.getStddevFromConfidence(conf)
+        
+        if conf < self.conf_threshold or weight == 0.0:
+            # uniform distribution
+            return np.log(self.uniformDistribution(min_value, max_value))
+        
+        u = (np.arange(min_value, max_value + 1) - mean) / float(abs(stddev))
+        log_pdf = -u*u/2 - np.log(np.sqrt(2*np.pi) * abs(stddev))
+        return self.normaliseLog(self.applyLogWeight(log_pdf, weight), norm_method)
+    
+    def getWeightedKernel(self, span, stddev, weight):
+        """Get the weighted pdf values of the Gaussian for the integer offsets from -span to span (clipped at prob_threshold)"""
+        kernel_key = (span, stddev, weight, self.apply_weight_method, self.prob_threshold)
+        kernel = self.curve_kernels.get(kernel_key)
+        if kernel is None:
+            if len(self.curve_kernels) >= self.max_curve_tables:
+                self.curve_kernels = {}
+            pdf = self.normpdf(np.arange(-span, span + 1), 0, stddev)
+            pdf[pdf < self.prob_threshold] = self.prob_threshold
+            kernel = self.applyWeightArray(pdf, weight)
+            self.curve_kernels[kernel_key] = kernel
+        return kernel
+    
 #     def getFaceThreshold(self, accuracy):
 #         """"""
 #         # NOTE: DON'T USE, MAKES RECOGNITION WORSE
@@ -1865,47 +2614,21 @@ class RecogniserBN:
     
     def getFaceRecognitionValues(self, face_values):
         """Sort similarity scores in the order of i_labels"""
-        accuracy_face = face_values[0]
-        face_similarities = []
-        if len(face_values[1]) > 0:
-            face_similarities = face_values[1][:]
-            
-        r_results_names = []
-        for counter in range(0, len(face_similarities)):
-            r_results_names.append(face_similarities[counter][0])
-        
-        r_results_index = []
+        face_scores, isFound = self.getFaceScores(face_values)
         # exclude unknown_var -> start from 1
-        for counter in range(1, len(self.i_labels)):
-            if self.i_labels[counter] in r_results_names:
-                r_results_index.append(r_results_names.index(self.i_labels[counter]))
-            else:
-                # if the person in database is not in face recognition database yet (did not have his/her first session yet)
-                r_results_index.append(-1)
-        face_prob = []
-        for r_counter in range(0, len(r_results_index)):
-            if r_results_index[r_counter] != -1:
-#                 face_prob.append(self.applyFaceAccuracy(face_similarities[r_results_index[r_counter]][1], accuracy_face))
-                face_prob.append(face_similarities[r_results_index[r_counter]][1])
-            else:
-                face_prob.append(0.0) # for face recognition, it is 0 NOT self.prob_threshold
-        return face_prob # doesnt include unknown!!!
+        # if the person in database is not in face recognition database yet (did not have his/her first session yet), for face recognition, it is 0 NOT self.prob_threshold
+        return face_scores[1:].tolist() # doesnt include unknown!!!
         
     def getFaceRecogEstimate(self):
         """Get identity estimated by face recognition"""
         total_face_prob = []
             
         if self.isMultipleRecognitions:
-            for num_recog in range(0, self.num_mult_recognitions):                
-                face_prob = self.getFaceRecognitionValues(self.mult_recognitions_list[num_recog][0])
-                if num_recog == 0:
-                    total_face_prob = face_prob[:]
-                else:
-                    total_face_prob = [x + y for x, y in zip(total_face_prob, face_prob)]
-            total_face_prob = [i/(self.num_mult_recognitions*1.0) for i in total_face_prob]
+            face_probs = np.array([self.getFaceScores(self.mult_recognitions_list[num_recog][0])[0][1:] for num_recog in range(0, self.num_mult_recognitions)])
+            total_face_prob = (np.sum(face_probs, axis=0)/(self.num_mult_recognitions*1.0)).tolist()
         else:
             total_face_prob = self.getFaceRecognitionValues(self.nonweighted_evidence[0])
-        unknown_index = self.i_labels.index(self.unknown_var)
+        unknown_index = self.getLabelIndex(self.unknown_var)
         if not total_face_prob:
             return self.unknown_var, [self.face_recog_threshold]
         elif self.num_recognitions < self.num_recog_min and len(self.i_labels) < self.num_recog_min and not self.isUseFaceRecogEstForMinRecog:
@@ -1938,6 +2661,10 @@ class RecogniserBN:
         time_slot = (int(p_time[1])-1)*24*60/self.period + int(tp[0])*60/self.period + int(tp[1])/self.period
         return time_slot
     
+    def getTimeSlots(self, hours, minutes, days):
+        """Calculate the time slots of the arrays of hours, minutes and days of the week (see getTimeSlot and RecognitionCSV)"""
+        return (days - 1)*24*60//self.period + hours*60//self.period + minutes//self.period
+    
     def applyWeight(self, value, weight):
         """Apply weight to the value: 
         pow (weight is taken as the power to the value - default), 
@@ -1950,6 +2677,35 @@ class RecogniserBN:
         elif self.apply_weight_method == "mult":
             return value*weight
     
+    def applyWeightArray(self, values, weight):
+        """Apply weight to each value in the numpy array (same as applyWeight)"""
+        if self.apply_weight_method == "pow":
+            return np.power(values, weight)
+        elif self.apply_weight_method == "invpow":
+            return np.power(values, 1.0/weight)
+        elif self.apply_weight_method == "mult":
+            return values*weight
+    
+    def applyLogWeight(self, log_values, weight):
+        """Apply weight to the values in log domain (same as applyWeight): pow and invpow are multiplications, mult is an addition"""
+        if self.apply_weight_method == "pow":
+            return log_values*weight
+        elif self.apply_weight_method == "invpow":
+            return log_values/weight
+        elif self.apply_weight_method == "mult":
+            return log_values + np.log(weight)
+    
+    def applyFaceAccuracyArray(self, values, accuracy):
+        """Apply accuracy of face recognition to each value in the numpy array (same as applyFaceAccuracy)"""
+        if self.apply_accuracy_method == "pow":
+            return np.power(values, accuracy)
+        elif self.apply_accuracy_method == "invpow":
+            return np.power(values, 1.0/accuracy)
+        elif self.apply_accuracy_method == "mult":
+            return values*accuracy     
+        elif self.apply_accuracy_method == "none":
+            return values
+        
     def applyFaceAccuracy(self, value, accuracy):
         """Apply accuracy of face recognition to the value:
         none (not applied - default),
@@ -1983,6 +2739,72 @@ class RecogniserBN:
         elif norm_method == "tanh":
             return self.tanhScore(array)
 
+    def normaliseArray(self, array, norm_method = None):
+        """Applies normalisation method to the given numpy array (same as normalise, returns numpy array)"""
+        if norm_method is None:
+            norm_method = self.norm_method
+        len_ar = len(array)
+        if norm_method == "norm-sum":
+            sum_array = np.sum(array)
+            if sum_array == 0:
+                return np.ones(len_ar)/len_ar
+            return array/float(sum_array)
+        elif norm_method == "softmax":
+            array_exp = np.exp(array)
+            return array_exp/np.sum(array_exp)
+        elif norm_method == "minmax":
+            min_ar = np.min(array)
+            diff = (np.max(array) - min_ar)*1.0
+            if diff > 0:
+                return (array - min_ar)/diff
+            return np.ones(len_ar)/len_ar
+        elif norm_method == "tanh":
+            mean_a = np.mean(array)
+            std_a = np.std(array)
+            if std_a == 0:
+                return np.ones(len_ar)/len_ar
+            return 0.5*(np.tanh(0.01*((array - mean_a)/std_a))+1)
+
+    def normaliseRows(self, array, norm_method = None):
+        """Applies normalisation method to each row of the 2D numpy array (same as normaliseArray for each row)"""
+        if norm_method is None:
+            norm_method = self.norm_method
+        num_states = array.shape[1]
+        if norm_method == "norm-sum":
+            sum_array = np.sum(array, axis=1)[:, np.newaxis]
+            return np.where(sum_array == 0, 1.0/num_states, array/np.where(sum_array == 0, 1.0, sum_array))
+        elif norm_method == "softmax":
+            array_exp = np.exp(array)
+            return array_exp/np.sum(array_exp, axis=1)[:, np.newaxis]
+        elif norm_method == "minmax":
+            min_ar = np.min(array, axis=1)[:, np.newaxis]
+            diff = (np.max(array, axis=1)[:, np.newaxis] - min_ar)*1.0
+            return np.where(diff > 0, (array - min_ar)/np.where(diff > 0, diff, 1.0), 1.0/num_states)
+        elif norm_method == "tanh":
+            mean_a = np.mean(array, axis=1)[:, np.newaxis]
+            std_a = np.std(array, axis=1)[:, np.newaxis]
+            return np.where(std_a == 0, 1.0/num_states, 0.5*(np.tanh(0.01*((array - mean_a)/np.where(std_a == 0, 1.0, std_a)))+1))
+
+    def normaliseLog(self, log_array, norm_method = None):
+        """Applies normalisation method to the values in log domain and returns the log of the normalised values:
+        norm-sum and softmax are computed with logsumexp, minmax and tanh are computed in linear domain"""
+        if norm_method is None:
+            norm_method = self.norm_method
+        if norm_method == "norm-sum":
+            return log_array - self.logSumExp(log_array)
+        elif norm_method == "softmax":
+            array = np.exp(log_array)
+            return array - self.logSumExp(array)
+        with np.errstate(divide='ignore'):
+            return np.log(self.normaliseArray(np.exp(log_array), norm_method))
+    
+    def logSumExp(self, log_array):
+        """log(sum(exp(values))) computed without underflow"""
+        max_value = np.max(log_array)
+        if np.isinf(max_value):
+            return max_value
+        return max_value + np.log(np.sum(np.exp(log_array - max_value)))
+
     def normaliseSum(self, array):
         """Divide each value by the sum of values"""
         sum_array = sum(array)
@@ -2015,6 +2837,47 @@ class RecogniserBN:
         return [0.5*(np.tanh(0.01*((i - mean_a)/std_a))+1) for i in array]
 
     def getStddevFromConfidence(self, confidence):
+        """Get the standard deviation of the curve from the confidence of the estimation. The values for the confidences on the grid of 1/stddev_table_steps 
+        are memoised in stddev_table (normppf is computed once for each confidence, the NAOqi confidences are rounded to 3 decimals)"""
+        index = int(round(confidence*self.stddev_table_steps))
+        if 0 <= index <= self.stddev_table_steps and index/float(self.stddev_table_steps) == confidence:
+            stddev_table = self.getStddevTable()
+            if np.isnan(stddev_table[index]):
+                stddev_table[index] = self.computeStddevFromConfidence(confidence)
+            return float(stddev_table[index])
+        return self.computeStddevFromConfidence(confidence)
+    
+    def getAgeCurveStddevs(self, confidences):
+        """Get the standard deviations of the age curves for an array of confidences (see getCurve): the confidences above max_threshold are max_threshold, 
+        and the standard deviation is 0 for the confidences below conf_threshold (uniform distribution)"""
+        confidences = np.minimum(np.asarray(confidences, dtype=float), self.max_threshold)
+        stddevs = np.zeros(len(confidences))
+        isCurve = confidences >= self.conf_threshold
+        stddevs[isCurve] = self.getStddevsFromConfidences(confidences[isCurve])
+        return stddevs
+    
+    def getStddevsFromConfidences(self, confidences):
+        """Get the standard deviations for an array of confidences (vectorised getStddevFromConfidence for batch computations): 
+        the confidences on the grid of 1/stddev_table_steps are looked up in stddev_table, and the missing values of the table are computed once"""
+        confidences = np.asarray(confidences, dtype=float)
+        indices = np.clip(np.round(confidences*self.stddev_table_steps), 0, self.stddev_table_steps).astype(int)
+        isOnGrid = indices/float(self.stddev_table_steps) == confidences
+        stddev_table = self.getStddevTable()
+        for index in set(indices[isOnGrid & np.isnan(stddev_table[indices])].tolist()):
+            stddev_table[index] = self.computeStddevFromConfidence(index/float(self.stddev_table_steps))
+        stddevs = stddev_table[indices]
+        for counter in np.nonzero(~isOnGrid.ravel())[0]:
+            stddevs.flat[counter] = self.computeStddevFromConfidence(confidences.flat[counter])
+        return stddevs
+    
+    def getStddevTable(self):
+        """Get the table of standard deviations for the confidences i/stddev_table_steps (allocated when first used, NaN if not computed yet)"""
+        if self.stddev_table is None:
+            self.stddev_table = np.empty(self.stddev_table_steps + 1)
+            self.stddev_table.fill(np.nan)
+        return self.stddev_table
+    
+    def computeStddevFromConfidence(self, confidence):
         """From https://stats.stackexchange.com/questions/269784/calculating-the-probability-of-a-discrete-rv-given-the-mean-and-the-probability"""
         z = self.normppf(confidence + (1-confidence)/2.0) # z-score
         return 0.5/z
@@ -2022,7 +2885,7 @@ class RecogniserBN:
     def normpdf(self, x, loc=0, scale=1):
         """x is the value that pdf wants to be read at, loc is the mean, and scale is the stddev
         From: https://stackoverflow.com/questions/8669235/alternative-for-scipy-stats-norm-pdf"""
-        u = float(x-loc) / abs(scale)
+        u = np.asarray(x - loc, dtype=float) / abs(scale)
         y = np.exp(-u*u/2) / (np.sqrt(2*np.pi) * abs(scale))
         return y
     
@@ -2136,7 +2999,7 @@ class RecogniserBN:
 
     def isAlreadyRegistered(self, p_id):
         """Checks if the user is already registered: if user in i_labels and occurrence is greater than 1, returns True, else False"""
-        if p_id in self.i_labels and self.occurrences[self.i_labels.index(p_id)][0] > 0:
+        if p_id in self.i_labels_index and self.occurrences[self.getLabelIndex(p_id)][0] > 0:
             return True
         return False
     
@@ -2155,7 +3018,8 @@ class RecogniserBN:
         self.conf_matrix_file = "confusionMatrix.csv"
         self.recog_folder = ""
         self.image_save_dir = "images/"
-        self.previous_files_dir = "LastSaved/"
+        self.journal_dir = "Journal/"
+        self.journal_file = self.journal_dir + "journal.log"
         self.faceDB = "faceDB"
                 
     def setFilePaths(self, recog_folder):
@@ -2169,37 +3033,53 @@ class RecogniserBN:
         self.image_save_dir = recog_folder + "images/"
         self.stats_file = recog_folder + self.stats_file
         self.conf_matrix_file = recog_folder + self.conf_matrix_file
-        self.previous_files_dir = recog_folder + self.previous_files_dir
+        self.journal_dir = recog_folder + self.journal_dir
+        self.journal_file = recog_folder + self.journal_file
         self.faceDB = recog_folder + self.faceDB
         self.recog_folder = recog_folder
 
     def resetFiles(self):
         """Removes the files/folders and rewrites empty files/folders."""
+        self.flush()
         if os.path.isfile(self.recog_file):
             os.remove(self.recog_file)
-        if os.path.isfile(self.recogniser_csv_file):
-            os.remove(self.recogniser_csv_file)
-        with open(self.recogniser_csv_file, 'wb') as outcsv:
-            writer = csv.writer(outcsv)
-            writer.writerow(["I", "F", "G", "A", "H", "T", "R", "N"])
-        if os.path.isfile(self.initial_recognition_file):
-            os.remove(self.initial_recognition_file)
-        with open(self.initial_recognition_file, 'wb') as outcsv:
-            writer = csv.writer(outcsv)
-            writer.writerow(["I_est", "F", "G", "A", "H", "T", "N"])
-        if os.path.isfile(self.db_file):
-            os.remove(self.db_file)
-        with open(self.db_file, 'wb') as outcsv:
-            writer = csv.writer(outcsv)
-#             writer.writerow(["id", "name", "gender", "age", "height", "times", "occurrence"])
-            writer.writerow(["id", "name", "gender", "birthYear", "height", "times", "occurrence"])
+        RecognitionModel(self.getModelFile(self.recog_file)).remove()
+        for csv_file, record_type in self.getRecogFiles():
+            for recog_file in [csv_file, self.getRecogLogFile(csv_file), RecognitionCSV(csv_file, record_type).getCacheFile()]:
+                if os.path.isfile(recog_file):
+                    os.remove(recog_file)
+        if self.isRecogLogBinary:
+            open(self.getRecogLogFile(self.recogniser_csv_file), 'wb').close()
+            open(self.getRecogLogFile(self.initial_recognition_file), 'wb').close()
+        else:
+            with open(self.recogniser_csv_file, 'wb') as outcsv:
+                writer = csv.writer(outcsv)
+                writer.writerow(RecognitionLog.COLUMNS[RecognitionLog.RECOGNISER])
+            with open(self.initial_recognition_file, 'wb') as outcsv:
+                writer = csv.writer(outcsv)
+                writer.writerow(RecognitionLog.COLUMNS[RecognitionLog.INITIAL])
+        self.closeUserStore()
+        for db_file in [self.db_file, self.getUserStoreFile(self.db_file)]:
+            if os.path.isfile(db_file):
+                os.remove(db_file)
+        if self.isUserStoreSQLite:
+            self.getUserStore()
+        else:
+            with open(self.db_file, 'wb') as outcsv:
+                writer = csv.writer(outcsv)
+#                 writer.writerow(["id", "name", "gender", "age", "height", "times", "occurrence"])
+                writer.writerow(["id", "name", "gender", "birthYear", "height", "times", "occurrence"])
         analys_dir = self.recog_folder + self.analysis_dir
         if os.path.isdir(analys_dir):
             shutil.rmtree(analys_dir)
         os.makedirs(analys_dir)        
-        with open(self.comparison_file, 'wb') as outcsv:
-            writer = csv.writer(outcsv)
-            writer.writerow(["I_real", "I_est", "F_est", "I_prob", "F_prob", "Calc_time", "R", "Quality", "Highest_I_prob", "Highest_F_prob"])
+        if self.isRecogLogBinary:
+            open(self.getRecogLogFile(self.comparison_file), 'wb').close()
+        else:
+            with open(self.comparison_file, 'wb') as outcsv:
+                writer = csv.writer(outcsv)
+                writer.writerow(RecognitionLog.COLUMNS[RecognitionLog.COMPARISON])
+        self.image_store = None
         if os.path.isdir(self.image_save_dir):
             shutil.rmtree(self.image_save_dir)
         os.makedirs(self.image_save_dir)
@@ -2210,84 +3090,234 @@ class RecogniserBN:
         os.makedirs(self.image_save_dir + "Unknown_False")
         os.makedirs(self.image_save_dir + "discarded")
         
-        if os.path.isdir(self.previous_files_dir):
-            shutil.rmtree(self.previous_files_dir)
-        os.makedirs(self.previous_files_dir)
+        if os.path.isdir(self.journal_dir):
+            shutil.rmtree(self.journal_dir)
+        os.makedirs(self.journal_dir)
+        self.journal_entry = None
+        self.journal_num_entries = 0
+        self.analysis_log = None
         if os.path.isfile(self.faceDB):
             os.remove(self.faceDB)
             
-    def saveFilesToLastSaved(self):
-        """add files one by one to avoid delay (instead of transferring the entire folder)"""
-        if os.path.isfile(self.recog_file):
-            shutil.copy2(self.recog_file, self.previous_files_dir)
-        if self.isSaveRecogFiles:
-            if os.path.isfile(self.recogniser_csv_file):
-                shutil.copy2(self.recogniser_csv_file, self.previous_files_dir)
-            if os.path.isfile(self.initial_recognition_file):
-                shutil.copy2(self.initial_recognition_file, self.previous_files_dir)
-            if os.path.isfile(self.db_file):
-                shutil.copy2(self.db_file, self.previous_files_dir)
-            if os.path.isfile(self.stats_file):
-                shutil.copy2(self.stats_file, self.previous_files_dir)
-            if os.path.isfile(self.conf_matrix_file):
-                shutil.copy2(self.conf_matrix_file, self.previous_files_dir)  
-            analys_save_dir = self.previous_files_dir + self.analysis_dir
-            if not os.path.isdir(analys_save_dir):
-               os.makedirs(analys_save_dir)
-            if os.path.isfile(self.comparison_file):
-                shutil.copy2(self.comparison_file, analys_save_dir)
-            if os.path.isfile(self.faceDB):
-                shutil.copy2(self.faceDB, self.previous_files_dir)
+    def beginJournalEntry(self):
+        """Start recording the changes of the recognition for the journal: the sizes of the recognition logs, P(I), the occurrences, 
+        the likelihoods before they are changed (see journalRows) and the face recognition database (if it exists, i.e. on the robot)"""
+        if self.journal_entry is not None:
+            return
+        face_db_copy = None
+        if os.path.isfile(self.faceDB):
+            face_db_copy = self.journal_dir + "faceDB_" + str(self.num_recognitions + 1)
+        self.journal_entry = {"N": self.num_recognitions, "num_people": len(self.i_labels), "prior": self.prior_I, 
+                              "occurrences": copy.deepcopy(self.occurrences), "rows": {}, "log_sizes": [], "face_db": face_db_copy}
+        self.persist(self.recordJournalFiles, (self.journal_entry,))
+        
+    def recordJournalFiles(self, entry):
+        """Record the sizes of the recognition logs (or CSV files) and copy the face recognition database for the journal entry"""
+        if not os.path.isdir(self.journal_dir):
+            os.makedirs(self.journal_dir)
+        for csv_file in [self.recogniser_csv_file, self.initial_recognition_file, self.comparison_file]:
+            log_file = self.getRecogLogFile(csv_file) if self.isRecogLogBinary else csv_file
+            if os.path.isfile(log_file):
+                entry["log_sizes"].append([log_file, os.path.getsize(log_file)])
+        segments = AnalysisLog(self.analysis_file).getSegments()
+        if segments:
+            entry["log_sizes"].append([segments[-1][1], os.path.getsize(segments[-1][1])])
+        if self.isImageStore:
+            index_file = ImageStore(self.image_save_dir).index_file
+            entry["log_sizes"].append([index_file, os.path.getsize(index_file) if os.path.isfile(index_file) else 0])
+        if entry["face_db"] is not None:
+            shutil.copy2(self.faceDB, entry["face_db"])
+            
+    def journalRows(self, rows, counter):
+        """Record the likelihoods of the users in rows for the parameter (counter: 0 for F, 1 for G, 2 for A, 3 for H, 4 for T) 
+        in the journal entry before they are changed (once per recognition, the face likelihoods in sparse form)"""
+        entry_rows = self.journal_entry["rows"]
+        for p_index in rows:
+            if p_index < self.journal_entry["num_people"] and (p_index, counter) not in entry_rows:
+                if counter == 0:
+                    entry_rows[(p_index, counter)] = self.likelihoods[0].getRowState(p_index)
+                else:
+                    entry_rows[(p_index, counter)] = self.likelihoods[counter][p_index].tolist()
+                    
+    def commitJournalEntry(self):
+        """Write the journal entry of the recognition: only P(I), the likelihood rows and the occurrences that are changed are kept 
+        (the users enrolled in the recognition are removed on revert, from the number of users before the recognition)"""
+        entry = self.journal_entry
+        self.journal_entry = None
+        prior = entry["prior"]
+        if prior is not None and self.prior_I is not None and len(prior) == len(self.prior_I) and np.array_equal(prior, self.prior_I):
+            prior = None
+        elif prior is not None:
+            prior = prior.tolist()
+        entry["prior"] = prior
+        entry["rows"] = [[p_index, counter, state] for (p_index, counter), state in sorted(entry["rows"].items())]
+        entry["occurrences"] = [[p_index, occurrence] for p_index, occurrence in enumerate(entry["occurrences"]) 
+                                if p_index < len(self.occurrences) and occurrence != self.occurrences[p_index]]
+        self.persist(self.writeJournalEntry, (entry,))
+        
+    def writeJournalEntry(self, entry):
+        """Append the entry to the journal, and remove the oldest entries when there are more than twice journal_max_steps entries"""
+        journal = RecognitionLog(self.journal_file)
+        if self.journal_num_entries is None:
+            self.journal_num_entries = journal.getNumRecords()
+        journal.append(RecognitionLog.JOURNAL, [entry["N"], entry["num_people"], entry["prior"], entry["rows"], entry["occurrences"], entry["log_sizes"], entry["face_db"]])
+        self.journal_num_entries += 1
+        if self.journal_max_steps is not None and self.journal_num_entries > 2*self.journal_max_steps:
+            records = journal.read(RecognitionLog.JOURNAL)
+            for record in records[:-self.journal_max_steps]:
+                if record[6] is not None and os.path.isfile(record[6]):
+                    os.remove(record[6])
+            pruned_journal = RecognitionLog(self.journal_file + ".tmp")
+            if os.path.isfile(pruned_journal.log_file):
+                os.remove(pruned_journal.log_file)
+            for record in records[-self.journal_max_steps:]:
+                pruned_journal.append(RecognitionLog.JOURNAL, record)
+            renameFile(pruned_journal.log_file, self.journal_file)
+            self.journal_num_entries = self.journal_max_steps
+            
+    def revertTo(self, num_steps = 1, isRobot = False):
+        """
+        Revert the last num_steps recognitions (at most journal_max_steps) using the journal: the recognition logs are truncated, 
+        the likelihoods, P(I) and the occurrences are restored, the users enrolled in the reverted recognitions are removed, 
+        and the analysis files and the images of the reverted recognitions are removed. Returns the number of reverted recognitions.
+        If the robot is being used for evaluation, use isRobot = True (the face recognition database before the recognitions is used). Otherwise, if the code is evaluated offline, use isRobot = False.
+        """
+        self.flush()
+        if not self.isBNLoaded:
+            self.loadBN(self.recog_file, self.recogniser_csv_file, self.initial_recognition_file)
+        journal = RecognitionLog(self.journal_file)
+        records = journal.read(RecognitionLog.JOURNAL)
+        num_steps = min(num_steps, len(records))
+        if num_steps == 0:
+            return 0
+        for record in reversed(records[len(records) - num_steps:]):
+            self.undoJournalEntry(record)
+        # the likelihoods are written to a new segment of the analysis log at the next recognition
+        self.analysis_log = None
+        journal.truncate(len(records) - num_steps)
+        self.journal_num_entries = len(records) - num_steps
+        
+        if self.r_bn is None:
+            self.flush()
+            if os.path.isfile(self.recog_file):
+                os.remove(self.recog_file)
+            RecognitionModel(self.getModelFile(self.recog_file)).remove()
+        else:
+            self.persistBN(self.recog_file)
+        face_db = records[len(records) - num_steps][6]
+        if isRobot and face_db is not None:
+            # if robot: set the face recognition database before the recognitions as the current faceDB
+            self.flush()
+            shutil.copy2(face_db, self.faceDB)
+            self.useFaceDetectionDB()
+        return num_steps
+    
+    def undoJournalEntry(self, record):
+        """Revert the changes of the recognition in the journal record"""
+        num_recog, num_people, prior, rows, occurrences, log_sizes, face_db = record
+        self.flush()
+        if self.isImageStore:
+            # the index is read before it is truncated, to find the images of the recognition
+            image_store = self.getImageStore()
+            image_store.load()
+        for log_file, size in log_sizes:
+            if os.path.isfile(log_file):
+                with open(log_file, "r+b") as fd:
+                    fd.truncate(size)
+        # remove the segments of the analysis log that are started after the recognition
+        analysis_log = AnalysisLog(self.analysis_file)
+        last_index = max([analysis_log.getSegmentIndex(log_file) for log_file, _ in log_sizes] + [0])
+        for index, segment_file in analysis_log.getSegments():
+            if index > last_index:
+                os.remove(segment_file)
+        if len(self.i_labels) > num_people:
+            self.removeUsers(num_people)
+        if self.likelihoods is not None:
+            for p_index, counter, state in rows:
+                if counter == 0:
+                    self.likelihoods[0].setRowState(p_index, state)
+                else:
+                    self.likelihoods[counter][p_index] = state
+                self.bn_dirty_rows.add(p_index)
+            if prior is not None:
+                self.setPriorI(prior)
+        for p_index, occurrence in occurrences:
+            self.occurrences[p_index] = occurrence
+            if self.isSaveRecogFiles:
+                self.updateDB(self.db_file, self.i_labels[p_index])
+        self.num_recognitions = num_recog
+        
+        # remove the analysis files and the images of the recognition
+        analys_file = self.analysis_file.replace(".json","") + str(num_recog + 1) + ".json"
+        for analys_file in [analys_file, analys_file.replace(".json", "_2.json")]:
+            if os.path.isfile(analys_file):
+                os.remove(analys_file)
+        if self.isImageStore:
+            image_store.removeRecognition(num_recog + 1)
+        else:
+            for dirpath, dirnames, filenames in os.walk(self.image_save_dir):
+                for filename in filenames:
+                    if filename.startswith(str(num_recog + 1) + "_"):
+                        os.remove(os.path.join(dirpath, filename))
+                    
+    def removeUsers(self, num_people):
+        """Remove the users after the first num_people users (i.e. the users enrolled in the reverted recognitions) from the database and the likelihoods"""
+        if self.isDBinCSV and self.isSaveRecogFiles:
+            user_store = self.getUserStore()
+            for p_id in self.i_labels[num_people:]:
+                self.persistDB(user_store.removeUser, (p_id,))
+        for values in [self.i_labels, self.names, self.genders, self.ages, self.heights, self.times, self.occurrences]:
+            del values[num_people:]
+        self.num_people = num_people
+        self.updateLabelIndex()
+        self.bn_dirty_rows = set(p_index for p_index in self.bn_dirty_rows if p_index < num_people)
+        if num_people < 2:
+            # the network is created when the first user is enrolled
+            self.r_bn = None
+            self.prior_I = None
+            self.likelihoods = None
+            self.likelihood_buffers = None
+            self.likelihood_capacity = 0
+            self.bn_num_people = 0
+        else:
+            self.resizeLikelihoods(num_people)
     
     def revertToLastSaved(self, isRobot):
-        """overwrite the current files with the previously saved files (RecogniserBN.bif, db.csv, RecogniserBN.csv and InitialRecognition.csv)
+        """Revert the last recognition (see revertTo).
         If the robot is being used for evaluation, use isRobot = True. Otherwise, if the code is evaluated offline, use isRobot = False."""
-        copy_tree(self.previous_files_dir, self.recog_folder)
-        num_recog = sum(1 for line in open(self.recogniser_csv_file) ) - 1
-        if isRobot:
-            # if robot: set the previously saved faceDB as the current faceDB
-            self.useFaceDetectionDB()
-
-        if self.isLogMode and self.isSaveRecogFiles:
-            # remove last analysis files
-            analys_dir = self.recog_folder + self.analysis_dir 
-            if os.path.isdir(analys_dir):
-                 # remove last two analysis files
-                analys_file = self.analysis_file.replace(".json","") + str(num_recog) + ".json"
-                analys_file_2 = analys_file.replace(".json", "_2.json")
-                if os.path.isfile(analys_file):
-                    os.remove(analys_file)
-                if os.path.isfile(analys_file_2):
-                    os.remove(analys_file_2)
-        for dirpath, dirnames, filenames in os.walk(self.image_save_dir):
-            # remove image from folder
-            for filename in filenames:
-                if filename.startswith(str(num_recog) + "_"):
-                    os.remove(str(dirpath)+"/"+filename)
-                    break
+        self.revertTo(1, isRobot)
         print "Reverted to the previous recognition files."
  
     def learnFromFile(self, db_list=None, init_list=None, recogs_list=None,
                             db_file = None, init_recog_file = None, final_recog_file = None, 
                             valid_info_file = None, isSaveImageAn = False, orig_image_dir = None):
-        """Creates the network from files/lists. The evidence is fed from existing file or information one by one."""
+        """Creates the network from files/lists. The evidence is fed from existing file or information one by one.
+        The users and the recognitions are indexed by ID and by the number of the recognition (N) once (see groupRecords), so the replay is linear in the number of recognitions."""
         learn_start_time = time.time() 
 
-        if db_list is None and os.path.isfile(db_file):
-            try:
-                df_db = pandas.read_csv(db_file, dtype={"id": object}, converters={"times": ast.literal_eval}, usecols = ["id","name","gender","birthYear","height","times"])
-            except:
-                df_db = pandas.read_csv(db_file, dtype={"id": object}, converters={"times": ast.literal_eval}, usecols = ["id","name","gender","age","height","times"])
+        if db_list is None and self.isDBFile(db_file):
+            df_db = self.readDBFile(db_file)
+            if "birthYear" in df_db.columns:
+                df_db = df_db[["id","name","gender","birthYear","height","times"]]
+            else:
+                df_db = df_db[["id","name","gender","age","height","times"]]
             db_list = df_db.values.tolist()
 
-        if init_list is None and os.path.isfile(init_recog_file):
-            df_init = pandas.read_csv(init_recog_file, dtype={"I_est": object}, converters={"F": ast.literal_eval, "G": ast.literal_eval, "A": ast.literal_eval, "H": ast.literal_eval, "T": ast.literal_eval})
+        if init_list is None and (os.path.isfile(init_recog_file) or os.path.isfile(self.getRecogLogFile(init_recog_file))):
+            df_init = self.readRecogFile(init_recog_file, RecognitionLog.INITIAL, dtype={"I_est": object})
             init_list = df_init.values.tolist()
             
-        if recogs_list is None and os.path.isfile(final_recog_file):
-            df_final = pandas.read_csv(final_recog_file, dtype={"I": object}, converters={"F": ast.literal_eval, "G": ast.literal_eval, "A": ast.literal_eval, "H": ast.literal_eval, "T": ast.literal_eval})
+        if recogs_list is None and (os.path.isfile(final_recog_file) or os.path.isfile(self.getRecogLogFile(final_recog_file))):
+            df_final = self.readRecogFile(final_recog_file, RecognitionLog.RECOGNISER, dtype={"I": object})
             recogs_list = df_final.values.tolist()
             
+        # index the users by ID (the first user with the ID is used) and the recognitions by N, in the order of the lists
+        db_index = {}
+        for x in db_list or []:
+            db_index.setdefault(str(x[0]), x)
+        init_index = self.groupRecords(init_list, 6)
+        recogs_index = self.groupRecords(recogs_list, 7)
+            
         if isSaveImageAn:
 #             df_info = pandas.read_csv(valid_info_file, usecols ={"Bin", "Bin_image", "Validation_image"}).values.tolist()          
             df_info = pandas.read_csv(valid_info_file, usecols ={"Original_image", "Validation_image"}).values.tolist()          
@@ -2307,7 +3337,7 @@ class RecogniserBN:
             person = []
             recog_results = []
             if isAddPersonToDB:    
-                person = [x for x in db_list if str(x[0]) == idPerson][0]
+                person = db_index[idPerson]
                 person[0] = str(person[0])
                 person[1] = str(person[1])
                 isRegistered = False
@@ -2316,7 +3346,7 @@ class RecogniserBN:
             
             if isRegistered:
                 if self.isMultipleRecognitions:
-                    recog_values = [x for x in recogs_list if x[7] == numRecognition]
+                    recog_values = recogs_index.get(numRecognition, [])
                     num_mult_recognitions = len(recog_values)
                     self.setDefinedNumMultRecognitions(num_mult_recognitions)
                     for num_rec in range(0, num_mult_recognitions):
@@ -2327,13 +3357,13 @@ class RecogniserBN:
                     recog_results = recogs_list[count_recogs][1:6]
             else:
                 if self.isMultipleRecognitions:
-                    init_recog_values = [x for x in init_list if x[6] == numRecognition]
+                    init_recog_values = init_index.get(numRecognition, [])
                     num_mult_recognitions = len(init_recog_values)
                     self.setDefinedNumMultRecognitions(num_mult_recognitions)
                     for num_rec in range(0, num_mult_recognitions):
                         recog_results.append(init_recog_values[num_rec][1:6])
                 else:
-                    init_recog_values = [x for x in init_list if x[6] == numRecognition][0]
+                    init_recog_values = init_index.get(numRecognition, [])[0]
                     recog_results = init_recog_values[1:6]
             start_recognising_time = time.time()                                           
             identity_est = self.startRecognition(recog_results) # get the estimated identity from the recognition network
@@ -2356,25 +3386,26 @@ class RecogniserBN:
                         isRecognitionCorrect = True # True if the name is confirmed by the user
                         
             if isSaveImageAn:
-                copy_dir = ""
+                category = ""
                 if isRegistered:
                     if isRecognitionCorrect:
-                        copy_dir = "Known_True/"
+                        category = "Known_True"
                     elif identity_est == self.unknown_var:
-                        copy_dir = "Known_Unknown/"
+                        category = "Known_Unknown"
                     else:
-                        copy_dir = "Known_False/"
+                        category = "Known_False"
                 else:
                     if identity_est == self.unknown_var:
-                        copy_dir = "Unknown_True/"
+                        category = "Unknown_True"
                     else:
-                        copy_dir = "Unknown_False/"
+                        category = "Unknown_False"
                 
 #                 orig_image = orig_image_dir + str(df_info[num_recog][0]) + "/" + df_info[num_recog][1] + ".jpg"
                 orig_image = str(df_info[num_recog][0])
 
                 valid_image = df_info[num_recog][-1]
-                shutil.copy2(orig_image,self.image_save_dir + copy_dir + str(num_recog+1) + "_" + valid_image + ".jpg")
+                # the images of the dataset are not changed, they are hard-linked to the image store
+                self.saveImage(orig_image, self.image_save_dir, category, str(num_recog+1) + "_" + valid_image, num_recog+1, isLink = True)
                                         
             if isRecognitionCorrect:
                 self.confirmPersonIdentity(recog_results_from_file = recog_results) # save the network, analysis data, csv for learning and picture of the person in the tablet
@@ -2384,7 +3415,7 @@ class RecogniserBN:
                     num_unknown += 1
                     recog_results = []
                     if self.isMultipleRecognitions:
-                        recog_values = [x for x in recogs_list if x[7] == numRecognition]
+                        recog_values = recogs_index.get(numRecognition, [])
                         num_mult_recognitions = len(recog_values)
                         self.setDefinedNumMultRecognitions(num_mult_recognitions)
                         for num_recog in range(0, num_mult_recognitions):
@@ -2407,6 +3438,13 @@ class RecogniserBN:
             print "time to learn:" + str(time.time() - learn_start_time) 
         return stats_openSet, stats_FR, num_recog, numNoFaceImages/(num_recog+numNoFaceImages), num_unknown
 
+    def groupRecords(self, records, column):
+        """Group the records (rows of the recognition files) by the value in the column (e.g. 7 for N in RecogniserBN.csv), keeping the order of the records in each group"""
+        groups = {}
+        for record in records or []:
+            groups.setdefault(record[column], []).append(record)
+        return groups
+    
     def saveRecogniserCSV(self, recogniser_csv_file, identity_real, num_recog=None):
         """Save real identity (I), the recognition values from each identifier (F,G,A,H,T) and registration status (R), and number of the recognition (N)"""
         self.recogniser_csv_file = recogniser_csv_file
@@ -2420,16 +3458,8 @@ class RecogniserBN:
             i = ""
             r = ""
         num_rr = self.num_recognitions + 1
-        df = pandas.DataFrame.from_items([('I', [i]), 
-                                          ('F', [self.nonweighted_evidence[0]]), 
-                                          ('G', [self.nonweighted_evidence[1]]),
-                                          ('A', [self.nonweighted_evidence[2]]),
-                                          ('H', [self.nonweighted_evidence[3]]),
-                                          ('T', [self.nonweighted_evidence[4]]),
-                                          ('R', [r]),
-                                          ('N', [num_rr])])
-        with open(recogniser_csv_file, 'a') as fd:
-            df.to_csv(fd, index=False, header=False)
+        row = [i] + self.nonweighted_evidence[:5] + [r, num_rr]
+        self.appendRecogFile(recogniser_csv_file, RecognitionLog.RECOGNISER, row)
     
     def saveInitialRecognitionCSV(self, initial_recognition_file, recog_results, identity_est):
         """Save estimated identity (I), initial recognition values (before registration, if user hasn't enrolled yet, or equal to the values in recogniserBN.csv) (F,G,A,H,T) 
@@ -2438,23 +3468,10 @@ class RecogniserBN:
         
         num_rr = self.num_recognitions + 1
         if recog_results:
-            df = pandas.DataFrame.from_items([('I_est', [identity_est]), 
-                                          ('F', [recog_results[0][:]]), 
-                                          ('G', [recog_results[1][:]]),
-                                          ('A', [recog_results[2][:]]),
-                                          ('H', [recog_results[3][:]]),
-                                          ('T', [recog_results[4][:]]),
-                                          ('N', [num_rr])])
-        else:
-            df = pandas.DataFrame.from_items([('I_est', [identity_est]), 
-                                          ('F', [[]]), 
-                                          ('G', [[]]),
-                                          ('A', [[]]),
-                                          ('H', [[]]),
-                                          ('T', [[]]),
-                                          ('N', [num_rr])])
-        with open(initial_recognition_file, 'a') as fd:
-            df.to_csv(fd, index=False, header=False)
+            row = [identity_est] + [recog_results[counter][:] for counter in range(0, 5)] + [num_rr]
+        else:
+            row = [identity_est, [], [], [], [], [], num_rr]
+        self.appendRecogFile(initial_recognition_file, RecognitionLog.INITIAL, row)
             
     def saveComparisonCSV(self, comparison_file, identity_real, identity_est, face_est, posterior_average, face_prob, calc_time, quality):
         """Save comparison file between estimated network and face recognition: 
@@ -2471,18 +3488,108 @@ class RecogniserBN:
             highest_f =  max(face_prob[1:])
         else:
             highest_f = ""
-        df = pandas.DataFrame.from_items([('I_real', [identity_real]), 
-                                          ('I_est', [identity_est]),
-                                          ('F_est', [face_est]),
-                                          ('I_prob', [posterior_average]),
-                                          ('F_prob', [face_prob]),
-                                          ('Calc_time', [float("{0:.2f}".format(calc_time))]),
-                                          ('R', [r]),
-                                          ('Quality',[quality]),
-                                          ('Highest_I_prob', max(posterior_average)),
-                                          ('Highest_F_prob',highest_f)])
-        with open(comparison_file, 'a') as fd:
-            df.to_csv(fd, index=False, header=False)
+        row = [identity_real, identity_est, face_est, posterior_average, face_prob, float("{0:.2f}".format(calc_time)), r, quality, max(posterior_average), highest_f]
+        self.appendRecogFile(comparison_file, RecognitionLog.COMPARISON, row)
+        
+    def appendRecogFile(self, csv_file, record_type, row):
+        """Append the row to the binary log of the CSV file (see getRecogLogFile) if isRecogLogBinary, otherwise to the CSV file"""
+        if self.persistence_queue is not None:
+            row = copy.deepcopy(row)
+        self.persist(self.writeRecogFile, (csv_file, record_type, row, self.isRecogLogBinary))
+        
+    def writeRecogFile(self, csv_file, record_type, row, isRecogLogBinary):
+        """Write the row to the binary log of the CSV file or to the CSV file"""
+        if isRecogLogBinary:
+            RecognitionLog(self.getRecogLogFile(csv_file)).append(record_type, row)
+        else:
+            df = pandas.DataFrame.from_items([(column, [value]) for column, value in zip(RecognitionLog.COLUMNS[record_type], row)])
+            with open(csv_file, 'a') as fd:
+                df.to_csv(fd, index=False, header=False)
+                
+    def getRecogLogFile(self, csv_file):
+        """Get the binary log file of the CSV file (e.g. RecogniserBN.log for RecogniserBN.csv)"""
+        return os.path.splitext(csv_file)[0] + ".log"
+    
+    def getNumRecogRecords(self, csv_file, record_type):
+        """Get the number of rows in the recognition file (from the binary log of the CSV file if it exists and isRecogLogBinary)"""
+        log_file = self.getRecogLogFile(csv_file)
+        if self.isRecogLogBinary and os.path.isfile(log_file):
+            return RecognitionLog(log_file).getNumRecords(record_type)
+        if os.path.isfile(csv_file):
+            return max(sum(1 for line in open(csv_file)) - 1, 0)
+        return 0
+    
+    def readRecogFile(self, csv_file, record_type, usecols = None, dtype = None):
+        """Read the recognition records as a DataFrame from the binary log of the CSV file if it exists and isRecogLogBinary, otherwise from the CSV file
+        (the lists in the columns F, G, A, H, T are parsed as in ast.literal_eval, with the cached arrays of RecognitionCSV). 
+        Empty fields are NaN, and the other columns have the types of pandas.read_csv (with dtype) in both cases. 
+        The columns I_prob and F_prob of Comparison.csv are returned as lists of numbers (pandas.read_csv returns them as strings)"""
+        self.flush()
+        columns = RecognitionLog.COLUMNS[record_type]
+        if usecols is None:
+            usecols = columns
+        df_columns = [column for column in columns if column in usecols]
+        recog_csv = RecognitionCSV(csv_file, record_type)
+        log_file = self.getRecogLogFile(csv_file)
+        if self.isRecogLogBinary and os.path.isfile(log_file):
+            recog_log = RecognitionLog(log_file)
+            indices = [columns.index(column) for column in df_columns]
+            rows = []
+            for log_row in recog_log.read(record_type):
+                row = []
+                for index in indices:
+                    value = log_row[index]
+                    if value is None or value == "":
+                        row.append(None)
+                    elif recog_csv.isListColumn(columns[index]):
+                        row.append(value)
+                    else:
+                        # the values are converted from their text in the CSV file, as the values read from the CSV file
+                        row.append(recog_log.formatCSV(value))
+                rows.append(row)
+        else:
+            try:
+                rows = recog_csv.getRows(recog_csv.read(), usecols)
+            except ValueError:
+                logging.warning("The columns of " + csv_file + " are not in the format of the recognition files, the file is read with ast.literal_eval.")
+                converters = dict((column, ast.literal_eval) for column in ["F", "G", "A", "H", "T"] if column in usecols)
+                return pandas.read_csv(csv_file, dtype = dtype, usecols = usecols, converters = converters)
+        df = pandas.DataFrame([[np.nan if value is None else value for value in row] for row in rows], columns = df_columns)
+        for column in df_columns:
+            if recog_csv.isListColumn(column):
+                continue
+            # types of the columns as in pandas.read_csv
+            if dtype is not None and column in dtype:
+                df[column] = df[column].astype(dtype[column])
+            else:
+                df[column] = pandas.to_numeric(df[column], errors = "ignore")
+        return df
+    
+    def readRecogArrays(self, csv_file, record_type):
+        """Read the recognition records as typed arrays (see RecognitionCSV.getArrays) from the binary log of the CSV file if it exists and isRecogLogBinary, 
+        otherwise from the CSV file (the arrays are cached in a sidecar file, see RecognitionCSV)"""
+        self.flush()
+        log_file = self.getRecogLogFile(csv_file)
+        if self.isRecogLogBinary and os.path.isfile(log_file):
+            return RecognitionCSV(csv_file, record_type).getArrays(RecognitionLog(log_file).read(record_type))
+        return RecognitionCSV(csv_file, record_type).read()
+    
+    def exportImages(self):
+        """Write the images of the image store to the folders of the categories (e.g. images/Known_True/3_2_1.jpg), see ImageStore.exportImages"""
+        self.flush()
+        self.getImageStore().exportImages()
+        
+    def getRecogFiles(self):
+        """Get the recognition files (RecogniserBN.csv, InitialRecognition.csv and Analysis/Comparison.csv) with their record types"""
+        return [(self.recogniser_csv_file, RecognitionLog.RECOGNISER), (self.initial_recognition_file, RecognitionLog.INITIAL), (self.comparison_file, RecognitionLog.COMPARISON)]
+    
+    def exportRecogLogs(self):
+        """Write the CSV files (RecogniserBN.csv, InitialRecognition.csv and Analysis/Comparison.csv) from the binary logs"""
+        self.flush()
+        for csv_file, record_type in self.getRecogFiles():
+            log_file = self.getRecogLogFile(csv_file)
+            if os.path.isfile(log_file):
+                RecognitionLog(log_file).exportToCSV(csv_file, record_type)
 
     def saveDB(self, db_file, person):
         """Save database to csv or to Mongo DB: id, name, gender, birthYear, height, times, occurrence"""
@@ -2496,23 +3603,84 @@ class RecogniserBN:
 #             db_handler.add_person(person_dict)         
             
     def saveDBToCSV(self, db_file, person):
-        """Save database to csv: id, name, gender, birthYear, height, times, occurrence"""
-        df = pandas.DataFrame.from_items([('id', [person[0]]),
-                                          ('name', [person[1]]), 
-                                          ('gender', [person[2]]), 
-#                                           ('age', [person[3]]),
-                                          ('birthYear', [person[3]]),
-                                          ('height', [person[4]]),
-                                          ('times', [person[5]]),
-                                          ('occurrence', [self.occurrences[self.i_labels.index(person[0])]])])
-        self.db_df = self.db_df.append(df, ignore_index=True)      
-        with open(db_file, 'a') as fd:
-            df.to_csv(fd, index=False, header=False)
+        """Save the user to the user database of the csv file (see getUserStore): id, name, gender, birthYear, height, times, occurrence"""
+        self.persistDB(self.getUserStore(db_file).addUser, (copy.deepcopy(person), list(self.occurrences[self.getLabelIndex(person[0])])), db_file)
+
+    def getUserStoreFile(self, db_file):
+        """Get the SQLite user database file of the csv file (e.g. db.sqlite for db.csv)"""
+        return os.path.splitext(db_file)[0] + ".sqlite"
+    
+    def openUserStore(self, db_file):
+        """Open the user database of the csv file: SQLiteUserStore if isUserStoreSQLite (db_file is imported if the SQLite file doesn't exist or is older, see importChangedDB), 
+        CSVUserStore otherwise"""
+        if not self.isUserStoreSQLite:
+            return CSVUserStore(db_file)
+        store_file = self.getUserStoreFile(db_file)
+        isNewStore = not os.path.isfile(store_file)
+        user_store = SQLiteUserStore(store_file)
+        if isNewStore and os.path.isfile(db_file):
+            user_store.importFromCSV(db_file)
+        else:
+            self.importChangedDB(user_store, db_file)
+        return user_store
+    
+    def importChangedDB(self, user_store, db_file):
+        """Import the csv file to the SQLite user database if the file was changed after it was exported or imported and it is newer than the database (e.g. edited by hand)"""
+        if os.path.isfile(db_file) and os.path.getmtime(db_file) > os.path.getmtime(user_store.store_file) and user_store.isCSVChanged(db_file):
+            logging.warning(db_file + " is newer than " + user_store.store_file + ", the users are imported from " + db_file + ".")
+            user_store.importFromCSV(db_file)
+        
+    def getUserStore(self, db_file = None):
+        """Get the user database of the csv file (db_file by default), which is kept open until another file is used"""
+        if db_file is None:
+            db_file = self.db_file
+        store_file = self.getUserStoreFile(db_file) if self.isUserStoreSQLite else db_file
+        if self.user_store is None or self.user_store.store_file != store_file:
+            self.closeUserStore()
+            self.user_store = self.openUserStore(db_file)
+        return self.user_store
+    
+    def closeUserStore(self):
+        """Close the open user database (after the queued writes are applied)"""
+        self.flush()
+        if self.user_store is not None:
+            self.user_store.close()
+            self.user_store = None
+            
+    def isDBFile(self, db_file):
+        """Check if the user database of the csv file exists (SQLite file if isUserStoreSQLite, or the csv file)"""
+        return os.path.isfile(db_file) or (self.isUserStoreSQLite and os.path.isfile(self.getUserStoreFile(db_file)))
+    
+    def readDBFile(self, db_file):
+        """Read the users of the user database of the csv file as a DataFrame (from the SQLite file if it exists and isUserStoreSQLite, otherwise from the csv file)"""
+        self.flush()
+        if self.user_store is not None and self.user_store.store_file == (self.getUserStoreFile(db_file) if self.isUserStoreSQLite else db_file):
+            if self.isUserStoreSQLite:
+                self.importChangedDB(self.user_store, db_file)
+            return self.user_store.getUsers()
+        if self.isUserStoreSQLite and os.path.isfile(self.getUserStoreFile(db_file)):
+            user_store = self.openUserStore(db_file)
+        else:
+            user_store = CSVUserStore(db_file)
+        db_df = user_store.getUsers()
+        user_store.close()
+        return db_df
+    
+    def exportDB(self):
+        """Write db.csv from the SQLite user database"""
+        self.flush()
+        if self.isUserStoreSQLite and self.isDBFile(self.db_file):
+            self.getUserStore().exportToCSV(self.db_file)
             
     def getAnalysisData(self, recog_results, identity_real, ie):
         """Get results of all the parameters in the system for analysis: 
         Database (identity labels in the database), image_id, I_real (real identity), I_est (estimated identity), 
         for all parameters I, F, G, A, H, T: cpt (likelihood in the network before update), posterior (inference posterior result), recognition results"""
+        return self.combineAnalysisData(self.getAnalysisResults(recog_results, identity_real, ie), self.i_labels, self.prior_I, self.likelihoods)
+    
+    def getAnalysisResults(self, recog_results, identity_real, ie):
+        """Get the results of the recognition for analysis (see getAnalysisData) without the database and the likelihoods: 
+        Date, Image_id, I_real, I_est, and for all parameters I, F, G, A, H, T: posterior, recognition results (except I)"""
         i_post = ie.posterior(self.I)[:]
         i_max_cpt = np.max(ie.posterior(self.I)[:])
         identity_est = self.i_labels[np.argmax(ie.posterior(self.I)[:])]
@@ -2528,38 +3696,48 @@ class RecogniserBN:
         date_now = str(datetime.strptime(date_today, '%d %B %Y %H:%M:%S'))          
         if self.image_id is None:
             self.image_id = identity_real + "_" + "0001"
-        data = OrderedDict([("Date", date_now),
-                ("Database", self.i_labels),
+        results = OrderedDict([("Date", date_now),
                 ("Image_id", self.image_id),
                 ("I_real", identity_real),
                 ("I_est", [identity_est, i_max_cpt]),
-                ("I_cpt", self.r_bn.cpt(self.I)[:].tolist()),
-                ("I_posterior", ie.posterior(self.I)[:].tolist()),
-                ("F_est", recog_results[0]),
-                ("F_cpt", self.r_bn.cpt(self.F)[:].tolist()),
-                ("F_posterior", ie.posterior(self.F)[:].tolist()),
-                ("G_est", recog_results[1]),
-                ("G_cpt", self.r_bn.cpt(self.G)[:].tolist()),
-                ("G_posterior", ie.posterior(self.G)[:].tolist()),
-                ("A_est", recog_results[2]),
-                ("A_cpt", self.r_bn.cpt(self.A)[:].tolist()),
-                ("A_posterior", ie.posterior(self.A)[:].tolist()),
-                ("H_est", recog_results[3]),
-                ("H_cpt", self.r_bn.cpt(self.H)[:].tolist()),
-                ("H_posterior", ie.posterior(self.H)[:].tolist()),
-                ("T_est", recog_results[4]),
-                ("T_cpt", self.r_bn.cpt(self.T)[:].tolist()),
-                ("T_posterior", ie.posterior(self.T)[:].tolist())])
-        
+                ("I_posterior", ie.posterior(self.I)[:].tolist())])
+        for counter in range(1, len(self.node_names)):
+            name_param = self.node_names[counter]
+            results[name_param + "_est"] = recog_results[counter - 1]
+            results[name_param + "_posterior"] = ie.posterior(self.node_ids[name_param])[:].tolist()
+        return results
+    
+    def combineAnalysisData(self, results, i_labels, prior, likelihoods):
+        """Get the analysis data (see getAnalysisData) from the results of the recognition (see getAnalysisResults), the labels, P(I) and the likelihoods"""
+        data = OrderedDict([("Date", results["Date"]),
+                ("Database", i_labels),
+                ("Image_id", results["Image_id"]),
+                ("I_real", results["I_real"]),
+                ("I_est", results["I_est"]),
+                ("I_cpt", prior.tolist()),
+                ("I_posterior", results["I_posterior"])])
+        for counter in range(1, len(self.node_names)):
+            name_param = self.node_names[counter]
+            data[name_param + "_est"] = results[name_param + "_est"]
+            data[name_param + "_cpt"] = likelihoods[counter - 1].tolist()
+            data[name_param + "_posterior"] = results[name_param + "_posterior"]
         return data
     
     def saveAnalysisFile(self, recog_results, identity_real, ie, isPrevSavedToAnalysis, num_recog = None):
-        if self.isDBinCSV:
-            if num_recog:
+        if self.isDBinCSV and self.isAnalysisSampled(self.num_recognitions + 1):
+            if self.isAnalysisLogBinary:
+                self.appendAnalysisLog(self.getAnalysisResults(recog_results, identity_real, ie), isPrevSavedToAnalysis)
+            elif num_recog:
                 self.saveAnalysisToJson(recog_results, identity_real, ie, isPrevSavedToAnalysis, num_recog = num_recog)
             else:
                 self.saveAnalysisToJson(recog_results, identity_real, ie, isPrevSavedToAnalysis)
 
+    def isAnalysisSampled(self, num_recog):
+        """Is the analysis of the recognition num_recog saved (analysis_sample_rate of the recognitions are saved, at equal intervals)"""
+        if self.analysis_sample_rate >= 1:
+            return True
+        return math.floor(num_recog*self.analysis_sample_rate) > math.floor((num_recog - 1)*self.analysis_sample_rate)
+
     def saveAnalysisToJson(self, recog_results, identity_real, ie, isPrevSavedToAnalysis, num_recog = None):
         """Save analysis to json file"""
                 
@@ -2577,39 +3755,79 @@ class RecogniserBN:
                 a.append(dt)
                 num_file = self.num_recognitions + 1
                 
-            if isPrevSavedToAnalysis:
-                fname = self.analysis_file.replace(".json","") + str(num_file) + "_2.json"
-            else:
-                fname = self.analysis_file.replace(".json","") + str(num_file) + ".json"
-            with open(fname, mode='w') as f:
-                f.write(json.dumps(a, ensure_ascii=False, indent=2))
-
+            self.persist(self.writeTextFile, (self.getAnalysisFile(num_file, isPrevSavedToAnalysis), json.dumps(a, ensure_ascii=False, indent=2)))
+
+    def getAnalysisFile(self, num_file, isPrevSavedToAnalysis):
+        """Get the JSON file of the analysis of the recognition num_file (Analysis<num_file>.json, or Analysis<num_file>_2.json if the analysis is saved before)"""
+        if isPrevSavedToAnalysis:
+            return self.analysis_file.replace(".json","") + str(num_file) + "_2.json"
+        return self.analysis_file.replace(".json","") + str(num_file) + ".json"
+        
+    def getAnalysisLog(self):
+        """Get the analysis log of the session (see AnalysisLog)"""
+        if self.analysis_log is None:
+            self.flush()
+            self.analysis_log = AnalysisLog(self.analysis_file, self.analysis_max_records, self.analysis_max_segments)
+        return self.analysis_log
     
-    def saveConfusionMatrix(self, comparison_file=None, conf_matrix_file=None):
-        """Save confusion matrix to file for both face recognition and network results"""
+    def appendAnalysisLog(self, results, isPrevSavedToAnalysis):
+        """Append the results of the recognition (see getAnalysisResults) to the analysis log, 
+        with the likelihoods that are changed since the last record (see AnalysisLog.getRecords)"""
+        if self.persistence_queue is not None:
+            results = copy.deepcopy(results)
+        analysis_log = self.getAnalysisLog()
+        segment_file, records = analysis_log.getRecords(self, results, self.num_recognitions + 1, isPrevSavedToAnalysis)
+        self.persist(analysis_log.writeRecords, (segment_file, records))
+        
+    def exportAnalysisLogs(self):
+        """Write the JSON files of the recognitions (Analysis<N>.json, in the format of saveAnalysisToJson) from the analysis log"""
+        self.flush()
+        analysis_file = None
+        a = []
+        for num_file, isPrevSavedToAnalysis, results, i_labels, prior, likelihoods in AnalysisLog(self.analysis_file).read():
+            fname = self.getAnalysisFile(num_file, isPrevSavedToAnalysis)
+            if fname != analysis_file:
+                if a:
+                    self.writeTextFile(analysis_file, json.dumps(a, ensure_ascii=False, indent=2))
+                analysis_file = fname
+                a = []
+            a.append(self.combineAnalysisData(results, i_labels, prior, likelihoods))
+        if a:
+            self.writeTextFile(analysis_file, json.dumps(a, ensure_ascii=False, indent=2))
+
+    def getConfusionMatrices(self, comparison_file=None):
+        """Get the confusion matrices of the network and face recognition from the comparison file: the number of recognitions of each real identity (row) 
+        estimated as each identity (column), in the order of i_labels, and the number of recognitions of the real identity in the last column"""
         if comparison_file is None:
             comparison_file = self.comparison_file
-        if conf_matrix_file is None:
-            conf_matrix_file = self.conf_matrix_file
-                        
-        df_comp = pandas.read_csv(comparison_file, usecols =["I_real", "I_est", "F_est", "R"])
+        df_comp = self.readRecogFile(comparison_file, RecognitionLog.COMPARISON, usecols =["I_real", "I_est", "F_est", "R"])
         comp_list = df_comp.values.tolist()
         conf_matrices = [[[0 for _ in range(0, self.num_people+1)] for i in range(0, self.num_people)] for j in range(0,2)]
         for num_recog in range(0, len(comp_list)):
             i_real = comp_list[num_recog][0]
-            real_ind = self.i_labels.index(str(i_real))
+            real_ind = self.getLabelIndex(str(i_real))
             for num_estimator in range(0, 2): # I and F
                 identity_est = comp_list[num_recog][num_estimator+1]
-                est_ind = self.i_labels.index(str(identity_est))
+                est_ind = self.getLabelIndex(str(identity_est))
                 if comp_list[num_recog][-1] == 1: # unknown
                     conf_matrices[num_estimator][0][est_ind] += 1
                     conf_matrices[num_estimator][0][-1] += 1
-                    if identity_est != int(self.unknown_var):
+                    if str(identity_est) != self.unknown_var:
                         conf_matrices[num_estimator][real_ind][est_ind] += 1
                         conf_matrices[num_estimator][real_ind][-1] += 1          
                 else:
                     conf_matrices[num_estimator][real_ind][est_ind] += 1
                     conf_matrices[num_estimator][real_ind][-1] += 1
+        return conf_matrices
+    
+    def saveConfusionMatrix(self, comparison_file=None, conf_matrix_file=None):
+        """Save confusion matrix to file for both face recognition and network results"""
+        if comparison_file is None:
+            comparison_file = self.comparison_file
+        if conf_matrix_file is None:
+            conf_matrix_file = self.conf_matrix_file
+                        
+        conf_matrices = self.getConfusionMatrices(comparison_file)
         percent_conf_matrices = [[[0 for _ in range(0, self.num_people+1)] for i in range(0, self.num_people)] for j in range(0,2)]
         for num_estimator in range(0, 2): # I and F
             conf_matrix = conf_matrices[num_estimator][:]
@@ -2667,19 +3885,22 @@ class RecogniserBN:
                     row_counter += 1
                 
     def copyNetworkDBFromValidation(self, val_folder, test_folder):
-        """Copy network (bif file) and db (db.csv) from training folder to test folder"""
-        shutil.copy2(val_folder+self.recog_file, test_folder)
-        df_db = pandas.read_csv(val_folder+self.db_file, dtype={"id": object}) 
+        """Copy network (binary model or bif file) and db (db.csv) from training folder to test folder"""
+        self.flush()
+        model_file = self.getModelFile(self.recog_file)
+        if os.path.isdir(val_folder+model_file):
+            RecognitionModel(test_folder+model_file).remove()
+            shutil.copytree(val_folder+model_file, test_folder+model_file)
+        if os.path.isfile(val_folder+self.recog_file):
+            shutil.copy2(val_folder+self.recog_file, test_folder)
+        self.closeUserStore()
+        df_db = self.readDBFile(val_folder+self.db_file)
         db_list = df_db.values.tolist()
-        with open(test_folder+self.db_file, 'wb') as outcsv:
-            writer = csv.writer(outcsv)
-            writer.writerow(df_db.columns.values) 
-
         for person in db_list:
             person[-1] = [1,1,1]
-            with open(test_folder+self.db_file, 'a') as outcsv:
-                writer = csv.writer(outcsv)
-                writer.writerow(person)
+        user_store = self.openUserStore(test_folder+self.db_file)
+        user_store.setUsers(pandas.DataFrame(db_list, columns = df_db.columns))
+        user_store.close()
 
     #---------------------------------------------STATS FUNCTIONS---------------------------------------------#
 
@@ -2758,6 +3979,78 @@ class RecogniserBN:
                     
         return stats, stats_percent, stats_graph
         
+    def recordQualitySweep(self, identity_real):
+        """Record the real identity, the estimated identity, the identity with the highest posterior, the two highest posteriors, the quality of the estimation, 
+        the registration status (R in RecogniserBN.csv) and whether the estimate depends on the quality threshold (i.e. not under the minimum number of recognitions) 
+        for the quality threshold sweep (see getQualitySweep)"""
+        i_post = self.identity_est_prob
+        two_largest = heapq.nlargest(2, i_post) + [0.0]
+        isThresholded = len(i_post) > 1 and self.quality_estimate >= 0 and not (self.isUseFaceRecogEstForMinRecog and self.num_recognitions < self.num_recog_min)
+        r = 1 if self.isAddPersonToDB else 0
+        self.quality_sweep_records.append([str(identity_real), str(self.identity_est), str(self.i_labels[int(np.argmax(i_post))]), 
+                                           two_largest[0], two_largest[1], self.quality_estimate, r, isThresholded])
+        
+    def getQualitySweep(self, quality_thresholds = None):
+        """
+        Get the open-set curve of the network for the quality thresholds from the recognitions recorded once (see setQualitySweep), without repeating the recognitions:
+        for each threshold, the identity is estimated as the identity with the highest posterior if the quality is greater than or equal to the threshold (and not 0), 
+        otherwise as unknown (see getEstimatedIdentity). The thresholds are the qualities of the recognitions (and inf, where all are estimated as unknown) by default.
+        Returns a DataFrame with the quality threshold, DIR and FAR (see getDIRFAR) and the counts of getDetailedRecogRates 
+        (TP, TN, FP_another, FP_unknown, FN) for each threshold, in increasing order of the threshold
+        """
+        records = self.quality_sweep_records or []
+        num_recog = len(records)
+        quality = np.array([record[5] for record in records], dtype=float)
+        isThresholded = np.array([record[7] for record in records], dtype=bool)
+        if quality_thresholds is None:
+            quality_thresholds = np.append(np.unique(quality[isThresholded & (quality > 0)]), np.inf)
+        quality_thresholds = np.sort(np.array(quality_thresholds, dtype=float))
+        # the recognitions with quality 0 are estimated as unknown for any threshold
+        quality = np.where(quality == 0, -np.inf, quality)
+        
+        # the outcome (TP, TN, FP_another, FP_unknown, FN, DIR count, FAR count) of each recognition if the estimate is accepted or rejected (unknown) by the threshold
+        outcomes = np.zeros((3, num_recog, 7), dtype=int)
+        for count in range(0, num_recog):
+            i_real, i_est, i_top, _, _, _, r, _ = records[count]
+            for num_outcome, identity_est in enumerate([i_top, self.unknown_var, i_est]):
+                outcomes[num_outcome, count] = self.getRecognitionOutcome(identity_est, i_real, r)
+        
+        # number of recognitions (with the estimate depending on the threshold) accepted for each threshold: the quality is sorted once and searched for all thresholds
+        counts = np.sum(outcomes[2][~isThresholded], axis=0) * np.ones((len(quality_thresholds), 1), dtype=int)
+        for num_outcome in range(0, 7):
+            for accepted, outcome in [(True, outcomes[0]), (False, outcomes[1])]:
+                sorted_quality = np.sort(quality[isThresholded & (outcome[:, num_outcome] == 1)])
+                num_accepted = len(sorted_quality) - np.searchsorted(sorted_quality, quality_thresholds, side="left")
+                counts[:, num_outcome] += num_accepted if accepted else len(sorted_quality) - num_accepted
+        
+        num_unknown = sum(record[6] for record in records)
+        rates = [self.getDIRFAR(list(count[5:]), num_recog, num_unknown) for count in counts]
+        sweep = pandas.DataFrame(counts[:, :5], columns = ["TP", "TN", "FP_another", "FP_unknown", "FN"])
+        sweep.insert(0, "Quality_threshold", quality_thresholds)
+        sweep.insert(1, "DIR", [rate[0] for rate in rates])
+        sweep.insert(2, "FAR", [rate[1] for rate in rates])
+        return sweep
+    
+    def getRecognitionOutcome(self, identity_est, identity_real, isRegistering):
+        """Get the outcome of the recognition as in getDetailedRecogRates (true positive, true negative, false positive for another user, false positive for an unknown user, 
+        false negative) and getPerformanceMetrics (correct known recognition, incorrect unknown recognition), as a list of 0 and 1"""
+        outcome = [0, 0, 0, 0, 0, 0, 0]
+        if identity_real == identity_est:
+            outcome[0] = 1
+        elif identity_est == self.unknown_var and isRegistering:
+            outcome[1] = 1
+        elif identity_est == self.unknown_var and not isRegistering:
+            outcome[4] = 1
+        elif identity_est != self.unknown_var and isRegistering:
+            outcome[3] = 1
+        else:
+            outcome[2] = 1
+        if not isRegistering and identity_est == identity_real:
+            outcome[5] = 1
+        elif isRegistering and identity_est != self.unknown_var:
+            outcome[6] = 1
+        return outcome
+        
     def getHeightStddev(self, recogniser_csv_file=None):
         """
         Get standard deviation of height from recognition file. 
@@ -2766,8 +4059,7 @@ class RecogniserBN:
         if recogniser_csv_file is None:
             recogniser_csv_file = self.recogniser_csv_file
 
-        df = pandas.read_csv(recogniser_csv_file, dtype={"I": object}, usecols =["I", "H"], converters={"H": ast.literal_eval})
-        group_v = df.loc[:,['I','H']].groupby('I')
+        arrays = self.readRecogArrays(recogniser_csv_file, RecognitionLog.RECOGNISER)
         std_dev = [0.0 for i in range(1, len(self.i_labels))]
         std_dev_est = [0.0 for i in range(1, len(self.i_labels))]
 
@@ -2775,25 +4067,11 @@ class RecogniserBN:
 
         for counter in range(1,len(self.i_labels)):
             true_height = float(self.heights[counter])
-            gr = group_v.get_group(self.i_labels[counter])
-            avg_val = 0
-            for g_counter in range(0, len(gr)):
-                l_val = gr.iloc[g_counter,1]
-                est = l_val[0]
-                std_dev[counter-1] += math.pow(est - true_height, 2)
-                avg_val += est
- 
-            if len(gr) > 0:
-                std_dev[counter-1] = math.sqrt(std_dev[counter-1]/len(gr))            
-                avg_val /= len(gr)
-                 
-            for g_counter in range(0, len(gr)):
-                l_val = gr.iloc[g_counter,1]
-                est = l_val[0]
-                std_dev_est[counter-1] += math.pow(est - avg_val, 2)
-                 
-            if len(gr) > 1:
-                std_dev_est[counter-1] = math.sqrt(std_dev_est[counter-1]/(len(gr)-1))
+            estimates = arrays["H_mean"][arrays["I"] == self.i_labels[counter]]
+            if len(estimates) > 0:
+                std_dev[counter-1] = math.sqrt(np.sum(np.square(estimates - true_height))/len(estimates))
+            if len(estimates) > 1:
+                std_dev_est[counter-1] = math.sqrt(np.sum(np.square(estimates - np.mean(estimates)))/(len(estimates)-1))
             
         return std_dev, std_dev_est
     
@@ -2807,8 +4085,8 @@ class RecogniserBN:
         if initial_recognition_file is None:
             initial_recognition_file = self.initial_recognition_file
 
-        df_final = pandas.read_csv(recogniser_csv_file, dtype={"I": object}, usecols =["I", "A", "R", "N"], converters={"A": ast.literal_eval})
-        df_init = pandas.read_csv(initial_recognition_file, usecols =["I_est", "A", "N"], converters={"A": ast.literal_eval})
+        df_final = self.readRecogFile(recogniser_csv_file, RecognitionLog.RECOGNISER, usecols =["I", "A", "R", "N"], dtype={"I": object})
+        df_init = self.readRecogFile(initial_recognition_file, RecognitionLog.INITIAL, usecols =["I_est", "A", "N"])
         self.loadDB(self.db_file)        
 
         recogs_list = df_final.values.tolist()
@@ -2817,13 +4095,13 @@ class RecogniserBN:
         stddev_est_list = [0.0 for i in range(1, len(self.i_labels))]    
         avg_val = [0.0 for i in range(1, len(self.i_labels))]
         estimates_mean = [[] for i in range(1, len(self.i_labels))]
-        estimates_stddev = [[] for i in range(1, len(self.i_labels))]
+        estimates_conf = [[] for i in range(1, len(self.i_labels))]
 
         while count_recogs < len(recogs_list):
             isRegistered =  not recogs_list[count_recogs][2]# False if register button is pressed (i.e. if the person starts the session for the first time)
             numRecognition = recogs_list[count_recogs][3]
             p_id = recogs_list[count_recogs][0]
-            p_id_index = self.i_labels.index(p_id)
+            p_id_index = self.getLabelIndex(p_id)
 
 
             if not isRegistered:
@@ -2835,12 +4113,8 @@ class RecogniserBN:
                         est_mean = init_recog_est[num_recog][1][0]
                         est_conf = init_recog_est[num_recog][1][1]
                         if est_conf > 0:  
-                            if est_conf == 1.0:
-                                est_stddev = 0.0
-                            else:
-                                est_stddev = 0.5/self.normppf(est_conf + (1-est_conf)/2.0)
                             estimates_mean[p_id_index-1].append(est_mean)
-                            estimates_stddev[p_id_index-1].append(est_stddev)
+                            estimates_conf[p_id_index-1].append(est_conf)
                             # stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2) + math.pow(est_stddev,2)
                             stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2)
                             avg_val[p_id_index-1] += est_mean
@@ -2850,12 +4124,8 @@ class RecogniserBN:
                     est_mean = init_recog_est[1][0]
                     est_conf = init_recog_est[1][1]
                     if est_conf > 0:  
-                        if est_conf == 1.0:
-                            est_stddev = 0.0
-                        else:
-                            est_stddev = 0.5/self.normppf(est_conf + (1-est_conf)/2.0)
                         estimates_mean[p_id_index-1].append(est_mean)
-                        estimates_stddev[p_id_index-1].append(est_stddev)
+                        estimates_conf[p_id_index-1].append(est_conf)
                         # stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2) + math.pow(est_stddev,2)
                         stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2)
                         avg_val[p_id_index-1] += est_mean
@@ -2867,12 +4137,8 @@ class RecogniserBN:
                     est_mean = recogs_list[count_recogs][1][0]
                     est_conf = recogs_list[count_recogs][1][1]
                     if est_conf > 0: 
-                        if est_conf == 1.0:
-                            est_stddev = 0.0
-                        else:
-                            est_stddev = 0.5/self.normppf(est_conf + (1-est_conf)/2.0)
                         estimates_mean[p_id_index-1].append(est_mean)
-                        estimates_stddev[p_id_index-1].append(est_stddev)
+                        estimates_conf[p_id_index-1].append(est_conf)
                         # stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2) + math.pow(est_stddev,2)
                         stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2)
                         avg_val[p_id_index-1] += est_mean
@@ -2882,16 +4148,20 @@ class RecogniserBN:
                 est_mean = recogs_list[count_recogs][1][0]
                 est_conf = recogs_list[count_recogs][1][1]
                 if est_conf > 0:  
-                    if est_conf == 1.0:
-                        est_stddev = 0.0
-                    else:
-                        est_stddev = 0.5/self.normppf(est_conf + (1-est_conf)/2.0)
                     estimates_mean[p_id_index-1].append(est_mean)
-                    estimates_stddev[p_id_index-1].append(est_stddev)
+                    estimates_conf[p_id_index-1].append(est_conf)
                     # stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2) + math.pow(est_stddev,2)
                     stddev_true_mean[p_id_index-1] += math.pow(est_mean - self.ages[p_id_index], 2)
                     avg_val[p_id_index-1] += est_mean
             count_recogs += 1
+        
+        # the standard deviations of the estimates (0.0 for the confidence 1.0) are looked up for all the estimates of a user at once
+        estimates_stddev = []
+        for confs in estimates_conf:
+            confs = np.array(confs, dtype=float)
+            stddevs = np.zeros(len(confs))
+            stddevs[confs != 1.0] = self.getStddevsFromConfidences(confs[confs != 1.0])
+            estimates_stddev.append(stddevs.tolist())
 
         if isReturnWithoutAveraging:
             return stddev_true_mean, estimates_mean
@@ -2921,8 +4191,8 @@ class RecogniserBN:
         if initial_recognition_file is None:
             initial_recognition_file = self.initial_recognition_file
 
-        df_final = pandas.read_csv(recogniser_csv_file, dtype={"I": object}, usecols =["I", "G", "R", "N"], converters={"G": ast.literal_eval})
-        df_init = pandas.read_csv(initial_recognition_file, usecols =["I_est", "G", "N"], converters={"G": ast.literal_eval})
+        df_final = self.readRecogFile(recogniser_csv_file, RecognitionLog.RECOGNISER, usecols =["I", "G", "R", "N"], dtype={"I": object})
+        df_init = self.readRecogFile(initial_recognition_file, RecognitionLog.INITIAL, usecols =["I_est", "G", "N"])
         self.loadDB(self.db_file)        
 
         recogs_list = df_final.values.tolist()
@@ -2936,7 +4206,7 @@ class RecogniserBN:
             isRegistered = not recogs_list[count_recogs][2]# False if register button is pressed (i.e. if the person starts the session for the first time)
             numRecognition = recogs_list[count_recogs][3]
             p_id = recogs_list[count_recogs][0]
-            p_id_index = self.i_labels.index(p_id)
+            p_id_index = self.getLabelIndex(p_id)
 
             if not isRegistered:
                 if self.isMultipleRecognitions:
@@ -3016,31 +4286,17 @@ class RecogniserBN:
         Get standard deviation of time from recognition file.
         Returns the list of standard deviation within time of interactions for each user 
         """
-        df = pandas.read_csv(recogniser_csv_file, dtype={"I": object}, usecols =["I", "T"], converters={"T": ast.literal_eval})
-        group_v = df.loc[:,['I','T']].groupby('I')
+        arrays = self.readRecogArrays(recogniser_csv_file, RecognitionLog.RECOGNISER)
+        time_slots = self.getTimeSlots(arrays["T_hour"], arrays["T_minute"], arrays["T_day"])
         std_dev_est = [0.0 for i in range(1, len(self.i_labels))]
         values = []
         for counter in range(1,len(self.i_labels)):
-            t_values = []
-            gr = group_v.get_group(self.i_labels[counter])
-            avg_val = 0
-            for g_counter in range(0, len(gr)):
-                l_val = gr.iloc[g_counter,1]
-                est = self.getTimeSlot(l_val)
-                t_values.append(est)
-                avg_val += est
-            
-            values.append(t_values)
-            if len(gr) > 0:
-                avg_val /= len(gr)
-                 
-            for g_counter in range(0, len(gr)):
-                l_val = gr.iloc[g_counter,1]
-                est = self.getTimeSlot(l_val)
-                std_dev_est[counter-1] += math.pow(est - avg_val, 2)
-                 
-            if len(gr) > 1:
-                std_dev_est[counter-1] = math.sqrt(std_dev_est[counter-1]/(len(gr)-1))
+            t_values = time_slots[arrays["I"] == self.i_labels[counter]]
+            values.append(t_values.tolist())
+            if len(t_values) > 1:
+                # the average time slot is an integer (as in the time slot)
+                avg_val = int(np.sum(t_values))//len(t_values)
+                std_dev_est[counter-1] = math.sqrt(np.sum(np.square(t_values - avg_val))/float(len(t_values)-1))
         
         times_curves = []
         for v in values:
@@ -3122,7 +4378,7 @@ class RecogniserBN:
         else:
             if self.image_id is None:
                 if isRegistered: 
-                    num_matches = self.occurrences[self.i_labels.index(p_id)][0]
+                    num_matches = self.occurrences[self.getLabelIndex(p_id)][0]
                     orig_matches = num_matches
                     counter = 0
                     for i in range(0,4):
@@ -3163,24 +4419,28 @@ class RecogniserBN:
             else:
                 temp_image = temp_dir + "temp.jpg"
                 
+        store_dir = image_dir
+        category = ""
         if isDiscardedImage:
-            image_dir += "discarded/"
+            category = "discarded"
         elif identity_est is not None:
             if isRegistered:
                 if identity_est == p_id:
-                    image_dir += "Known_True/"
+                    category = "Known_True"
                 elif identity_est == self.unknown_var:
-                    image_dir += "Known_Unknown/"
+                    category = "Known_Unknown"
                 else:
-                    image_dir += "Known_False/"
+                    category = "Known_False"
             else:
                 if identity_est == self.unknown_var:
-                    image_dir += "Unknown_True/"
+                    category = "Unknown_True"
                 else:
-                    image_dir += "Unknown_False/"
+                    category = "Unknown_False"
+        if category:
+            image_dir += category + "/"
 
-        if p_id in self.i_labels:
-            num_matches = self.occurrences[self.i_labels.index(p_id)][0] + 1
+        if p_id in self.i_labels_index:
+            num_matches = self.occurrences[self.getLabelIndex(p_id)][0] + 1
         else:
             num_matches = 1
         orig_matches = num_matches
@@ -3201,18 +4461,35 @@ class RecogniserBN:
                 to_rep = str(num_recog) + ".jpg"
             temp_image = self.imagePath.replace(".jpg", to_rep)
 
-            save_name = image_dir + str(self.num_recognitions + 1) + "_" + p_id + "_" + str(orig_matches) + "-" + str(num_saves) +".jpg" 
+            save_name = str(self.num_recognitions + 1) + "_" + p_id + "_" + str(orig_matches) + "-" + str(num_saves)
 
         else:
             if imageName is not None:
-                save_name = image_dir + imageName + ".jpg"  
+                save_name = imageName
             else: 
-                save_name = image_dir + str(self.num_recognitions + 1) + "_" + p_id + "_" + str(orig_matches) + ".jpg"
+                save_name = str(self.num_recognitions + 1) + "_" + p_id + "_" + str(orig_matches)
         
-        shutil.copy2(temp_image,save_name)
+        self.saveImage(temp_image, store_dir, category, save_name, self.num_recognitions + 1)
 
         image_id = str(self.num_recognitions + 1) + "_" + p_id + "_" + str(orig_matches)
         return image_id
+    
+    def saveImage(self, image_file, image_dir, category, image_name, num_recog, isLink = False):
+        """Save the image of the recognition num_recog as image_dir/category/image_name.jpg: add it to the image store of image_dir if isImageStore 
+        (hard-linked if isLink, i.e. if image_file is not changed later, otherwise copied), otherwise copy it to the folder of the category"""
+        if self.isImageStore:
+            image_store = self.getImageStore(image_dir)
+            self.persist(image_store.appendIndex, (image_store.addImage(image_file, num_recog, image_name, category, isLink),))
+        else:
+            shutil.copy2(image_file, os.path.join(image_dir, category, image_name + ".jpg"))
+    
+    def getImageStore(self, image_dir = None):
+        """Get the image store of image_dir (image_save_dir by default), see ImageStore"""
+        if image_dir is None:
+            image_dir = self.image_save_dir
+        if self.image_store is None or self.image_store.image_dir != image_dir:
+            self.image_store = ImageStore(image_dir)
+        return self.image_store
             
     #---------------------------------------------FUNCTIONS FOR THE ROBOT---------------------------------------------#
 
@@ -3497,6 +4774,7 @@ class RecogniserBN:
                                                                                 valid_info_file = valid_info_file, 
                                                                                 isSaveImageAn = isSaveImageAn, orig_image_dir = os.path.abspath(os.path.join(recog_folder,"../../../bins")) + "/")
 
+        self.cross_validation_counts = [stats_openSet[:], stats_FR[:]]
         stats_openSet_percent = self.getDIRFAR(stats_openSet, num_recog, num_unknown)
         stats_FR_percent = self.getDIRFAR(stats_FR, num_recog, num_unknown)
         self.saveConfusionMatrix()
@@ -3504,6 +4782,70 @@ class RecogniserBN:
         print "time to run: " + str(time.time()-start_time_run)
         return num_recog, FER, stats_openSet_percent, stats_FR_percent, num_unknown
 
+    def runParallelCrossValidation(self, jobs, scratch_dir, num_processes = None):
+        """
+        Run the cross validation jobs in a pool of num_processes processes (the number of CPUs by default). Each job is a dictionary with:
+        'name' (unique name of the job, e.g. 'fold1_condition1'), 'condition' (the jobs of the same condition are merged, e.g. the folds), 'num_people',
+        'training' (the arguments of the data for runCrossValidation for training, e.g. {'db_file': ..., 'init_recog_file': ..., 'final_recog_file': ...} or the lists), 
+        'test' (optional, the arguments of the data for the test on the learned network), and the other arguments of runCrossValidation for both 
+        (e.g. 'weights', 'faceRecogThreshold', 'qualityThreshold', 'normMethod', 'updateMethod'). If 'isQualitySweep' is True, the DIR and FAR for all quality thresholds
+        are also returned for each pass (see getQualitySweep).
+        Each job is run in a new RecogniserBN in its own folder (scratch_dir/name/training/ and scratch_dir/name/test/, see runCrossValidationJob).
+        Returns the results of the jobs (in the order of jobs), and the results merged for each condition (see mergeCrossValidationResults).
+        """
+        job_list = []
+        for job in jobs:
+            job = dict(job)
+            job["scratch_dir"] = scratch_dir
+            job_list.append(job)
+        if len(set(job["name"] for job in job_list)) < len(job_list):
+            raise ValueError("The names of the cross validation jobs should be unique")
+        pool = multiprocessing.Pool(num_processes)
+        try:
+            job_results = pool.map(runCrossValidationJob, job_list, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+        return job_results, self.mergeCrossValidationResults(job_results)
+    
+    def mergeCrossValidationResults(self, job_results):
+        """
+        Merge the results of the cross validation jobs (see runCrossValidationJob) for each condition, for training and test: 
+        DIR and FAR of the network and face recognition from the total counts, the number of recognitions, and the confusion matrices 
+        (the number of recognitions of the real identity estimated as each identity, with the users of all the jobs in the order they appear).
+        """
+        merged_results = OrderedDict()
+        for job_result in job_results:
+            for data_type in ["training", "test"]:
+                result = job_result.get(data_type)
+                if result is None:
+                    continue
+                merged = merged_results.setdefault(job_result["condition"], OrderedDict()).setdefault(data_type, 
+                    {"num_recog": 0, "num_unknown": 0, "counts": [[0, 0], [0, 0]], "labels": [], "conf_matrices": [{}, {}]})
+                merged["num_recog"] += result["num_recog"]
+                merged["num_unknown"] += result["num_unknown"]
+                for num_estimator in range(0, 2): # I and F
+                    merged["counts"][num_estimator] = [x + y for x, y in zip(merged["counts"][num_estimator], result["counts"][num_estimator])]
+                if result["conf_matrices"] is None:
+                    continue
+                for label in result["labels"]:
+                    if label not in merged["labels"]:
+                        merged["labels"].append(label)
+                for num_estimator in range(0, 2):
+                    conf_matrix = merged["conf_matrices"][num_estimator]
+                    for real_label, row in zip(result["labels"], result["conf_matrices"][num_estimator]):
+                        merged_row = conf_matrix.setdefault(real_label, {})
+                        for est_label, value in zip(result["labels"] + ["Num_recog"], row):
+                            merged_row[est_label] = merged_row.get(est_label, 0) + value
+        
+        for condition_results in merged_results.values():
+            for merged in condition_results.values():
+                merged["stats_openSet"] = self.getDIRFAR(merged["counts"][0][:], merged["num_recog"], merged["num_unknown"])
+                merged["stats_FR"] = self.getDIRFAR(merged["counts"][1][:], merged["num_recog"], merged["num_unknown"])
+                columns = merged["labels"] + ["Num_recog"]
+                merged["conf_matrices"] = [[[conf_matrix.get(real_label, {}).get(column, 0) for column in columns] for real_label in merged["labels"]] 
+                                           for conf_matrix in merged["conf_matrices"]]
+        return merged_results
 
     def runCrossValidationOnRobot(self, num_people, training_folder, test_folder, bin_folder, 
                                  validation_info_file, db_file, 
@@ -3585,11 +4927,12 @@ class RecogniserBN:
         
         validation_info = [i[1:] for i in info_list]
 
-        if os.path.isfile(db_file):
-            try:
-                df_db = pandas.read_csv(db_file, dtype={"id": object}, usecols = ["id","name","gender","birthYear","height"])
-            except:
-                df_db = pandas.read_csv(db_file, dtype={"id": object}, usecols = ["id","name","gender","age","height"])
+        if self.isDBFile(db_file):
+            df_db = self.readDBFile(db_file)
+            if "birthYear" in df_db.columns:
+                df_db = df_db[["id","name","gender","birthYear","height"]]
+            else:
+                df_db = df_db[["id","name","gender","age","height"]]
             db_list = df_db.values.tolist()
         
         num_unknown = 0
@@ -3619,7 +4962,7 @@ class RecogniserBN:
             
             person = []
             if isAddPersonToDB:
-                if not os.path.isfile(db_file):
+                if not self.isDBFile(db_file):
                     warn_msg = db_file + " should exist if a person is to be added to the db (i.e. if isAddPersonToDB is true)."
                     logging.debug(warn_msg)
                     break     
@@ -3763,11 +5106,12 @@ class RecogniserBN:
         
         validation_info = [i[1:] for i in info_list]
 
-        if os.path.isfile(db_file):
-            try:
-                df_db = pandas.read_csv(db_file, dtype={"id": object}, usecols = ["id","name","gender","birthYear","height"])
-            except:
-                df_db = pandas.read_csv(db_file, dtype={"id": object}, usecols = ["id","name","gender","age","height"])
+        if self.isDBFile(db_file):
+            df_db = self.readDBFile(db_file)
+            if "birthYear" in df_db.columns:
+                df_db = df_db[["id","name","gender","birthYear","height"]]
+            else:
+                df_db = df_db[["id","name","gender","age","height"]]
             db_list = df_db.values.tolist()
         
         self.setSessionConstant(isMemoryRobot = True, isDBinCSV = True, defNumMultRecog = num_mult_recognitions)
@@ -3796,7 +5140,7 @@ class RecogniserBN:
             # print "idPersonOrig:" + str(idPersonOrig)
             person = []
             if isAddPersonToDB:
-                if not os.path.isfile(db_file):
+                if not self.isDBFile(db_file):
                     warn_msg = db_file + " should exist if a person is to be added to the db (i.e. if isAddPersonToDB is true)."
                     logging.debug(warn_msg)
                     break     
@@ -3896,11 +5240,11 @@ class RecogniserBN:
         """"""
         print "priors:"
         print "I:"
-        print self.r_bn.cpt(self.I)[:]
+        print self.prior_I
         print "F:"
-        print self.r_bn.cpt(self.F)[:]
+        print self.getLikelihoodMatrix(0)
         print "G:"
-        print self.r_bn.cpt(self.G)[:]
+        print self.likelihoods[1]
 #         print "A:"
 #         for counter in range(0,len(self.i_labels)):
 #             plt.plot(range(self.age_min, self.age_max + 1),self.r_bn.cpt(self.A)[{'I':self.i_labels[counter]}], label=self.i_labels[counter])
@@ -3967,7 +5311,1762 @@ class RecogniserBN:
         print "self.heights: " + str(self.heights)
         print "self.times: " + str(self.times)
         print "self.num_people: " + str(self.num_people)
-                        
+
+
+class SparseFaceLikelihood:
+    """
+    Face likelihood P(F|I) in sparse form: P(F=i|I=i) is diagonal[i], and P(F=f|I=i) for f != i is background[i], 
+    unless f is in entries[i] (the values learned from the face recognition results that differ from the background, 
+    e.g. the confusions with the top results of the face recogniser, or the users enrolled after user i is seen).
+    The memory, the cost of updating and the inference scale with num_people + number of learned entries, instead of num_people^2.
+    Rows can be read (as read-only arrays) and written as dense arrays (likelihood[p_index]), as for the other likelihood matrices.
+    """
+    
+    def __init__(self, max_entries = None):
+        self.num_labels = 0
+        self.diagonal = np.zeros(0) # P(F=i|I=i) (with capacity for more users)
+        self.background = np.zeros(0) # P(F=f|I=i) for f != i that are not in entries (with capacity for more users)
+        self.entries = {} # learned entries: {i: {f: P(F=f|I=i)}}
+        self.max_entries = max_entries # maximum number of entries per user (None for all)
+        self.coo = None # entries as (rows, columns, values) arrays, cleared when the entries change
+        
+    def __len__(self):
+        return self.num_labels
+    
+    def __getitem__(self, p_index):
+        """Get P(F|I=p_index) as a dense array. The array is read-only, because it is built from the sparse form (set the row with likelihood[p_index] = values)"""
+        row = np.empty(self.num_labels)
+        row.fill(self.background[p_index])
+        row[p_index] = self.diagonal[p_index]
+        for column, value in self.entries.get(p_index, {}).iteritems():
+            row[column] = value
+        row.flags.writeable = False
+        return row
+    
+    def __setitem__(self, p_index, values):
+        """Set P(F|I=p_index) from a dense array: the most common off-diagonal value is the background and the rest are kept as entries 
+        (if there are more than max_entries, the ones that differ most from the background are kept and the rest are averaged into the background)"""
+        values = np.asarray(values, dtype=float)
+        columns = np.delete(np.arange(self.num_labels), p_index)
+        background = self.getMode(values[columns])
+        columns = columns[values[columns] != background]
+        if self.max_entries is not None and len(columns) > self.max_entries:
+            columns = columns[np.argsort(-np.abs(values[columns] - background), kind='mergesort')[:self.max_entries]]
+            background = (np.sum(values) - values[p_index] - np.sum(values[columns]))/(self.num_labels - 1 - len(columns))
+        self.diagonal[p_index] = values[p_index]
+        self.background[p_index] = background
+        if len(columns) > 0:
+            self.entries[p_index] = dict(zip(columns.tolist(), values[columns].tolist()))
+        else:
+            self.entries.pop(p_index, None)
+        self.coo = None
+        
+    def getMode(self, values):
+        """Get the most common value (the smallest one if there are more than one)"""
+        if len(values) == 0:
+            return 0.0
+        sorted_values = np.sort(values)
+        starts = np.concatenate(([0], np.nonzero(np.diff(sorted_values))[0] + 1))
+        counts = np.diff(np.append(starts, len(sorted_values)))
+        return sorted_values[starts[np.argmax(counts)]]
+        
+    def resize(self, num_labels):
+        """Resize to num_labels users (the arrays are reallocated with double capacity when they are full). The new users have zero likelihoods"""
+        if num_labels > len(self.diagonal):
+            capacity = max(num_labels, 2*len(self.diagonal), 4)
+            diagonal = np.zeros(capacity)
+            diagonal[:self.num_labels] = self.diagonal[:self.num_labels]
+            background = np.zeros(capacity)
+            background[:self.num_labels] = self.background[:self.num_labels]
+            self.diagonal = diagonal
+            self.background = background
+        elif num_labels > self.num_labels:
+            self.diagonal[self.num_labels:num_labels] = 0.0
+            self.background[self.num_labels:num_labels] = 0.0
+        else:
+            # remove the entries of the removed users
+            for p_index in [p_index for p_index in self.entries if p_index >= num_labels]:
+                del self.entries[p_index]
+            for p_index, row in self.entries.items():
+                for column in [column for column in row if column >= num_labels]:
+                    del row[column]
+                if not row:
+                    del self.entries[p_index]
+        self.num_labels = num_labels
+        self.coo = None
+        
+    def setRows(self, rows, diagonal_value, background_value):
+        """Set P(F=i|I=i) = diagonal_value and P(F=f|I=i) = background_value for f != i for the users in rows"""
+        self.diagonal[rows] = diagonal_value
+        self.background[rows] = background_value
+        for p_index in rows:
+            self.entries.pop(p_index, None)
+        self.coo = None
+        
+    def setSparse(self, diagonal, background, rows, columns, values):
+        """Set P(F|I) from its sparse form: the diagonal and the background (num_people), and the entries as (rows, columns, values) arrays (see getEntries)"""
+        self.entries = {}
+        self.resize(len(diagonal))
+        self.diagonal[:self.num_labels] = diagonal
+        self.background[:self.num_labels] = background
+        for p_index, column, value in itertools.izip(rows.tolist(), columns.tolist(), values.tolist()):
+            self.entries.setdefault(p_index, {})[column] = value
+        self.coo = None
+        
+    def getRowState(self, p_index):
+        """Get the sparse form of P(F|I=p_index): [diagonal, background, [[column, value], ...]] (see setRowState)"""
+        return [float(self.diagonal[p_index]), float(self.background[p_index]), [[column, value] for column, value in sorted(self.entries.get(p_index, {}).iteritems())]]
+    
+    def setRowState(self, p_index, state):
+        """Set P(F|I=p_index) from its sparse form (see getRowState)"""
+        self.diagonal[p_index] = state[0]
+        self.background[p_index] = state[1]
+        if state[2]:
+            self.entries[p_index] = dict((int(column), value) for column, value in state[2])
+        else:
+            self.entries.pop(p_index, None)
+        self.coo = None
+        
+    def replaceValue(self, rows, old_value, new_value):
+        """Replace the likelihoods that are close to old_value with new_value in the rows"""
+        for values in [self.diagonal, self.background]:
+            isOldValue = np.isclose(values[rows], old_value)
+            values[rows[isOldValue]] = new_value
+        for p_index in rows:
+            row = self.entries.get(p_index, {})
+            for column in [column for column, value in row.iteritems() if np.isclose(value, old_value)]:
+                row[column] = new_value
+        self.coo = None
+        
+    def appendToRows(self, rows, scales, value):
+        """Multiply the likelihoods of the users in rows by scales, set value for the last user (F=num_labels-1) and normalise the rows"""
+        num_prev = self.num_labels - 1
+        row_entries, _, entry_values = self.getEntries()
+        num_entries = np.bincount(row_entries, minlength=self.num_labels)[rows]
+        sum_entries = np.bincount(row_entries, weights=entry_values, minlength=self.num_labels)[rows]
+        background = self.background[rows] * scales
+        diagonal = self.diagonal[rows] * scales
+        sum_rows = background*(num_prev - 1 - num_entries) + diagonal + sum_entries*scales + value
+        self.background[rows] = background / sum_rows
+        self.diagonal[rows] = diagonal / sum_rows
+        new_values = value / sum_rows
+        for counter in range(0, len(rows)):
+            p_index = rows[counter]
+            row = self.entries.get(p_index, {})
+            for column in row:
+                row[column] = row[column]*scales[counter]/sum_rows[counter]
+            if new_values[counter] != self.background[p_index]:
+                row[num_prev] = new_values[counter]
+                self.entries[p_index] = row
+        self.coo = None
+            
+    def getEntries(self):
+        """Get the learned entries as (rows, columns, values) arrays"""
+        if self.coo is None:
+            rows = []
+            columns = []
+            values = []
+            for p_index, row in self.entries.iteritems():
+                rows.extend([p_index]*len(row))
+                columns.extend(row.keys())
+                values.extend(row.values())
+            self.coo = (np.array(rows, dtype=int), np.array(columns, dtype=int), np.array(values, dtype=float))
+        return self.coo
+    
+    def toarray(self):
+        """Get P(F|I) as a dense array (num_people x num_people)"""
+        matrix = np.repeat(self.background[:self.num_labels, np.newaxis], self.num_labels, axis=1)
+        matrix[np.arange(self.num_labels), np.arange(self.num_labels)] = self.diagonal[:self.num_labels]
+        rows, columns, values = self.getEntries()
+        matrix[rows, columns] = values
+        return matrix
+    
+    def tolist(self):
+        """Get P(F|I) as a list of lists"""
+        return self.toarray().tolist()
+    
+    def setMatrix(self, matrix):
+        """Set P(F|I) from a dense array (num_people x num_people)"""
+        matrix = np.asarray(matrix, dtype=float)
+        self.entries = {}
+        self.resize(len(matrix))
+        for p_index in range(0, len(matrix)):
+            self[p_index] = matrix[p_index]
+    
+    def dot(self, evidence):
+        """Get sum_f P(F=f|I=i) * e(f) for each user i, for evidence with shape (num_people) or (num_evidence x num_people)"""
+        evidence = np.asarray(evidence, dtype=float)
+        evidence_2d = np.atleast_2d(evidence)
+        background = self.background[:self.num_labels]
+        result = np.sum(evidence_2d, axis=1)[:, np.newaxis] * background + evidence_2d * (self.diagonal[:self.num_labels] - background)
+        rows, columns, values = self.getEntries()
+        if len(rows) > 0:
+            np.add.at(result.T, rows, (evidence_2d[:, columns] * (values - background[rows])).T)
+        if evidence.ndim == 1:
+            return result[0]
+        return result
+    
+    def marginalise(self, post_I):
+        """Get sum_i P(F=f|I=i) * P(I=i) for each f"""
+        post_I = np.asarray(post_I, dtype=float)
+        background = self.background[:self.num_labels]
+        result = np.dot(post_I, background) + post_I * (self.diagonal[:self.num_labels] - background)
+        rows, columns, values = self.getEntries()
+        if len(rows) > 0:
+            np.add.at(result, columns, post_I[rows] * (values - background[rows]))
+        return result
+
+class AgrumInference:
+    """
+    Inference with the LazyPropagation of pyAgrum that is kept by the recogniser (RecogniserBN.getAgrumEngine), instead of compiling a new junction tree for each evidence.
+    The evidence is set on the shared LazyPropagation in makeInference (with chgEvidence), and the posteriors of all nodes are copied, 
+    so that multiple instances (e.g. for multiple images in a recognition) can be used at the same time.
+    Uses the same functions as gum.LazyPropagation (setEvidence, eraseAllEvidence, makeInference, posterior) so that it can be used in place of it.
+    """
+    
+    def __init__(self, recogniser):
+        self.recogniser = recogniser
+        self.evidence = {}
+        self.posteriors = None
+        
+    def setEvidence(self, evs):
+        """Set evidence as a dictionary of node names and evidence values (in linear domain), e.g. {"F":face_result, ..., "I":p_id}"""
+        self.evidence = dict(evs)
+        self.posteriors = None
+        
+    def eraseAllEvidence(self):
+        """Erase all evidence"""
+        self.evidence = {}
+        self.posteriors = None
+        
+    def makeInference(self):
+        """Set the evidence on the LazyPropagation of the network, make inference and copy the posteriors of all nodes"""
+        ie = self.recogniser.setAgrumEvidence(self.evidence)
+        ie.makeInference()
+        self.posteriors = {}
+        for id_v in self.recogniser.node_ids.values():
+            self.posteriors[id_v] = np.array(ie.posterior(id_v)[:])
+            
+    def posterior(self, node_id):
+        """Get the posterior of the node (by ID in the network)"""
+        if self.posteriors is None:
+            self.makeInference()
+        return self.posteriors[node_id].copy()
+
+class ClosedFormInference:
+    """
+    Exact inference on the network of RecogniserBN in closed form. I is the only parent of F, G, A, H and T (naive Bayes structure), hence:
+    P(I=i|e) is proportional to P(I=i) * prod_X sum_x P(X=x|I=i) * e_X(x), and
+    P(X=x|e) is proportional to e_X(x) * sum_i P(X=x|I=i) * P(I=i|e without e_X).
+    Uses the same functions as gum.LazyPropagation (setEvidence, eraseAllEvidence, makeInference, posterior) so that it can be used in place of it.
+    The likelihoods are read from the recogniser (prior_I and likelihoods), which are kept equal to the CPTs of the network.
+    With hard evidence on I, the likelihoods of the user are copied in makeInference (as in pyAgrum, the posteriors do not change if the likelihoods are updated afterwards).
+    """
+    
+    def __init__(self, recogniser):
+        self.recogniser = recogniser
+        self.evidence = {}
+        self.messages = None
+        self.post_I = None
+        self.likelihoods_I = None
+        
+    def setEvidence(self, evs):
+        """Set evidence as a dictionary of node names and evidence values, e.g. {"F":face_result, ..., "I":p_id} (hard evidence for I is the label of the user)"""
+        self.evidence = dict(evs)
+        self.messages = None
+        self.post_I = None
+        
+    def eraseAllEvidence(self):
+        """Erase all evidence"""
+        self.evidence = {}
+        self.messages = None
+        self.post_I = None
+    
+    def setPosteriorI(self, post_I):
+        """Set the posterior of I that is already computed for the evidence (e.g. in RecogniserBN.getPosteriorsBatch), the messages are computed only if the posterior of another node is requested"""
+        self.post_I = np.array(post_I, dtype=float)
+        
+    def makeInference(self):
+        """Compute the messages from the children to I and the posterior of I (or copy the likelihoods of the user if there is hard evidence on I)"""
+        if "I" in self.evidence:
+            p_index = self.recogniser.getLabelIndex(self.evidence["I"])
+            self.post_I = np.zeros(len(self.recogniser.i_labels))
+            self.post_I[p_index] = 1.0
+            self.likelihoods_I = [np.array(likelihood[p_index], dtype=float) for likelihood in self.recogniser.likelihoods]
+        else:
+            self.computeMessages()
+            self.post_I = self.normalise(self.getPosteriorIExcept(None))
+            
+    def computeMessages(self):
+        """Compute the messages from the children to I (likelihood of the evidence for each user)"""
+        rec = self.recogniser
+        self.messages = {}
+        for name_param in rec.node_names[1:]:
+            if name_param in self.evidence:
+                counter = rec.node_names.index(name_param) - 1
+                evidence = np.asarray(self.evidence[name_param], dtype=float)
+                if rec.isLogSpace:
+                    # the message is in log domain
+                    with np.errstate(divide='ignore'):
+                        msg = np.log(rec.dotLikelihood(counter, np.exp(evidence - np.max(evidence))))
+                else:
+                    msg = rec.dotLikelihood(counter, evidence)
+                    max_msg = np.max(msg)
+                    if max_msg > 0:
+                        # rescale to prevent underflow (the posterior is normalised afterwards)
+                        msg = msg/max_msg
+                self.messages[name_param] = msg
+            
+    def getPosteriorIExcept(self, name_exc):
+        """Unnormalised posterior of I using the evidence of all the nodes except name_exc"""
+        if self.recogniser.isLogSpace:
+            with np.errstate(divide='ignore'):
+                log_post = np.log(self.recogniser.prior_I)
+            for name_param, msg in self.messages.iteritems():
+                if name_param != name_exc:
+                    log_post = log_post + msg
+            return np.exp(log_post - np.max(log_post))
+        post = np.array(self.recogniser.prior_I, dtype=float)
+        for name_param, msg in self.messages.iteritems():
+            if name_param != name_exc:
+                post = post * msg
+                max_post = np.max(post)
+                if max_post > 0:
+                    post = post/max_post
+        return post
+    
+    def normalise(self, values):
+        """Normalise the values, raise error if the evidence is incompatible with the network (all values are zero)"""
+        total = np.sum(values)
+        if not total > 0:
+            raise ValueError("Evidence is incompatible with the network")
+        return values/total
+
+    def posterior(self, node_id):
+        """Get the posterior of the node (by ID in the network)"""
+        if self.post_I is None:
+            self.makeInference()
+        rec = self.recogniser
+        if node_id == rec.node_ids["I"]:
+            return self.post_I.copy()
+        name_param = [name for name, id_v in rec.node_ids.iteritems() if id_v == node_id][0]
+        counter = rec.node_names.index(name_param) - 1
+        if "I" in self.evidence:
+            post_X = self.likelihoods_I[counter].copy()
+        else:
+            if self.messages is None:
+                self.computeMessages()
+            post_I_exc = self.normalise(self.getPosteriorIExcept(name_param))
+            post_X = rec.marginaliseLikelihood(counter, post_I_exc)
+        if name_param in self.evidence:
+            evidence = np.asarray(self.evidence[name_param], dtype=float)
+            if rec.isLogSpace:
+                with np.errstate(divide='ignore'):
+                    log_post_X = np.log(post_X) + evidence
+                post_X = np.exp(log_post_X - np.max(log_post_X))
+            else:
+                post_X = post_X * evidence
+        return self.normalise(post_X)
+        
+class WeightOptimiser:
+    """
+    Optimiser of the weights and the quality threshold of RecogniserBN on a sequence of recognitions (e.g. the recognitions of a test set, as the rows of RecogniserBN.csv), 
+    for the users in the recogniser (the recognitions of the users that are not in the recogniser are unknown). The evidence of the recognitions is computed once 
+    without the weights (see RecogniserBN.getUnweightedEvidence), and since the weight is applied to each value (applyWeightArray), the evidence with each weight of 
+    a parameter is computed for all the recognitions at once. The message of a parameter (sum_x P(X=x|I=i) * e_X(x), see ClosedFormInference) is computed once for 
+    each distinct weight, so the posteriors of the candidates (weights and quality threshold) are the sums of the log messages, and the identity is estimated 
+    as in getEstimatedIdentity (the recogniser has at least num_recog_min users). 
+    The likelihoods are initialised from the users with the weights of the candidate (as addLikelihoods, i.e. without online learning) if isLikelihoodWeighted, 
+    otherwise the likelihoods of the recogniser are used for all the candidates. The evidence is in linear domain (isLogSpace is not used).
+    """
+    
+    def __init__(self, recogniser, recognitions, isLikelihoodWeighted = True):
+        self.recogniser = recogniser
+        self.isLikelihoodWeighted = isLikelihoodWeighted
+        self.max_chunk_size = 5000000 # maximum number of posterior values (candidates x images x users) that are computed at once
+        self.max_messages = 100 # maximum number of messages (for a parameter and a weight) to keep in memory
+        self.messages = {}
+        self.length_scale = 0.2 # length scale of the Gaussian process in bayesianSearch (for the parameters scaled to [0, 1])
+        
+        rec = recogniser
+        real_ids = []
+        image_starts = []
+        images = []
+        # the rows without I are the other images of the recognition (multiple recognitions)
+        for row in recognitions:
+            p_id = row[0]
+            if isinstance(p_id, float) and not math.isnan(p_id) and p_id.is_integer():
+                p_id = int(p_id)
+            if p_id is not None and not (isinstance(p_id, float) and math.isnan(p_id)) and str(p_id) != "":
+                real_ids.append(str(p_id))
+                image_starts.append(len(images))
+            elif not image_starts:
+                continue
+            images.append(row[1:6])
+        # the standard deviations of A are looked up for all the images at once
+        age_stddevs = rec.getAgeCurveStddevs([recog_results[2][1] for recog_results in images])
+        evidence = [rec.getUnweightedEvidence(recog_results, age_stddev) for recog_results, age_stddev in zip(images, age_stddevs.tolist())]
+        self.image_starts = np.array(image_starts, dtype=int)
+        self.num_images = len(images)
+        self.real_indices = np.array([rec.i_labels_index.get(p_id, -1) if p_id != rec.unknown_var else -1 for p_id in real_ids], dtype=int)
+        self.isKnown = self.real_indices >= 0
+        self.unknown_index = rec.getLabelIndex(rec.unknown_var)
+        
+        # the evidence of each parameter (images x states), the uniform evidence of A, H, T is marked in isUniform
+        num_states = [len(rec.i_labels)] + rec.getNumStates()
+        self.evidence = []
+        self.isUniform = []
+        for counter in range(0, len(num_states)):
+            values = [image_evidence[counter] for image_evidence in evidence]
+            self.isUniform.append(np.array([value is None for value in values], dtype=bool))
+            self.evidence.append(np.array([np.ones(num_states[counter]) if value is None else value for value in values], dtype=float).reshape(self.num_images, num_states[counter]))
+        with np.errstate(divide='ignore'):
+            self.log_prior = np.log(np.array(rec.prior_I, dtype=float))
+        
+    def getWeightedEvidence(self, counter, weight):
+        """Get the evidence of the parameter (counter: 0 for F, 1 for G, 2 for A, 3 for H, 4 for T) with the weight for all the images (see getEvidence)"""
+        rec = self.recogniser
+        num_states = self.evidence[counter].shape[1]
+        if counter >= 2 and weight == 0.0:
+            return np.ones(self.evidence[counter].shape)/num_states
+        values = rec.applyWeightArray(self.evidence[counter], weight)
+        if counter == 1:
+            # the gender probabilities are normalised by their sum (see setGenderProbabilities)
+            return rec.normaliseRows(values, "norm-sum")
+        values = rec.normaliseRows(values, rec.evidence_norm_methods[counter])
+        values[self.isUniform[counter]] = 1.0/num_states
+        return values
+    
+    def getLikelihoods(self, counter, weight):
+        """Get the likelihoods of G, A, H or T (counter: 1 for G, 2 for A, 3 for H, 4 for T) initialised from the users with the weight (see getInitialLikelihoods)"""
+        rec = self.recogniser
+        num_states = self.evidence[counter].shape[1]
+        likelihoods = np.ones((len(rec.i_labels), num_states))/num_states
+        rows = np.array([p_index for p_index in range(0, len(rec.i_labels)) if p_index != self.unknown_index], dtype=int)
+        likelihoods[rows] = rec.getInitialLikelihoods(counter, rows, weight)
+        return likelihoods
+        
+    def getMessages(self, counter, weight):
+        """Get the log messages of the parameter (counter: 0 for F, 1 for G, 2 for A, 3 for H, 4 for T) with the weight to I for all the images (images x users)"""
+        key = (counter, weight)
+        if key in self.messages:
+            return self.messages[key]
+        rec = self.recogniser
+        evidence = self.getWeightedEvidence(counter, weight)
+        if not self.isLikelihoodWeighted:
+            messages = rec.dotLikelihood(counter, evidence)
+        elif counter == 0:
+            # P(F=f|I=i) is the same for f != i
+            diagonal_value, background_value = rec.getInitialFaceLikelihood(len(rec.i_labels), weight)
+            messages = background_value*np.sum(evidence, axis=1)[:, np.newaxis] + (diagonal_value - background_value)*evidence
+        else:
+            messages = np.dot(evidence, self.getLikelihoods(counter, weight).T)
+        with np.errstate(divide='ignore'):
+            messages = np.log(messages)
+        if len(self.messages) >= self.max_messages:
+            self.messages = {}
+        self.messages[key] = messages
+        return messages
+    
+    def getEstimates(self, candidates):
+        """Get the indices of the estimated identities and the qualities of the estimations (candidates x recognitions) for the candidates 
+        ([face_weight, gender_weight, age_weight, height_weight, time_weight, quality_threshold] for each candidate)"""
+        rec = self.recogniser
+        candidates = np.array(candidates, dtype=float).reshape(-1, 6)
+        num_users = len(rec.i_labels)
+        chunk_size = max(1, self.max_chunk_size//max(1, self.num_images*num_users))
+        estimates = np.zeros((len(candidates), len(self.image_starts)), dtype=int)
+        qualities = np.zeros((len(candidates), len(self.image_starts)))
+        coefficient = rec.num_people if rec.qualityCoefficient is None else rec.qualityCoefficient
+        for start in range(0, len(candidates), chunk_size):
+            chunk = candidates[start:start + chunk_size]
+            log_posts = np.tile(self.log_prior, (len(chunk), self.num_images, 1))
+            for counter in range(0, 5):
+                weights, indices = np.unique(chunk[:, counter], return_inverse=True)
+                messages = np.array([self.getMessages(counter, weight) for weight in weights.tolist()])
+                log_posts += messages[indices]
+            with np.errstate(invalid='ignore'):
+                posts = np.exp(log_posts - np.max(log_posts, axis=2)[:, :, np.newaxis])
+            posts = np.nan_to_num(posts)
+            # the posteriors of the images of a recognition are averaged (see recogniseBatch)
+            posts = posts/np.maximum(np.sum(posts, axis=2), 1e-300)[:, :, np.newaxis]
+            if len(self.image_starts) < self.num_images:
+                posts = np.add.reduceat(posts, self.image_starts, axis=1)
+                posts = posts/np.maximum(np.sum(posts, axis=2), 1e-300)[:, :, np.newaxis]
+            posts = np.round(posts, 4)
+            two_largest = np.sort(posts, axis=2)[:, :, -2:]
+            quality = np.round((two_largest[:, :, 1] - two_largest[:, :, 0])*coefficient, 5)
+            estimate = np.argmax(posts, axis=2)
+            isUnknown = (quality < chunk[:, 5][:, np.newaxis]) | (quality == 0)
+            estimate[isUnknown] = self.unknown_index
+            estimates[start:start + len(chunk)] = estimate
+            qualities[start:start + len(chunk)] = quality
+        return estimates, qualities
+    
+    def evaluate(self, candidates):
+        """Get the detection and identification rate (DIR) and the false alarm rate (FAR) of each candidate 
+        ([face_weight, gender_weight, age_weight, height_weight, time_weight, quality_threshold]) as a DataFrame with the score (see getScores)"""
+        candidates = np.array(candidates, dtype=float).reshape(-1, 6)
+        estimates, _ = self.getEstimates(candidates)
+        num_known = np.sum(self.isKnown)
+        num_unknown = len(self.isKnown) - num_known
+        DIR = np.sum((estimates == self.real_indices) & self.isKnown, axis=1)/float(max(num_known, 1))
+        FAR = np.sum((estimates != self.unknown_index) & ~self.isKnown, axis=1)/float(max(num_unknown, 1))
+        results = pandas.DataFrame(candidates, columns = ["F", "G", "A", "H", "T", "Quality_threshold"])
+        results["DIR"] = DIR
+        results["FAR"] = FAR
+        results["Score"] = self.getScores(DIR, FAR)
+        return results
+    
+    def getScores(self, DIR, FAR):
+        """Score of the candidates to maximise (DIR - FAR)"""
+        return DIR - FAR
+    
+    def getBounds(self, weight_bounds = None, quality_bounds = None):
+        """Get the bounds of the candidates ([min, max] for each parameter, a parameter is fixed if min = max): 
+        the face weight is fixed and the other weights are in [0, 1], and the quality threshold is fixed, by default"""
+        rec = self.recogniser
+        if weight_bounds is None:
+            weight_bounds = [[rec.weights[0], rec.weights[0]]] + [[0.0, 1.0] for _ in range(0, 4)]
+        if quality_bounds is None:
+            quality_bounds = [rec.quality_threshold, rec.quality_threshold]
+        return np.array(list(weight_bounds) + [quality_bounds], dtype=float)
+        
+    def gridSearch(self, weight_values = None, quality_thresholds = None):
+        """Evaluate all the combinations of the values of the weights (a list of values for each parameter, by default the face weight and 0.0, 0.2, ..., 1.0 for the others) 
+        and the quality thresholds (the quality threshold of the recogniser by default)"""
+        rec = self.recogniser
+        if weight_values is None:
+            weight_values = [[rec.weights[0]]] + [np.linspace(0.0, 1.0, 6).tolist() for _ in range(0, 4)]
+        if quality_thresholds is None:
+            quality_thresholds = [rec.quality_threshold]
+        return self.evaluate(list(itertools.product(*(list(weight_values) + [quality_thresholds]))))
+    
+    def randomSearch(self, num_candidates, weight_bounds = None, quality_bounds = None, seed = None):
+        """Evaluate num_candidates candidates that are drawn uniformly within the bounds (see getBounds)"""
+        bounds = self.getBounds(weight_bounds, quality_bounds)
+        random_state = np.random.RandomState(seed)
+        return self.evaluate(bounds[:, 0] + random_state.rand(num_candidates, len(bounds))*(bounds[:, 1] - bounds[:, 0]))
+    
+    def bayesianSearch(self, num_iterations, weight_bounds = None, quality_bounds = None, num_initial = 10, num_samples = 1000, seed = None):
+        """Bayesian optimisation of the score within the bounds (see getBounds): num_initial random candidates are evaluated, then in each iteration, 
+        the candidate with the highest expected improvement of the score (Gaussian process with RBF kernel on the parameters scaled to [0, 1]) 
+        among num_samples random candidates is evaluated. Returns the results of all the evaluated candidates"""
+        bounds = self.getBounds(weight_bounds, quality_bounds)
+        isFree = bounds[:, 1] > bounds[:, 0]
+        random_state = np.random.RandomState(seed)
+        scale = lambda x: (x[:, isFree] - bounds[isFree, 0])/(bounds[isFree, 1] - bounds[isFree, 0])
+        sample = lambda num: bounds[:, 0] + random_state.rand(num, len(bounds))*(bounds[:, 1] - bounds[:, 0])
+        results = self.evaluate(sample(num_initial))
+        if not np.any(isFree):
+            return results
+        for _ in range(0, num_iterations):
+            x_train = scale(results[["F", "G", "A", "H", "T", "Quality_threshold"]].values)
+            y_train = results["Score"].values
+            y_mean = np.mean(y_train)
+            y_std = np.std(y_train) if np.std(y_train) > 0 else 1.0
+            y_train = (y_train - y_mean)/y_std
+            samples = sample(num_samples)
+            mean, stddev = self.getGaussianProcess(x_train, y_train, scale(samples))
+            improvement = mean - np.max(y_train) - 0.01
+            z = improvement/stddev
+            cdf = 0.5*(1 + np.vectorize(math.erf)(z/math.sqrt(2)))
+            pdf = np.exp(-z*z/2)/math.sqrt(2*math.pi)
+            expected_improvement = improvement*cdf + stddev*pdf
+            results = results.append(self.evaluate(samples[np.argmax(expected_improvement)]), ignore_index=True)
+        return results
+    
+    def getGaussianProcess(self, x_train, y_train, x_test, noise = 1e-6):
+        """Get the mean and the standard deviation of the Gaussian process (RBF kernel with length_scale) at x_test, given the observations y_train at x_train"""
+        kernel = lambda a, b: np.exp(-np.sum((a[:, np.newaxis, :] - b[np.newaxis, :, :])**2, axis=2)/(2*self.length_scale**2))
+        k_train = kernel(x_train, x_train) + noise*np.eye(len(x_train))
+        k_test = kernel(x_test, x_train)
+        chol = np.linalg.cholesky(k_train)
+        alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, y_train))
+        mean = np.dot(k_test, alpha)
+        v = np.linalg.solve(chol, k_test.T)
+        variance = np.maximum(1.0 - np.sum(v*v, axis=0), 1e-12)
+        return mean, np.sqrt(variance)
+        
+class RecognitionSimulator:
+    """
+    In-memory simulation of the recognitions on RecogniserBN with recognise and setPersonIdentity of the recogniser (as startRecognition and confirmPersonIdentity, 
+    and learnFromFile for a sequence of recognitions) with isSaveRecogFiles False, without the speech, the journal and the comparison file, 
+    e.g. as the inner loop of an optimisation or a benchmark. The state of the recogniser (the users, the network, the likelihoods and the occurrences) is updated in memory, 
+    nothing is saved (call saveBN on the recogniser to save the network). If the network of the recogniser is not loaded, the simulation starts from an empty network (see reset).
+    """
+    
+    def __init__(self, recogniser):
+        self.recogniser = recogniser
+        self.recog_results = None # recognition results of the last recognition (the results of each image for multiple recognitions)
+        if not recogniser.isBNLoaded:
+            self.reset()
+            
+    def reset(self):
+        """Start from an empty network in memory (only the unknown state, no recognitions), without loading the files of the recogniser"""
+        rec = self.recogniser
+        rec.clearDB()
+        rec.r_bn = None
+        rec.num_recognitions = 0
+        rec.isBNLoaded = True
+        if rec.quality_sweep_records is not None:
+            rec.setQualitySweep()
+            
+    def callWithoutFiles(self, method, **kwargs):
+        """Call the method of the recogniser with isSaveRecogFiles False (no recognition files, images or network are saved)"""
+        rec = self.recogniser
+        isSaveRecogFiles = rec.isSaveRecogFiles
+        rec.isSaveRecogFiles = False
+        try:
+            return method(**kwargs)
+        finally:
+            rec.isSaveRecogFiles = isSaveRecogFiles
+        
+    def recognise(self, recog_results, person = None):
+        """
+        Estimate the identity of the user from the recognition results (the list of the results of each image for multiple recognitions) as startRecognition 
+        (with setSessionVar, the user is registering if person is given, in the format of addPersonToBN). Returns the estimated identity ("" if there is no face in the results)
+        """
+        rec = self.recogniser
+        rec.isRegistered = person is None
+        rec.isAddPersonToDB = person is not None
+        rec.personToAdd = person if person is not None else []
+        self.recog_results = recog_results
+        if rec.isMultipleRecognitions:
+            rec.setDefinedNumMultRecognitions(len(recog_results))
+        rec.identity_est = self.callWithoutFiles(rec.recognise, isRegistered = rec.isRegistered, recog_results_from_file = recog_results)
+        return rec.identity_est
+    
+    def confirm(self, p_id = None, recog_results = None):
+        """
+        Learn from the last recognition with the identity of the user (the estimated identity if p_id is None) as confirmPersonIdentity (see setPersonIdentity), 
+        recog_results are the results after the registration (the results of the recognition by default). Returns the name of the user ("" if there is no face in the results)
+        """
+        rec = self.recogniser
+        if recog_results is None:
+            recog_results = self.recog_results
+        if p_id is None:
+            p_id = rec.identity_est
+        name = self.callWithoutFiles(rec.setPersonIdentity, isRegistered = rec.isRegistered, p_id = p_id, recog_results_from_file = recog_results)
+        if name == "":
+            return ""
+        if rec.quality_sweep_records is not None:
+            rec.recordQualitySweep(p_id)
+        rec.num_recognitions += 1
+        return name
+    
+    def run(self, db_list, init_list, recogs_list):
+        """
+        Simulate the recognitions of the users in db_list (in the format of db.csv) with the initial recognitions (rows of InitialRecognition.csv) 
+        and the recognitions (rows of RecogniserBN.csv) as learnFromFile.
+        Returns [#correct_known_recognitions, #incorrect_unknown_recognitions] for the network and face recognition (see getPerformanceMetrics), 
+        the number of recognitions, the ratio of recognitions without a face and the number of unknown recognitions (as learnFromFile)
+        """
+        rec = self.recogniser
+        db_index = {}
+        for x in db_list or []:
+            db_index.setdefault(str(x[0]), x)
+        init_index = rec.groupRecords(init_list, 6)
+        recogs_index = rec.groupRecords(recogs_list, 7)
+        
+        num_unknown = 0
+        stats_openSet = [0,0]
+        stats_FR = [0,0]
+        numNoFaceImages = 0
+        count_recogs = 0
+        num_recog = 0
+        while count_recogs < len(recogs_list):
+            idPerson = str(recogs_list[count_recogs][0])
+            isAddPersonToDB = recogs_list[count_recogs][6]
+            numRecognition = recogs_list[count_recogs][7]
+            person = None
+            if isAddPersonToDB:
+                person = db_index[idPerson]
+                person[0] = str(person[0])
+                person[1] = str(person[1])
+                
+            # the recognition results of each image for multiple recognitions (the other images of the recognition are the rows without I in RecogniserBN.csv)
+            recog_values = recogs_index.get(numRecognition, [])
+            if rec.isMultipleRecognitions:
+                final_results = [values[1:6] for values in recog_values]
+                if isAddPersonToDB:
+                    recog_results = [values[1:6] for values in init_index.get(numRecognition, [])]
+                else:
+                    recog_results = final_results
+                count_recogs += len(recog_values) - 1
+            else:
+                final_results = recogs_list[count_recogs][1:6]
+                if isAddPersonToDB:
+                    recog_results = init_index.get(numRecognition, [])[0][1:6]
+                else:
+                    recog_results = final_results
+                    
+            identity_est = self.recognise(recog_results, person)
+            if identity_est == "":
+                numNoFaceImages += 1
+                count_recogs += 1
+                continue
+            
+            stats_openSet = rec.getPerformanceMetrics(identity_est, idPerson, rec.unknown_var, not isAddPersonToDB, stats_openSet)
+            stats_FR = rec.getPerformanceMetrics(rec.face_est, idPerson, rec.unknown_var, not isAddPersonToDB, stats_FR)
+            if isAddPersonToDB:
+                num_unknown += 1
+            self.confirm(idPerson, final_results)
+            num_recog += 1
+            count_recogs += 1
+        return stats_openSet, stats_FR, num_recog, numNoFaceImages/(num_recog+numNoFaceImages), num_unknown
+
+class RecognitionLog:
+    """
+    Append-only binary log of the recognition records (the rows of RecogniserBN.csv, InitialRecognition.csv and Comparison.csv, and the entries of the journal).
+    Each record is framed as: length of the payload (uint32), record type (uint8), payload, CRC32 of the record type and the payload (uint32).
+    The payload is the list of the fields of the row, each with a type tag: numbers are fixed-width (int64, float64), 
+    lists of floats (e.g. posteriors) are float64 arrays, and the other lists (e.g. face similarity scores [['ID', score], ...]) are variable-length.
+    A record is written with a single append, and a truncated or corrupted record at the end of the file (e.g. power loss while writing) ends the reading.
+    The CSV files are exports of the logs (see exportToCSV).
+    """
+    
+    RECOGNISER = 1 # RecogniserBN.csv
+    INITIAL = 2 # InitialRecognition.csv
+    COMPARISON = 3 # Comparison.csv
+    JOURNAL = 4 # journal of the recognitions (see RecogniserBN.revertTo)
+    ANALYSIS_MODEL = 5 # version of the likelihoods in the analysis log (see AnalysisLog)
+    ANALYSIS = 6 # analysis of a recognition (see AnalysisLog)
+    IMAGE = 7 # image of a recognition (see ImageStore)
+    COLUMNS = {RECOGNISER: ["I", "F", "G", "A", "H", "T", "R", "N"],
+               INITIAL: ["I_est", "F", "G", "A", "H", "T", "N"],
+               COMPARISON: ["I_real", "I_est", "F_est", "I_prob", "F_prob", "Calc_time", "R", "Quality", "Highest_I_prob", "Highest_F_prob"]}
+    HEADER = struct.Struct("<IB")
+    CRC = struct.Struct("<I")
+    INT = struct.Struct("<q")
+    FLOAT = struct.Struct("<d")
+    COUNT = struct.Struct("<I")
+    
+    def __init__(self, log_file):
+        self.log_file = log_file
+    
+    def append(self, record_type, row):
+        """Append the row (list of fields) as a record of record_type"""
+        payload = "".join(self.encode(value) for value in row)
+        body = chr(record_type) + payload
+        record = self.COUNT.pack(len(payload)) + body + self.CRC.pack(zlib.crc32(body) & 0xffffffff)
+        with open(self.log_file, "ab") as fd:
+            fd.write(record)
+            
+    def readData(self):
+        """Read the bytes of the log ("" if there is no log)"""
+        if not os.path.isfile(self.log_file):
+            return ""
+        with open(self.log_file, "rb") as fd:
+            return fd.read()
+            
+    def iterFrames(self, data):
+        """Iterate over the records in the data of the log as (record type, start of the payload, end of the payload, end of the record). 
+        A truncated or corrupted record (the CRC32 does not match) ends the iteration"""
+        offset = 0
+        while offset + self.HEADER.size <= len(data):
+            length, rec_type = self.HEADER.unpack_from(data, offset)
+            end = offset + self.HEADER.size + length
+            if end + self.CRC.size > len(data) or zlib.crc32(data[offset + self.COUNT.size:end]) & 0xffffffff != self.CRC.unpack_from(data, end)[0]:
+                logging.warning("Truncated or corrupted record in " + self.log_file + " at byte " + str(offset) + ", the rest of the log is ignored.")
+                return
+            yield rec_type, offset + self.HEADER.size, end, end + self.CRC.size
+            offset = end + self.CRC.size
+            
+    def read(self, record_type = None):
+        """Read the rows of the records (of record_type, or all records as (record_type, row) if None)"""
+        rows = []
+        data = self.readData()
+        for rec_type, pos, end, _ in self.iterFrames(data):
+            if record_type is None or rec_type == record_type:
+                row = []
+                while pos < end:
+                    value, pos = self.decode(data, pos)
+                    row.append(value)
+                rows.append(row if record_type is not None else (rec_type, row))
+        return rows
+    
+    def getNumRecords(self, record_type = None):
+        """Get the number of records (of record_type, or all records if None) without decoding the rows"""
+        return sum(1 for rec_type, _, _, _ in self.iterFrames(self.readData()) if record_type is None or rec_type == record_type)
+    
+    def truncate(self, num_records):
+        """Keep the first num_records records and remove the rest of the log (including a truncated or corrupted record)"""
+        if not os.path.isfile(self.log_file):
+            return
+        with open(self.log_file, "r+b") as fd:
+            data = fd.read()
+            offset = 0
+            for frame in itertools.islice(self.iterFrames(data), num_records):
+                offset = frame[3]
+            fd.truncate(offset)
+    
+    def exportToCSV(self, csv_file, record_type):
+        """Write the records of record_type to the CSV file (with the header), in the same format as the CSV files of the recogniser"""
+        with open(csv_file, "wb") as outcsv:
+            writer = csv.writer(outcsv)
+            writer.writerow(self.COLUMNS[record_type])
+            writer = csv.writer(outcsv, lineterminator="\n") # pandas appends the rows with unix line endings
+            for row in self.read(record_type):
+                writer.writerow([self.formatCSV(value) for value in row])
+                
+    def formatCSV(self, value):
+        """Format the value for the CSV file (lists are written as python literals, as in pandas.DataFrame.to_csv)"""
+        if value is None:
+            return ""
+        elif isinstance(value, float):
+            return repr(value)
+        return str(value)
+        
+    def encode(self, value):
+        """Encode the value with its type tag"""
+        if value is None:
+            return "N"
+        elif isinstance(value, (bool, np.bool_)):
+            return "T" if value else "F"
+        elif isinstance(value, (int, long, np.integer)):
+            return "i" + self.INT.pack(value)
+        elif isinstance(value, (float, np.floating)):
+            return "d" + self.FLOAT.pack(value)
+        elif isinstance(value, str):
+            return "s" + self.COUNT.pack(len(value)) + value
+        elif isinstance(value, unicode):
+            value = value.encode("utf-8")
+            return "u" + self.COUNT.pack(len(value)) + value
+        elif isinstance(value, np.ndarray) or (len(value) > 0 and all(isinstance(item, (float, np.floating)) for item in value)):
+            values = np.asarray(value, dtype="<f8")
+            return "a" + self.COUNT.pack(len(values)) + values.tostring()
+        return "l" + self.COUNT.pack(len(value)) + "".join(self.encode(item) for item in value)
+    
+    def decode(self, data, pos):
+        """Decode the value at pos, returns the value and the position of the next value"""
+        tag = data[pos]
+        pos += 1
+        if tag == "N":
+            return None, pos
+        elif tag == "T":
+            return True, pos
+        elif tag == "F":
+            return False, pos
+        elif tag == "i":
+            return self.INT.unpack_from(data, pos)[0], pos + self.INT.size
+        elif tag == "d":
+            return self.FLOAT.unpack_from(data, pos)[0], pos + self.FLOAT.size
+        count = self.COUNT.unpack_from(data, pos)[0]
+        pos += self.COUNT.size
+        if tag == "s":
+            return data[pos:pos + count], pos + count
+        elif tag == "u":
+            return data[pos:pos + count].decode("utf-8"), pos + count
+        elif tag == "a":
+            return np.frombuffer(data, dtype="<f8", count=count, offset=pos).tolist(), pos + count*self.FLOAT.size
+        values = []
+        for _ in range(0, count):
+            value, pos = self.decode(data, pos)
+            values.append(value)
+        return values, pos
+
+class RecognitionCSV:
+    """
+    Streaming parser of the recognition CSV files (RecogniserBN.csv, InitialRecognition.csv and Analysis/Comparison.csv) into typed arrays, 
+    which replaces parsing the list columns with ast.literal_eval. The lists are tokenised with a regular expression (ast.literal_eval is used for the values 
+    that are not lists of strings and numbers), and the columns are stored as NumPy arrays (see getArrays): 
+    the face recognition results as the confidence and the (ID, similarity score) pairs of the rows (see getFaceScores for the score matrix), 
+    the label/estimate and confidence of G, A, H, the strings of T and the hour, minute and day of the week (for the time slot, see RecogniserBN.getTimeSlots), 
+    the posteriors/scores of I_prob and F_prob, and the other columns as strings.
+    The arrays are cached in a sidecar file (RecogniserBN.npz for RecogniserBN.csv) with the modification time and the size of the CSV file, 
+    and they are parsed again if the CSV file is changed.
+    """
+    
+    VERSION = 1 # version of the cache (the caches with another version are parsed again)
+    TOKEN = re.compile(r"\[|\]|'[^'\\]*'|\"[^\"\\]*\"|[^\s,\[\]]+")
+    INT = re.compile(r"[-+]?\d+$")
+    FACE_COLUMNS = ["F"] # [confidence, [[ID, score], ...]]
+    PAIR_COLUMNS = {"G": ["label", "conf"], "A": ["mean", "conf"], "H": ["mean", "conf"]} # [label/estimate, confidence]
+    STRING_LIST_COLUMNS = ["T"] # [HH:MM:SS, day of the week, ...]
+    NUMBER_LIST_COLUMNS = ["I_prob", "F_prob"] # [value, ...]
+    
+    def __init__(self, csv_file, record_type):
+        self.csv_file = csv_file
+        self.record_type = record_type
+        self.columns = RecognitionLog.COLUMNS[record_type]
+        
+    def getCacheFile(self):
+        return os.path.splitext(self.csv_file)[0] + ".npz"
+    
+    def isListColumn(self, column):
+        return column in self.FACE_COLUMNS or column in self.PAIR_COLUMNS or column in self.STRING_LIST_COLUMNS or column in self.NUMBER_LIST_COLUMNS
+        
+    def read(self):
+        """Get the arrays of the CSV file from the cache if it is up to date, otherwise parse the file and write the cache"""
+        stat = os.stat(self.csv_file)
+        cache_file = self.getCacheFile()
+        if os.path.isfile(cache_file):
+            try:
+                cache = np.load(cache_file)
+                if int(cache["version"]) == self.VERSION and float(cache["source_mtime"]) == stat.st_mtime and int(cache["source_size"]) == stat.st_size:
+                    arrays = dict((name, cache[name]) for name in cache.files)
+                    cache.close()
+                    return arrays
+                cache.close()
+            except (IOError, ValueError, KeyError):
+                logging.warning("The cache " + cache_file + " could not be read, " + self.csv_file + " is parsed again.")
+        arrays = self.getArrays(self.parse())
+        arrays["version"] = np.array(self.VERSION)
+        arrays["source_mtime"] = np.array(stat.st_mtime)
+        arrays["source_size"] = np.array(stat.st_size)
+        # the temporary file is unique for the process, as the file can be read by parallel cross validation jobs (see runParallelCrossValidation)
+        tmp_file = os.path.splitext(self.csv_file)[0] + "." + str(os.getpid()) + ".tmp.npz"
+        try:
+            np.savez(tmp_file, **arrays)
+            renameFile(tmp_file, cache_file)
+        except (IOError, OSError):
+            logging.warning("The cache " + cache_file + " could not be written.")
+        return arrays
+    
+    def parse(self):
+        """Parse the rows of the CSV file (with the columns of the record type, in that order), the lists are parsed as in ast.literal_eval. 
+        Raises ValueError if a column is missing"""
+        rows = []
+        with open(self.csv_file, "rb") as incsv:
+            reader = csv.reader(incsv)
+            header = next(reader, [])
+            if any(column not in header for column in self.columns):
+                raise ValueError("The columns of " + self.csv_file + " are not " + str(self.columns))
+            indices = [header.index(column) for column in self.columns]
+            isList = [self.isListColumn(column) for column in self.columns]
+            for line in reader:
+                if not line:
+                    continue
+                row = []
+                for index, isListValue in zip(indices, isList):
+                    value = line[index] if index < len(line) else ""
+                    if value == "":
+                        row.append(None)
+                    elif isListValue:
+                        row.append(self.parseLiteral(value))
+                    else:
+                        row.append(value)
+                rows.append(row)
+        return rows
+    
+    def parseLiteral(self, text):
+        """Parse the python literal of a list of strings, numbers and lists (the other literals are parsed with ast.literal_eval)"""
+        if not text.startswith("[") or "\\" in text or "(" in text:
+            return ast.literal_eval(text)
+        stack = []
+        value = None
+        for token in self.TOKEN.findall(text):
+            if token == "[":
+                stack.append([])
+            elif token == "]":
+                value = stack.pop()
+                if stack:
+                    stack[-1].append(value)
+            elif not stack:
+                return ast.literal_eval(text)
+            elif token[0] == "'" or token[0] == '"':
+                stack[-1].append(token[1:-1])
+            elif self.INT.match(token):
+                stack[-1].append(int(token))
+            elif token == "None":
+                stack[-1].append(None)
+            elif token == "True" or token == "False":
+                stack[-1].append(token == "True")
+            else:
+                stack[-1].append(float(token))
+        if stack:
+            raise ValueError("Malformed list " + text)
+        return value
+    
+    def getArrays(self, rows):
+        """Get the typed arrays of the rows (the rows of the CSV file or the binary log with the columns of the record type). 
+        For a list column X, X_null is True for the empty values. The numbers have a boolean array (_isint) to restore the integers.
+        F: F_conf, F_offsets (the pairs of row k are F_ids[F_offsets[k]:F_offsets[k+1]], F_scores[...]), F_ids, F_scores. 
+        G: G_label, G_conf. A, H: X_mean, X_conf. T: T_offsets, T_values, T_hour, T_minute, T_day (-1 if it is not a time). 
+        I_prob, F_prob: X_offsets, X_values. The other columns are strings ("" for empty values).
+        Raises ValueError if a list is not in the format of the column"""
+        arrays = {}
+        for counter, column in enumerate(self.columns):
+            values = [row[counter] for row in rows]
+            isNull = [value is None or (isinstance(value, float) and math.isnan(value)) for value in values]
+            if not self.isListColumn(column):
+                arrays[column] = np.array(["" if null else (repr(value) if isinstance(value, float) else str(value)) for value, null in zip(values, isNull)], dtype=str)
+                continue
+            arrays[column + "_null"] = np.array(isNull, dtype=bool)
+            values = [value for value, null in zip(values, isNull) if not null]
+            try:
+                if column in self.FACE_COLUMNS:
+                    self.setNumbers(arrays, column + "_conf", [value[0] for value in values], isNull)
+                    self.setLists(arrays, column, [value[1] for value in values], isNull)
+                    arrays[column + "_ids"] = np.array([pair[0] for value in values for pair in value[1]], dtype=str)
+                    self.setNumbers(arrays, column + "_scores", [pair[1] for value in values for pair in value[1]])
+                elif column in self.PAIR_COLUMNS:
+                    label, conf = self.PAIR_COLUMNS[column]
+                    if label == "label":
+                        arrays[column + "_label"] = self.setNull(np.array([value[0] for value in values], dtype=str), isNull, "")
+                    else:
+                        self.setNumbers(arrays, column + "_" + label, [value[0] for value in values], isNull)
+                    self.setNumbers(arrays, column + "_" + conf, [value[1] for value in values], isNull)
+                elif column in self.STRING_LIST_COLUMNS:
+                    self.setLists(arrays, column, values, isNull)
+                    arrays[column + "_values"] = np.array([item for value in values for item in value], dtype=str)
+                    times = [self.getTimeFields(value) for value in values]
+                    for index, name in enumerate(["_hour", "_minute", "_day"]):
+                        arrays[column + name] = self.setNull(np.array([time_fields[index] for time_fields in times], dtype=int), isNull, -1)
+                else:
+                    self.setLists(arrays, column, values, isNull)
+                    self.setNumbers(arrays, column + "_values", [item for value in values for item in value])
+            except (TypeError, IndexError, ValueError):
+                raise ValueError("The values of the column " + column + " in " + self.csv_file + " are not in the format of the column")
+        return arrays
+    
+    def setNull(self, values, isNull, null_value):
+        """Expand the values of the non-empty rows to all rows (null_value for the empty rows)"""
+        isNull = np.array(isNull, dtype=bool)
+        if not isNull.any():
+            return values
+        result = np.empty(len(isNull), dtype=values.dtype)
+        result[isNull] = null_value
+        result[~isNull] = values
+        return result
+        
+    def setNumbers(self, arrays, name, values, isNull = None):
+        """Set the numbers as a float array (name) and a boolean array for the integers (name_isint). Raises ValueError if a value is not a number"""
+        if any(isinstance(value, bool) or not isinstance(value, (int, long, float)) for value in values):
+            raise ValueError("Not a number")
+        numbers = np.array(values, dtype=float)
+        isInt = np.array([isinstance(value, (int, long)) for value in values], dtype=bool)
+        if isNull is not None:
+            numbers = self.setNull(numbers, isNull, np.nan)
+            isInt = self.setNull(isInt, isNull, False)
+        arrays[name] = numbers
+        arrays[name + "_isint"] = isInt
+        
+    def setLists(self, arrays, column, values, isNull):
+        """Set the offsets of the lists of the rows (name_offsets), the items of row k are items[offsets[k]:offsets[k+1]]. Raises ValueError if a value is not a list"""
+        if any(not isinstance(value, list) for value in values):
+            raise ValueError("Not a list")
+        lengths = self.setNull(np.array([len(value) for value in values], dtype=int), isNull, 0)
+        arrays[column + "_offsets"] = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+        
+    def getTimeFields(self, value):
+        """Get the hour, minute and day of the week of the time ['HH:MM:SS', 'day of the week', ...] (-1 if it is not a time)"""
+        try:
+            time_fields = value[0].split(":")
+            return [int(time_fields[0]), int(time_fields[1]), int(value[1])]
+        except (IndexError, ValueError, AttributeError):
+            return [-1, -1, -1]
+    
+    def getRows(self, arrays, usecols = None):
+        """Get the rows (with the columns in usecols, in the order of the columns) from the arrays, with the same values as ast.literal_eval (None for the empty values)"""
+        columns = [column for column in self.columns if usecols is None or column in usecols]
+        num_rows = len(arrays[self.columns[-1]]) if self.columns[-1] in arrays else len(arrays[self.columns[-1] + "_null"])
+        column_values = []
+        for column in columns:
+            if not self.isListColumn(column):
+                column_values.append([value if value != "" else None for value in arrays[column].tolist()])
+                continue
+            isNull = arrays[column + "_null"].tolist()
+            if column in self.FACE_COLUMNS:
+                confs = self.getNumbers(arrays, column + "_conf")
+                pairs = [list(pair) for pair in zip(arrays[column + "_ids"].tolist(), self.getNumbers(arrays, column + "_scores"))]
+                lists = self.splitLists(arrays[column + "_offsets"], pairs)
+                values = [[conf, pair_list] for conf, pair_list in zip(confs, lists)]
+            elif column in self.PAIR_COLUMNS:
+                label, conf = self.PAIR_COLUMNS[column]
+                labels = arrays[column + "_label"].tolist() if label == "label" else self.getNumbers(arrays, column + "_" + label)
+                values = [list(pair) for pair in zip(labels, self.getNumbers(arrays, column + "_" + conf))]
+            elif column in self.STRING_LIST_COLUMNS:
+                values = self.splitLists(arrays[column + "_offsets"], arrays[column + "_values"].tolist())
+            else:
+                values = self.splitLists(arrays[column + "_offsets"], self.getNumbers(arrays, column + "_values"))
+            column_values.append([None if null else value for value, null in zip(values, isNull)])
+        return [list(row) for row in zip(*column_values)] if column_values else [[] for _ in range(0, num_rows)]
+    
+    def getNumbers(self, arrays, name):
+        return [int(value) if isInt else value for value, isInt in zip(arrays[name].tolist(), arrays[name + "_isint"].tolist())]
+    
+    def splitLists(self, offsets, items):
+        offsets = offsets.tolist()
+        return [items[offsets[k]:offsets[k + 1]] for k in range(0, len(offsets) - 1)]
+    
+    def getFaceScores(self, arrays, column = "F"):
+        """Get the face recognition scores as a matrix (number of rows x number of IDs, NaN if the ID is not in the results of the row) and the IDs (sorted)"""
+        ids, id_indices = np.unique(arrays[column + "_ids"], return_inverse=True)
+        offsets = arrays[column + "_offsets"]
+        scores = np.empty((len(offsets) - 1, len(ids)))
+        scores.fill(np.nan)
+        row_indices = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        scores[row_indices, id_indices] = arrays[column + "_scores"]
+        return scores, ids.tolist()
+
+class AnalysisLog:
+    """
+    Log of the analysis of the recognitions (log mode, see RecogniserBN.setLogMode and setAnalysisLog). The results of a recognition (estimates and posteriors) 
+    are an ANALYSIS record that refers to a version of P(I) and the likelihoods, instead of copying them (P(F|I) is num_people x num_people) for each recognition. 
+    A version is an ANALYSIS_MODEL record with the labels, P(I) and the likelihood rows that are changed since the previous version (P(F|I) in the sparse form, 
+    see SparseFaceLikelihood.getRowState), or all of them in the first version of a segment. 
+    The records are appended to segments (Analysis_1.log, Analysis_2.log, ... in the binary format of RecognitionLog) that are kept as a ring buffer: 
+    a segment is started in each session and after max_records records (at the next recognition), and only the last max_segments segments are kept. 
+    The JSON files of the recognitions (Analysis<N>.json) are exports of the log (see RecogniserBN.exportAnalysisLogs).
+    """
+    
+    RESULTS = ["Date", "Image_id", "I_real", "I_est", "I_posterior", "F_est", "F_posterior", "G_est", "G_posterior", 
+               "A_est", "A_posterior", "H_est", "H_posterior", "T_est", "T_posterior"] # fields of the ANALYSIS record (see RecogniserBN.getAnalysisResults)
+    
+    def __init__(self, analysis_file, max_records = None, max_segments = None):
+        self.analysis_file = analysis_file # Analysis.json (the segments are Analysis_<index>.log in the same folder)
+        self.max_records = max_records # maximum number of ANALYSIS records in a segment (None for no limit)
+        self.max_segments = max_segments # number of segments that are kept (None for all)
+        self.segment_index = None # index of the segment that is written (None until the first record of the session)
+        self.num_records = 0 # number of ANALYSIS records in the segment
+        self.num_recog = None # recognition of the last ANALYSIS record (the records of a recognition are in the same segment)
+        self.version = 0 # version of the last ANALYSIS_MODEL record
+        self.num_people = None # number of users in the last version (None if the next version has all the likelihoods)
+        self.dirty_rows = set() # indices of the users whose likelihoods are changed since the last version
+        self.isPriorChanged = False # is P(I) changed since the last version
+        
+    def getSegmentFile(self, index):
+        return self.analysis_file.replace(".json", "_" + str(index) + ".log")
+    
+    def getSegmentIndex(self, log_file):
+        """Get the index of the segment (0 if the file is not a segment of the log)"""
+        prefix = self.analysis_file.replace(".json", "_")
+        index = log_file[len(prefix):-len(".log")]
+        if log_file.startswith(prefix) and log_file.endswith(".log") and index.isdigit():
+            return int(index)
+        return 0
+    
+    def getSegments(self):
+        """Get the segments as a list of (index, segment file), in the order they are written"""
+        log_dir = os.path.dirname(self.analysis_file)
+        if not os.path.isdir(log_dir or "."):
+            return []
+        segments = []
+        for file_name in os.listdir(log_dir or "."):
+            index = self.getSegmentIndex(os.path.join(log_dir, file_name))
+            if index > 0:
+                segments.append((index, self.getSegmentFile(index)))
+        return sorted(segments)
+    
+    def getRecords(self, rec, results, num_recog, isPrevSavedToAnalysis):
+        """Get the records for the results of the recognition num_recog of the recogniser rec (see RecogniserBN.getAnalysisResults): 
+        the ANALYSIS_MODEL record if the likelihoods are changed since the last version, and the ANALYSIS record. 
+        Returns the segment to write them to and the records as a list of (record type, row)"""
+        if self.segment_index is None or (self.max_records is not None and self.num_records >= self.max_records and num_recog != self.num_recog):
+            if self.segment_index is None:
+                segments = self.getSegments()
+                self.segment_index = segments[-1][0] if segments else 0
+            self.segment_index += 1
+            self.num_records = 0
+            self.num_people = None
+        records = []
+        model_row = self.getModelRow(rec)
+        if model_row is not None:
+            records.append((RecognitionLog.ANALYSIS_MODEL, model_row))
+        records.append((RecognitionLog.ANALYSIS, [num_recog, isPrevSavedToAnalysis, self.version] + [results[key] for key in self.RESULTS]))
+        self.num_records += 1
+        self.num_recog = num_recog
+        return self.getSegmentFile(self.segment_index), records
+    
+    def getModelRow(self, rec):
+        """Get the row of the ANALYSIS_MODEL record for the likelihoods of the recogniser rec that are changed since the last version (None if there is no change): 
+        version, isFull (all users), labels of the new users, P(I) (None if not changed), face likelihood rows [[p_index, row state], ...], 
+        the other likelihood rows [[p_index, G row, A row, H row, T row], ...]"""
+        num_labels = len(rec.i_labels)
+        isFull = self.num_people is None or num_labels < self.num_people
+        if isFull:
+            new_labels = list(rec.i_labels)
+            face_rows = range(0, num_labels)
+            other_rows = face_rows
+        elif num_labels > self.num_people:
+            # the face likelihoods of all users are changed for the new users (see RecogniserBN.updateNodes)
+            new_labels = rec.i_labels[self.num_people:]
+            face_rows = range(0, num_labels)
+            other_rows = sorted(self.dirty_rows.union(range(self.num_people, num_labels)))
+        elif self.dirty_rows or self.isPriorChanged:
+            new_labels = []
+            face_rows = sorted(self.dirty_rows)
+            other_rows = face_rows
+        else:
+            return None
+        prior = np.array(rec.prior_I) if isFull or new_labels or self.isPriorChanged else None
+        self.version += 1
+        self.num_people = num_labels
+        self.dirty_rows = set()
+        self.isPriorChanged = False
+        return [self.version, isFull, new_labels, prior, [[p_index, rec.likelihoods[0].getRowState(p_index)] for p_index in face_rows], 
+                [[p_index] + [np.array(likelihood[p_index]) for likelihood in rec.likelihoods[1:]] for p_index in other_rows]]
+    
+    def writeRecords(self, segment_file, records):
+        """Append the records to the segment. The oldest segments are removed when a segment is started"""
+        if not os.path.isfile(segment_file) and self.max_segments is not None:
+            index = self.getSegmentIndex(segment_file)
+            for old_index, old_file in self.getSegments():
+                if old_index <= index - self.max_segments:
+                    os.remove(old_file)
+        log = RecognitionLog(segment_file)
+        for record_type, row in records:
+            log.append(record_type, row)
+    
+    def read(self):
+        """Read the analysis of the recognitions from the segments in the order they are written, 
+        yields num_recog, isPrevSavedToAnalysis, results (dictionary, see RecogniserBN.getAnalysisResults), labels, P(I) and the likelihoods of the recognition"""
+        for _, segment_file in self.getSegments():
+            version = None
+            for record_type, row in RecognitionLog(segment_file).read():
+                if record_type == RecognitionLog.ANALYSIS_MODEL:
+                    version, isFull, new_labels, new_prior, face_rows, other_rows = row
+                    if isFull:
+                        i_labels = []
+                        face_likelihood = SparseFaceLikelihood()
+                        other_likelihoods = [[] for _ in range(0, len(other_rows[0]) - 1)]
+                    i_labels = i_labels + new_labels
+                    if new_prior is not None:
+                        prior = np.array(new_prior)
+                    face_likelihood.resize(len(i_labels))
+                    for p_index, state in face_rows:
+                        face_likelihood.setRowState(p_index, state)
+                    for likelihood in other_likelihoods:
+                        likelihood.extend([None]*(len(i_labels) - len(likelihood)))
+                    for other_row in other_rows:
+                        for counter in range(0, len(other_likelihoods)):
+                            other_likelihoods[counter][other_row[0]] = np.array(other_row[counter + 1])
+                elif record_type == RecognitionLog.ANALYSIS:
+                    if version is None or row[2] != version:
+                        logging.warning("The likelihoods of recognition " + str(row[0]) + " are not in " + segment_file + ", the analysis is skipped.")
+                        continue
+                    results = OrderedDict(zip(self.RESULTS, row[3:]))
+                    yield row[0], row[1], results, i_labels, prior, [face_likelihood] + [np.array(likelihood) for likelihood in other_likelihoods]
+
+class RecognitionModel:
+    """
+    Binary model of the recogniser (RecogniserBN.model): a directory with the raw arrays of P(I) and the likelihoods as .npy files 
+    (P(F|I) in the sparse form of SparseFaceLikelihood: diagonal, background and the entries as rows, columns, values), 
+    and header.json with the format version, the labels, the node ranges, the weights, the thresholds and the occurrences.
+    The arrays are loaded with np.load(mmap_mode='r'), so loading and saving take time proportional to the bytes of the arrays (not formatting and parsing text as BIF).
+    The model is written to a temporary directory which replaces the model, and the previous model (.old) is read if the replacement is interrupted.
+    """
+    
+    VERSION = 1 # version of the format (the models with a higher version are not read)
+    ARRAYS = ["prior_I", "F_diagonal", "F_background", "F_rows", "F_columns", "F_values", "G", "A", "H", "T"]
+    
+    def __init__(self, model_file):
+        self.model_file = model_file
+        self.tmp_file = model_file + ".tmp"
+        self.old_file = model_file + ".old"
+    
+    def getHeaderFile(self, model_dir):
+        return os.path.join(model_dir, "header.json")
+    
+    def getModelDir(self):
+        """Get the directory of the complete model (the previous model if the model is being replaced), None if there is no model"""
+        for model_dir in [self.model_file, self.old_file]:
+            if os.path.isfile(self.getHeaderFile(model_dir)):
+                return model_dir
+        return None
+    
+    def exists(self):
+        return self.getModelDir() is not None
+    
+    def write(self, header, arrays):
+        """Write the header (dictionary) and the arrays (dictionary of the names in ARRAYS and arrays)"""
+        if os.path.isdir(self.tmp_file):
+            shutil.rmtree(self.tmp_file)
+        os.makedirs(self.tmp_file)
+        for name in self.ARRAYS:
+            np.save(os.path.join(self.tmp_file, name + ".npy"), arrays[name])
+        header = dict(header)
+        header["version"] = self.VERSION
+        # the header is written last, the model is complete if it has the header
+        with open(self.getHeaderFile(self.tmp_file), mode='w') as f:
+            json.dump(header, f)
+        if os.path.isdir(self.model_file):
+            if os.path.isdir(self.old_file):
+                shutil.rmtree(self.old_file)
+            os.rename(self.model_file, self.old_file)
+        renameFile(self.tmp_file, self.model_file)
+        if os.path.isdir(self.old_file):
+            shutil.rmtree(self.old_file)
+    
+    def read(self, mmap_mode = 'r'):
+        """Read the header and the arrays (memory-mapped with mmap_mode, see np.load, or read into memory if mmap_mode is None), returns None if there is no model"""
+        model_dir = self.getModelDir()
+        if model_dir is None:
+            return None
+        with open(self.getHeaderFile(model_dir), mode='r') as f:
+            header = json.load(f)
+        if header["version"] > self.VERSION:
+            raise ValueError("Model " + self.model_file + " has version " + str(header["version"]) + ", the latest readable version is " + str(self.VERSION))
+        arrays = {}
+        for name in self.ARRAYS:
+            arrays[name] = np.load(os.path.join(model_dir, name + ".npy"), mmap_mode = mmap_mode)
+        return header, arrays
+    
+    def remove(self):
+        for model_dir in [self.model_file, self.tmp_file, self.old_file]:
+            if os.path.isdir(model_dir):
+                shutil.rmtree(model_dir)
+
+class ImageStore:
+    """
+    Content-addressed store of the images of the recognitions (see RecogniserBN.saveImage). An image is stored once in objects/ with the SHA-1 of its content 
+    as the name (hard-linked from the source if it is not changed later, e.g. the images of a dataset, otherwise copied), instead of a copy in the folder of 
+    the category for each image. The index (index.log in the binary format of RecognitionLog) has an IMAGE record for each image: the number of the recognition, 
+    the name of the image (e.g. 3_2_1-0), the category of the recognition (Known_True, Known_False, Known_Unknown, Unknown_True, Unknown_False, discarded, 
+    or "" for none) and the SHA-1 of the image. The index is read once, and the images of a recognition or a category are found without listing the folders.
+    The records of the reverted recognitions are removed by truncating the index (see RecogniserBN.undoJournalEntry and removeRecognition).
+    The folders of the categories with the named images are an export of the store (see exportImages).
+    """
+    
+    def __init__(self, image_dir):
+        self.image_dir = image_dir # images/ (the images are in images/objects/)
+        self.index_file = os.path.join(image_dir, "index.log")
+        self.recognitions = None # number of the recognition: list of [name, category, SHA-1] of its images (None until the index is read)
+        self.categories = {} # category: {number of the recognition: list of [name, SHA-1]}
+        self.references = {} # SHA-1: number of images in the index with the content
+        
+    def load(self):
+        """Read the index (once)"""
+        if self.recognitions is not None:
+            return
+        self.recognitions = {}
+        for row in RecognitionLog(self.index_file).read(RecognitionLog.IMAGE):
+            self.addToIndex(row)
+            
+    def addToIndex(self, row):
+        num_recog, name, category, digest = row
+        self.recognitions.setdefault(num_recog, []).append([name, category, digest])
+        self.categories.setdefault(category, {}).setdefault(num_recog, []).append([name, digest])
+        self.references[digest] = self.references.get(digest, 0) + 1
+        
+    def getObjectFile(self, digest):
+        return os.path.join(self.image_dir, "objects", digest[:2], digest + ".jpg")
+    
+    def getDigest(self, image_file):
+        sha = hashlib.sha1()
+        with open(image_file, "rb") as fd:
+            for chunk in iter(lambda: fd.read(65536), ""):
+                sha.update(chunk)
+        return sha.hexdigest()
+        
+    def addImage(self, image_file, num_recog, name, category = "", isLink = False):
+        """Store the image if its content is not in the store (hard-linked if isLink and the file system supports it, otherwise copied) and add it to the index in memory. 
+        Returns the row of the index to append (see appendIndex)"""
+        self.load()
+        digest = self.getDigest(image_file)
+        object_file = self.getObjectFile(digest)
+        if not os.path.isfile(object_file):
+            object_dir = os.path.dirname(object_file)
+            if not os.path.isdir(object_dir):
+                os.makedirs(object_dir)
+            tmp_file = object_file + ".tmp"
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            self.linkImage(image_file, tmp_file, isLink)
+            renameFile(tmp_file, object_file)
+        row = [num_recog, name, category, digest]
+        self.addToIndex(row)
+        return row
+    
+    def linkImage(self, image_file, target_file, isLink = True):
+        """Hard-link the image to target_file if isLink and the file system supports it, otherwise copy it"""
+        if isLink and hasattr(os, "link"):
+            try:
+                os.link(image_file, target_file)
+                return
+            except OSError:
+                pass
+        shutil.copy2(image_file, target_file)
+    
+    def appendIndex(self, row):
+        """Append the row of an image (see addImage) to the index file"""
+        RecognitionLog(self.index_file).append(RecognitionLog.IMAGE, row)
+    
+    def getImages(self, num_recog):
+        """Get the images of the recognition as a list of [name, category, image file]"""
+        self.load()
+        return [[name, category, self.getObjectFile(digest)] for name, category, digest in self.recognitions.get(num_recog, [])]
+    
+    def getCategoryImages(self, category):
+        """Get the images of the category (e.g. Known_False) as a list of [number of the recognition, name, image file], in the order of the recognitions"""
+        self.load()
+        category_images = self.categories.get(category, {})
+        return [[num_recog, name, self.getObjectFile(digest)] for num_recog in sorted(category_images) for name, digest in category_images[num_recog]]
+    
+    def removeRecognition(self, num_recog):
+        """Remove the images of the recognition from the index in memory (the index file is truncated by the journal, see RecogniserBN.undoJournalEntry), 
+        and the images in the store that are not in another recognition"""
+        self.load()
+        for name, category, digest in self.recognitions.pop(num_recog, []):
+            self.categories[category].pop(num_recog, None)
+            self.references[digest] -= 1
+            if self.references[digest] == 0:
+                del self.references[digest]
+                if os.path.isfile(self.getObjectFile(digest)):
+                    os.remove(self.getObjectFile(digest))
+                    
+    def exportImages(self):
+        """Write the images to the folders of their categories (e.g. images/Known_True/3_2_1.jpg) as hard links to the store (or copies)"""
+        self.load()
+        for num_recog in sorted(self.recognitions):
+            for name, category, digest in self.recognitions[num_recog]:
+                image_file = os.path.join(self.image_dir, category, name + ".jpg")
+                if not os.path.isdir(os.path.dirname(image_file)):
+                    os.makedirs(os.path.dirname(image_file))
+                if os.path.isfile(image_file):
+                    os.remove(image_file)
+                self.linkImage(self.getObjectFile(digest), image_file)
+
+class SQLiteUserStore:
+    """
+    User database (the records of db.csv) in an embedded SQLite file, where the record of a user is updated in place 
+    (e.g. the occurrence after a recognition, or the times of interaction) instead of rewriting the whole CSV file.
+    The columns are the same as db.csv: id, name, gender, birthYear (or age), height, times, occurrence (times and occurrence are stored as python literals).
+    db.csv is an export of the store (see exportToCSV), and an existing db.csv can be imported with importFromCSV.
+    """
+    
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.lock = threading.Lock() # the store is shared by the threads of the robot module
+        self.conn = sqlite3.connect(store_file, check_same_thread = False)
+        self.conn.text_factory = str
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, name TEXT, gender TEXT, birthYear, height, times TEXT, occurrence TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS users_name ON users (name)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+    
+    def getColumns(self):
+        """Get the columns of db.csv (the age column is 'age' for the databases imported from the CSV files with ages instead of birth years)"""
+        row = self.conn.execute("SELECT value FROM info WHERE key = 'age_column'").fetchone()
+        age_column = "birthYear" if row is None else row[0]
+        return ["id", "name", "gender", age_column, "height", "times", "occurrence"]
+        
+    def getUsers(self):
+        """Get the users as a DataFrame with the columns of db.csv, in the order of enrolment"""
+        with self.lock:
+            columns = self.getColumns()
+            rows = self.conn.execute("SELECT id, name, gender, birthYear, height, times, occurrence FROM users ORDER BY rowid").fetchall()
+        users = [list(row[:5]) + [ast.literal_eval(row[5]), ast.literal_eval(row[6])] for row in rows]
+        return pandas.DataFrame(users, columns = columns)
+    
+    def getNumUsers(self):
+        """Get the number of users in the store"""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    
+    def getUserByName(self, p_name):
+        """Get [id, name, gender, birthYear (or age), height, times] of the first user with the name, or None if there is no such user"""
+        with self.lock:
+            row = self.conn.execute("SELECT id, name, gender, birthYear, height, times FROM users WHERE name = ? ORDER BY rowid LIMIT 1", (p_name,)).fetchone()
+        if row is None:
+            return None
+        return list(row[:5]) + [ast.literal_eval(row[5])]
+    
+    def isNameInStore(self, p_name):
+        """Check if a user with the name is in the store"""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM users WHERE name = ? LIMIT 1", (p_name,)).fetchone() is not None
+        
+    def addUser(self, person, occurrence):
+        """Add the user (person = [id, name, gender, birthYear, height, times]) with the occurrence. 
+        The record is replaced if the id is already in the store (e.g. when the network is learned again from the files)"""
+        self.addUsers([person], [occurrence])
+        
+    def addUsers(self, persons, occurrences):
+        """Add the users with their occurrences in one transaction (see addUser)"""
+        with self.lock, self.conn:
+            for person, occurrence in zip(persons, occurrences):
+                record = self.getRecord(person, occurrence)
+                if self.conn.execute("UPDATE users SET name = ?, gender = ?, birthYear = ?, height = ?, times = ?, occurrence = ? WHERE id = ?", record[1:] + record[:1]).rowcount == 0:
+                    self.conn.execute("INSERT INTO users (id, name, gender, birthYear, height, times, occurrence) VALUES (?, ?, ?, ?, ?, ?, ?)", record)
+    
+    def updateOccurrence(self, p_id, occurrence):
+        """Update the occurrence of the user"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE users SET occurrence = ? WHERE id = ?", (repr(list(occurrence)), str(p_id)))
+            
+    def addTime(self, p_name, time_p):
+        """Append the time of interaction to the times of the first user with the name"""
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT rowid, times FROM users WHERE name = ? ORDER BY rowid LIMIT 1", (p_name,)).fetchone()
+            if row is not None:
+                times = ast.literal_eval(row[1])
+                times.append(time_p)
+                self.conn.execute("UPDATE users SET times = ? WHERE rowid = ?", (repr(times), row[0]))
+    
+    def removeUser(self, p_id):
+        """Remove the user from the store"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM users WHERE id = ?", (str(p_id),))
+            
+    def setUsers(self, df_db):
+        """Replace the users in the store with the users in the DataFrame (with the columns of db.csv)"""
+        age_column = "age" if "age" in df_db.columns and "birthYear" not in df_db.columns else "birthYear"
+        columns = ["id", "name", "gender", age_column, "height", "times"]
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM users")
+            self.conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('age_column', ?)", (age_column,))
+            self.conn.executemany("INSERT INTO users (id, name, gender, birthYear, height, times, occurrence) VALUES (?, ?, ?, ?, ?, ?, ?)", 
+                                  [self.getRecord(person, occurrence) for person, occurrence in zip(df_db[columns].values.tolist(), df_db["occurrence"].values.tolist())])
+    
+    def getRecord(self, person, occurrence):
+        """Get the values of the columns of the record of the user (numpy numbers are converted to python numbers for sqlite3)"""
+        values = [str(person[0]), person[1], person[2], person[3], person[4]]
+        values = [value.item() if isinstance(value, np.generic) else value for value in values]
+        return values + [repr(list(person[5])), repr(list(occurrence))]
+    
+    def importFromCSV(self, csv_file):
+        """Replace the users in the store with the users in the CSV file"""
+        self.setUsers(pandas.read_csv(csv_file, dtype={"id": object, "name": object}, converters={"times": ast.literal_eval, "occurrence": ast.literal_eval}))
+        self.setCSVStat(csv_file)
+        
+    def exportToCSV(self, csv_file):
+        """Write the users to the CSV file (db.csv)"""
+        tmp_file = csv_file + ".tmp"
+        self.getUsers().to_csv(tmp_file, index=False)
+        renameFile(tmp_file, csv_file)
+        self.setCSVStat(csv_file)
+        
+    def setCSVStat(self, csv_file):
+        """Record the modification time and the size of the CSV file after it is imported or exported (see isCSVChanged)"""
+        stat = os.stat(csv_file)
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", [("csv_mtime", repr(stat.st_mtime)), ("csv_size", str(stat.st_size))])
+            
+    def isCSVChanged(self, csv_file):
+        """Check if the CSV file was changed after it was last imported or exported (its modification time or size is not the recorded one)"""
+        stat = os.stat(csv_file)
+        with self.lock:
+            info = dict(self.conn.execute("SELECT key, value FROM info WHERE key IN ('csv_mtime', 'csv_size')").fetchall())
+        return info.get("csv_mtime") != repr(stat.st_mtime) or info.get("csv_size") != str(stat.st_size)
+        
+    def close(self):
+        """Close the connection to the store"""
+        with self.lock:
+            self.conn.close()
+
+class CSVUserStore:
+    """
+    User database in db.csv, with the same interface as SQLiteUserStore. The whole file is rewritten when a record is updated.
+    """
+    
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.db_df = None
+        
+    def getUsers(self):
+        """Get the users as a DataFrame with the columns of db.csv, in the order of enrolment"""
+        self.db_df = pandas.read_csv(self.store_file, dtype={"id": object, "name": object}, converters={"times": ast.literal_eval, "occurrence": ast.literal_eval})
+        return self.db_df
+    
+    def getDataFrame(self):
+        """Get the DataFrame of the users (read from the file if not read yet)"""
+        if self.db_df is None:
+            self.getUsers()
+        return self.db_df
+    
+    def getNumUsers(self):
+        """Get the number of users in the store"""
+        return len(self.getDataFrame())
+    
+    def getUserByName(self, p_name):
+        """Get [id, name, gender, birthYear (or age), height, times] of the first user with the name, or None if there is no such user"""
+        db_df = self.getDataFrame()
+        users = db_df.loc[db_df['name'] == p_name]
+        if users.empty:
+            return None
+        age_column = 'birthYear' if 'birthYear' in db_df.columns else 'age'
+        return [users[column].iloc[0] for column in ['id', 'name', 'gender', age_column, 'height', 'times']]
+    
+    def isNameInStore(self, p_name):
+        """Check if a user with the name is in the store"""
+        return p_name in self.getDataFrame().name.values
+        
+    def addUser(self, person, occurrence):
+        """Add the user (person = [id, name, gender, birthYear, height, times]) with the occurrence"""
+        self.addUsers([person], [occurrence])
+        
+    def addUsers(self, persons, occurrences):
+        """Add the users with their occurrences, the file is appended once"""
+        df = pandas.DataFrame.from_items([('id', [person[0] for person in persons]),
+                                          ('name', [person[1] for person in persons]), 
+                                          ('gender', [person[2] for person in persons]), 
+                                          ('birthYear', [person[3] for person in persons]),
+                                          ('height', [person[4] for person in persons]),
+                                          ('times', [person[5] for person in persons]),
+                                          ('occurrence', list(occurrences))])
+        self.db_df = self.getDataFrame().append(df, ignore_index=True)      
+        with open(self.store_file, 'a') as fd:
+            df.to_csv(fd, index=False, header=False)
+    
+    def updateOccurrence(self, p_id, occurrence):
+        """Update the occurrence of the user"""
+        db_df = self.getDataFrame()
+        db_df.loc[db_df['id'] == p_id, 'occurrence'] = str(occurrence)
+        db_df.to_csv(self.store_file, index=False)
+            
+    def addTime(self, p_name, time_p):
+        """Append the time of interaction to the times of the first user with the name"""
+        db_df = self.getDataFrame()
+        idx = db_df.index[db_df['name'] == p_name][0]
+        db_df.at[idx, 'times'] = db_df.at[idx, 'times'] + [time_p]
+        db_df.to_csv(self.store_file, index=False)
+    
+    def removeUser(self, p_id):
+        """Remove the user from the store"""
+        db_df = self.getDataFrame()
+        self.db_df = db_df.loc[db_df['id'] != p_id].reset_index(drop=True)
+        self.db_df.to_csv(self.store_file, index=False)
+        
+    def setUsers(self, df_db):
+        """Replace the users in the store with the users in the DataFrame (with the columns of db.csv)"""
+        self.db_df = df_db
+        df_db.to_csv(self.store_file, index=False)
+    
+    def importFromCSV(self, csv_file):
+        """Replace the users in the store with the users in the CSV file"""
+        if csv_file != self.store_file:
+            shutil.copy2(csv_file, self.store_file)
+        self.getUsers()
+        
+    def exportToCSV(self, csv_file):
+        """Write the users to the CSV file (db.csv)"""
+        if csv_file != self.store_file:
+            shutil.copy2(self.store_file, csv_file)
+        
+    def close(self):
+        """Close the store"""
+        self.db_df = None
+
+class PersistenceQueue:
+    """
+    Write-behind queue of the file writes of the recogniser (see RecogniserBN.setWriteBehind), which are applied in order in a background thread.
+    A task is a function with the snapshot of the state to write as its arguments. A task with a key (e.g. saving the network) replaces the pending task 
+    with the same key and is moved to the end of the queue, so that the network file is never ahead of the recognition files written before it 
+    (the recognition files can be ahead of the network if the process is killed, see RecogniserBN.checkModelHeader). 
+    The queue is closed (the pending tasks are applied) when the process exits.
+    """
+    
+    def __init__(self):
+        self.tasks = [] # pending tasks (key, func, args)
+        self.condition = threading.Condition()
+        self.isBusy = False # is a task being applied
+        self.isRunning = True
+        self.error = None # first error raised by a task (raised in flush)
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+        
+    def put(self, func, args, key = None):
+        """Queue func(*args), replacing the pending task with the same key (if key is not None)"""
+        with self.condition:
+            if key is not None:
+                self.tasks = [task for task in self.tasks if task[0] != key]
+            self.tasks.append((key, func, args))
+            self.condition.notify_all()
+    
+    def run(self):
+        """Apply the tasks in order until the queue is closed"""
+        while True:
+            with self.condition:
+                while not self.tasks and self.isRunning:
+                    self.condition.wait()
+                if not self.tasks:
+                    return
+                key, func, args = self.tasks.pop(0)
+                self.isBusy = True
+            error = None
+            try:
+                func(*args)
+            except Exception as e:
+                logging.exception("Error in the write-behind queue")
+                error = e
+            with self.condition:
+                if self.error is None:
+                    self.error = error
+                self.isBusy = False
+                self.condition.notify_all()
+    
+    def flush(self):
+        """Wait until all the queued tasks are applied, and raise the first error of the tasks (if any)"""
+        with self.condition:
+            while self.tasks or self.isBusy:
+                self.condition.wait()
+            error = self.error
+            self.error = None
+        if error is not None:
+            raise error
+        
+    def close(self):
+        """Apply the queued tasks and stop the thread"""
+        with self.condition:
+            self.isRunning = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()
+
+def syncFile(file_name):
+    """Flush the file (or the files in the directory and the directory) to the disk"""
+    if os.path.isdir(file_name):
+        for name in os.listdir(file_name):
+            syncFile(os.path.join(file_name, name))
+    try:
+        fd = os.open(file_name, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass # the file system does not support fsync of directories
+    finally:
+        os.close(fd)
+
+def renameFile(src, dst):
+    """Rename src to dst after src is flushed to the disk, and flush the directory of dst, so that dst is either the previous or the complete file after a crash"""
+    syncFile(src)
+    os.rename(src, dst)
+    syncFile(os.path.dirname(os.path.abspath(dst)))
+
+def runCrossValidationJob(job):
+    """
+    Run a cross validation job of runParallelCrossValidation (in a worker process) in a new RecogniserBN: training with job['training'], 
+    and test on the learned network with job['test'] if given, in the folders scratch_dir/name/training/ and scratch_dir/name/test/. 
+    Returns the results of runCrossValidation for training and test with the counts of DIR and FAR, the confusion matrices (None if the files are not saved) 
+    and the quality threshold sweep (None if not isQualitySweep).
+    """
+    job_dir = os.path.join(job["scratch_dir"], job["name"]) + "/"
+    folders = {"training": job_dir + "training/", "test": job_dir + "test/"}
+    for folder in folders.values():
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    params = dict((key, value) for key, value in job.items() if key not in ["name", "condition", "num_people", "scratch_dir", "training", "test", "isQualitySweep"])
+    
+    RB = RecogniserBN()
+    RB.setSilentMode()
+    job_result = {"name": job["name"], "condition": job.get("condition", job["name"]), "training": None, "test": None}
+    for data_type in ["training", "test"]:
+        if job.get(data_type) is None:
+            continue
+        data_params = dict(params)
+        data_params.update(job[data_type])
+        # the images are sorted only if the validation info (the original images) is given
+        data_params.setdefault("isSaveImageAn", data_params.get("valid_info_file") is not None)
+        RB.setQualitySweep(job.get("isQualitySweep", False))
+        num_recog, FER, stats_openSet, stats_FR, num_unknown = RB.runCrossValidation(job.get("num_people"), folders["training"], folders["test"], 
+                                                                                     isTestData = data_type == "test", **data_params)
+        result = {"num_recog": num_recog, "FER": FER, "stats_openSet": stats_openSet, "stats_FR": stats_FR, "num_unknown": num_unknown, 
+                  "counts": RB.cross_validation_counts, "labels": list(RB.i_labels), "conf_matrices": None, "quality_sweep": None}
+        if job.get("isQualitySweep", False):
+            result["quality_sweep"] = RB.getQualitySweep()
+        if RB.isSaveRecogFiles:
+            result["conf_matrices"] = RB.getConfusionMatrices()
+        job_result[data_type] = result
+    RB.closeUserStore()
+    return job_result
+
 if __name__ == "__main__":
 
     RB = RecogniserBN()
@@ -457,7 +457,7 @@ class RecognitionModule(object):
                 self.say(textToSay)
                 self.askInputJS(self.parameters[self.counter])
             else:
-                identity_name = self.RB.names[self.RB.i_labels.index(self.identity_est)]
+                identity_name = self.RB.names[self.RB.getLabelIndex(self.identity_est)]
                 self.getPersonFromDB(identity_name)
                 identity_say = identity_name.split()
                 textToSay = self.RB.askForIdentityConfirmal.replace("XX", str(identity_say[0]))
@@ -474,7 +474,7 @@ class RecognitionModule(object):
                                 
         else:
             if self.identity_est:
-                print self.RB.names[self.RB.i_labels.index(self.identity_est)]
+                print self.RB.names[self.RB.getLabelIndex(self.identity_est)]
             else:
                 print "all images are discarded"
 
@@ -507,7 +507,7 @@ class RecognitionModule(object):
                 self.s.ALMemory.raiseEvent("RecognitionResultsWritten", [self.isRegistered, self.identity_est, identity_name])
                 
             else:
-                identity_name = self.RB.names[self.RB.i_labels.index(self.identity_est)]
+                identity_name = self.RB.names[self.RB.getLabelIndex(self.identity_est)]
                 print identity_name
                 self.getPersonFromDB(identity_name)
                 print "isRegistered : " + str(self.isRegistered) + ", id estimated: " + self.identity_est + " id name: " + identity_name
@@ -1055,40 +1055,35 @@ class RecognitionModule(object):
     
     @qi.bind(returnType=qi.Void, paramsType=[qi.String, qi.String])    
     def updateDB(self, csv_file, p_name):
-        """This function updates the database csv file with the updated time of the person seen"""
-        time_p = self.db_df.loc[self.db_df['name'] == p_name, 'times'].iloc[0]
-        time_p.append(self.getTime())
-        self.db_df.loc[self.db_df['name'] == p_name, 'times'].iloc[0] = time_p
-        with open(csv_file, 'w') as fd:
-            self.db_df.to_csv(fd, index=False, header=True)
+        """This function updates the user database of the csv file with the updated time of the person seen"""
+        self.RB.persist(self.RB.getUserStore(csv_file).addTime, (p_name, self.getTime()))
         
     @qi.bind(returnType=qi.Bool, paramsType=[qi.String])    
     def isPersonInDB(self, p_name):
         p_name = self.changeNameLetters(p_name)
         if self.num_db > 0:
-            if p_name in self.db_df.name.values:
+            if self.RB.getUserStore(self.db_file).isNameInStore(p_name):
                 return True
         return False
     
     @qi.bind(returnType=qi.Void, paramsType=[qi.String])  
     def loadDB(self, csv_file):
-        if os.path.isfile(csv_file):
-            self.num_db = sum(1 for line in open(csv_file)) - 1
-            self.db_df = pandas.read_csv(csv_file, dtype={"I": object}, converters={"times": ast.literal_eval})
+        self.RB.flush()
+        self.db_file = csv_file # the user database that is used in isPersonInDB and getPersonFromDB
+        if self.RB.isDBFile(csv_file):
+            self.num_db = self.RB.getUserStore(csv_file).getNumUsers()
         else:
             self.cleanDB()
         
     @qi.bind(returnType=qi.Void, paramsType=[qi.String])  
     def getPersonFromDB(self, p_name):
-        self.person[0] = str(self.db_df.loc[self.db_df['name'] == p_name, 'id'].iloc[0])
+        person = self.RB.getUserStore(self.db_file).getUserByName(p_name)
+        self.person[0] = str(person[0])
         self.person[1] = p_name
-        self.person[2] = self.db_df.loc[self.db_df['name'] == p_name, 'gender'].iloc[0]
-        try:
-            self.person[3] = self.db_df.loc[self.db_df['name'] == p_name, 'birthYear'].iloc[0]
-        except:
-            self.person[3] = self.db_df.loc[self.db_df['name'] == p_name, 'age'].iloc[0]
-        self.person[4] = self.db_df.loc[self.db_df['name'] == p_name, 'height'].iloc[0]
-        self.person[5] = self.db_df.loc[self.db_df['name'] == p_name, 'times'].iloc[0]
+        self.person[2] = person[2]
+        self.person[3] = person[3]
+        self.person[4] = person[4]
+        self.person[5] = person[5]
         print "The person is :",self.person
     
     @qi.bind(returnType=qi.Void, paramsType=[])
@@ -1106,6 +1101,7 @@ class RecognitionModule(object):
         self.running = False
         self.RB.saveBN()
         self.RB.saveFaceDetectionDB()
+        self.RB.flush()
 #         self.s.ALMotion.rest()
 #         time.sleep(2.0)
         try:
@@ -0,0 +1,280 @@
+import unittest
+import os
+import shutil
+import tempfile
+import random
+import csv
+import ast
+import numpy as np
+import RecognitionMemory
+
+def getPersons(num_persons, start = 1):
+    """Users in the format of addPersonToBN"""
+    genders = ["Female", "Male"]
+    return [[str(p), "Name" + str(p), genders[p % 2], 1950 + (7*p) % 50, 150.0 + (11*p) % 45, [["%02d:%02d:00" % (8 + p % 10, (13*p) % 60), str(1 + p % 5)]]]
+            for p in range(start, start + num_persons)]
+
+def getRecognitions(num_people, num_recogs, seed = 3):
+    """Users and recognitions in the format of learnFromFile (db_list, init_list, recogs_list): a new user is enrolled in the first recognitions 
+    and in a quarter of the rest, and the face recognition result of the user is higher than the others after the enrolment"""
+    rnd = random.Random(seed)
+    people = getPersons(num_people)
+    db_list = []
+    init_list = []
+    recogs_list = []
+    seen = []
+    for num_recog in range(1, num_recogs + 1):
+        isNew = len(seen) < num_people and (num_recog <= 3 or rnd.random() < 0.25)
+        p_id = str(len(seen) + 1) if isNew else rnd.choice(seen)
+        person = people[int(p_id) - 1]
+        face = [[s, round(rnd.uniform(0.3, 0.95) if s == p_id else rnd.uniform(0.0, 0.45), 3)] for s in seen]
+        recog_results = [[0.6, face], [person[2], round(rnd.uniform(0.5, 0.99), 3)], [2017 - person[3] + rnd.randint(-8, 8), round(rnd.uniform(0.1, 0.8), 3)], 
+                         [person[4] + rnd.randint(-5, 5), 0.08], ["%02d:%02d:00" % (rnd.randint(8, 18), rnd.randint(0, 59)), str(rnd.randint(1, 5)), "06", "June", "2017"]]
+        if isNew:
+            seen.append(p_id)
+            db_list.append(person[:5] + [[recog_results[4][:2]]])
+            init_list.append(["0"] + recog_results + [num_recog])
+            recog_results = [[0.6, face + [[p_id, round(rnd.uniform(0.5, 0.95), 3)]]]] + recog_results[1:]
+        recogs_list.append([p_id] + recog_results + [1 if isNew else 0, num_recog])
+    return db_list, init_list, recogs_list
+
+class TestImportUsers(unittest.TestCase):
+
+    def getRecogniser(self, face_weight, isOnline):
+        RB = RecognitionMemory.RecogniserBN()
+        RB.setSilentMode()
+        RB.setSessionConstant(isMemoryRobot = True, isDBinCSV = True, isSaveRecogFiles = False, isSpeak = False)
+        RB.setOnlineLearning(isOnline)
+        RB.setWeights(face_weight, 0.044, 0.538, 0.136, 0.906)
+        RB.isBNLoaded = True
+        RB.loadDB()
+        return RB
+
+    def assertSameNetwork(self, RB_import, RB_add):
+        self.assertEqual(RB_import.i_labels, RB_add.i_labels)
+        self.assertTrue(np.allclose(RB_import.prior_I, RB_add.prior_I, rtol = 0, atol = 1e-12))
+        for counter in range(0, 5):
+            self.assertTrue(np.allclose(RB_import.getLikelihoodMatrix(counter), RB_add.getLikelihoodMatrix(counter), rtol = 0, atol = 1e-12))
+
+    def testImportUsersAsAddPersonToBN(self):
+        """importUsers gives the same network as addPersonToBN for each user, into an empty network and next to existing users"""
+        for face_weight in [1.0, 0.5, 2.0]:
+            for isOnline in [False, True]:
+                for num_existing in [0, 3]:
+                    RB_import = self.getRecogniser(face_weight, isOnline)
+                    RB_add = self.getRecogniser(face_weight, isOnline)
+                    for person in getPersons(num_existing):
+                        RB_import.addPersonToBN(person)
+                    RB_import.importUsers(getPersons(6, num_existing + 1))
+                    for person in getPersons(num_existing + 6):
+                        RB_add.addPersonToBN(person)
+                    self.assertSameNetwork(RB_import, RB_add)
+
+class TestRecognitionLog(unittest.TestCase):
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.log = RecognitionMemory.RecognitionLog(os.path.join(self.test_dir, "RecogniserBN.log"))
+        
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        
+    def getRecords(self):
+        """Records of the recognition files as (record type, row)"""
+        RL = RecognitionMemory.RecognitionLog
+        return [(RL.RECOGNISER, ["1", [0.6, [["1", 0.82], ["2", 0.1]]], ["Female", 0.71], [31, 0.54], [165.0, 0.08], ["10:05:00", "2", "06", "June", "2017"], 1, 1]),
+                (RL.INITIAL, ["0", [0.6, []], ["Male", 0.6], [40, 0.3], [180.0, 0.08], ["11:30:00", "3", "06", "June", "2017"], 2]),
+                (RL.COMPARISON, ["2", "1", "", [0.25, 0.5, 0.25], [0.1, 0.3], 0.12, 0, 0.043, 0.5, 0.3]),
+                (RL.RECOGNISER, ["", [0.6, [["2", 0.4]]], ["Male", 0.9], [39, 0.2], [181.0, 0.08], ["11:30:00", "3", "06", "June", "2017"], "", 2]),
+                (RL.COMPARISON, ["1", "1", "1", [0.9, 0.1], [0.8], 0.05, 1, None, 0.9, ""])]
+    
+    def writeRecords(self):
+        for record_type, row in self.getRecords():
+            self.log.append(record_type, row)
+    
+    def testRoundTrip(self):
+        """The rows are read as they are written"""
+        self.writeRecords()
+        self.assertEqual(self.log.read(), self.getRecords())
+        for record_type in [RecognitionMemory.RecognitionLog.RECOGNISER, RecognitionMemory.RecognitionLog.COMPARISON]:
+            self.assertEqual(self.log.read(record_type), [row for rec_type, row in self.getRecords() if rec_type == record_type])
+            
+    def testCorruptedRecord(self):
+        """A record with a CRC that does not match ends the reading, and truncate removes it"""
+        self.writeRecords()
+        with open(self.log.log_file, "rb") as fd:
+            data = fd.read()
+        frames = list(self.log.iterFrames(data))
+        # change a byte in the payload of the third record
+        pos = frames[2][1] + 1
+        with open(self.log.log_file, "wb") as fd:
+            fd.write(data[:pos] + chr((ord(data[pos]) + 1) % 256) + data[pos + 1:])
+        self.assertEqual(self.log.read(), self.getRecords()[:2])
+        self.assertEqual(self.log.getNumRecords(), 2)
+        self.log.truncate(5)
+        with open(self.log.log_file, "rb") as fd:
+            self.assertEqual(fd.read(), data[:frames[1][3]])
+        
+    def testTruncatedRecord(self):
+        """A truncated record at the end of the log (e.g. power loss while writing) is ignored"""
+        self.writeRecords()
+        with open(self.log.log_file, "rb") as fd:
+            data = fd.read()
+        for size in [len(data) - 1, len(data) - 6]:
+            with open(self.log.log_file, "wb") as fd:
+                fd.write(data[:size])
+            self.assertEqual(self.log.read(), self.getRecords()[:-1])
+            self.assertEqual(self.log.getNumRecords(), len(self.getRecords()) - 1)
+        
+    def testNumRecords(self):
+        """getNumRecords is the number of rows of read"""
+        self.assertEqual(self.log.getNumRecords(), 0)
+        self.writeRecords()
+        for record_type in [None, RecognitionMemory.RecognitionLog.RECOGNISER, RecognitionMemory.RecognitionLog.INITIAL, 
+                            RecognitionMemory.RecognitionLog.COMPARISON, RecognitionMemory.RecognitionLog.JOURNAL]:
+            self.assertEqual(self.log.getNumRecords(record_type), len(self.log.read(record_type)))
+
+class TestRevert(unittest.TestCase):
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+    
+    def getRecogniser(self, name):
+        RB = RecognitionMemory.RecogniserBN()
+        RB.setSilentMode()
+        RB.loadSentencesForRecognition()
+        RB.setFilePaths(os.path.join(self.test_dir, name) + "/")
+        RB.setOnlineLearning(True)
+        return RB
+    
+    def learnRecognitions(self, name, num_recogs):
+        """Learn the first num_recogs recognitions of the dataset in a new recogniser"""
+        os.makedirs(os.path.join(self.test_dir, name))
+        RB = self.getRecogniser(name)
+        RB.resetFiles()
+        RB.loadBN(RB.recog_file, RB.recogniser_csv_file, RB.initial_recognition_file)
+        db_list, init_list, recogs_list = getRecognitions(8, 40)
+        RB.learnFromFile(db_list = db_list, init_list = [row for row in init_list if row[-1] <= num_recogs], recogs_list = recogs_list[:num_recogs])
+        RB.flush()
+        return RB
+    
+    def assertSameState(self, RB_reverted, RB_learned):
+        self.assertEqual(RB_reverted.i_labels, RB_learned.i_labels)
+        self.assertTrue(np.allclose(RB_reverted.prior_I, RB_learned.prior_I, rtol = 0, atol = 1e-15))
+        for counter in range(0, 5):
+            self.assertTrue(np.allclose(RB_reverted.getLikelihoodMatrix(counter), RB_learned.getLikelihoodMatrix(counter), rtol = 0, atol = 1e-15))
+        
+    def testRevertTo(self):
+        """Reverting k recognitions gives the state of learning the recognitions before them, and the state is kept after the recogniser is loaded again"""
+        for num_steps in [5, 30]:
+            RB_learned = self.learnRecognitions("learned_" + str(num_steps), 40 - num_steps)
+            RB_reverted = self.learnRecognitions("reverted_" + str(num_steps), 40)
+            self.assertEqual(RB_reverted.revertTo(num_steps), num_steps)
+            self.assertSameState(RB_reverted, RB_learned)
+            self.assertEqual(RB_reverted.occurrences, RB_learned.occurrences)
+            self.assertEqual(RB_reverted.num_recognitions, RB_learned.num_recognitions)
+            for csv_file, record_type in [(RB_learned.recogniser_csv_file, RecognitionMemory.RecognitionLog.RECOGNISER), 
+                                          (RB_learned.initial_recognition_file, RecognitionMemory.RecognitionLog.INITIAL)]:
+                reverted_file = csv_file.replace("learned_", "reverted_")
+                self.assertEqual(RB_reverted.readRecogFile(reverted_file, record_type).values.tolist(), RB_learned.readRecogFile(csv_file, record_type).values.tolist())
+            RB_loaded = self.getRecogniser("reverted_" + str(num_steps))
+            RB_loaded.loadBN(RB_loaded.recog_file, RB_loaded.recogniser_csv_file, RB_loaded.initial_recognition_file)
+            self.assertSameState(RB_loaded, RB_learned)
+            self.assertEqual(RB_loaded.occurrences, RB_learned.occurrences)
+
+class TestRecognitionCSV(unittest.TestCase):
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.csv_file = os.path.join(self.test_dir, "RecogniserBN.csv")
+        self.writeRows(getRecognitions(4, 10)[2])
+        
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        
+    def writeRows(self, rows):
+        """Write the rows of RecogniserBN.csv as the recogniser does (the lists as python literals, see RecogniserBN.writeRecogFile)"""
+        with open(self.csv_file, "wb") as outcsv:
+            writer = csv.writer(outcsv)
+            writer.writerow(RecognitionMemory.RecognitionLog.COLUMNS[RecognitionMemory.RecognitionLog.RECOGNISER])
+            for row in rows:
+                writer.writerow([str(value) for value in row])
+    
+    def getLiteralRows(self):
+        """Parse the rows of the CSV file with ast.literal_eval (as pandas.read_csv with the converters of the baseline)"""
+        with open(self.csv_file, "rb") as incsv:
+            reader = csv.reader(incsv)
+            next(reader)
+            return [[ast.literal_eval(value) if counter in range(1, 6) else value for counter, value in enumerate(line)] for line in reader]
+        
+    def testParseAsLiteralEval(self):
+        """The parser and the typed arrays give the same values as ast.literal_eval"""
+        recog_csv = RecognitionMemory.RecognitionCSV(self.csv_file, RecognitionMemory.RecognitionLog.RECOGNISER)
+        literal_rows = self.getLiteralRows()
+        self.assertEqual(recog_csv.parse(), literal_rows)
+        self.assertEqual(recog_csv.getRows(recog_csv.read()), literal_rows)
+        
+    def testCacheInvalidated(self):
+        """The cache is used while the CSV file is not changed, and the file is parsed again when it is changed"""
+        recog_csv = RecognitionMemory.RecognitionCSV(self.csv_file, RecognitionMemory.RecognitionLog.RECOGNISER)
+        mtime = 1500000000
+        os.utime(self.csv_file, (mtime, mtime))
+        recog_csv.read()
+        self.assertTrue(os.path.isfile(recog_csv.getCacheFile()))
+        # the cache (not the CSV file) is read if the modification time and the size of the file are not changed
+        with open(self.csv_file, "r+b") as fd:
+            fd.seek(len(fd.readline())) # the ID of the user in the first row
+            fd.write("X")
+        os.utime(self.csv_file, (mtime, mtime))
+        self.assertEqual(recog_csv.getRows(recog_csv.read())[0][0], "1")
+        # the file is parsed again if its modification time or its size is changed
+        for num_recogs, mtime in [(10, mtime + 10), (12, mtime + 10)]:
+            self.writeRows(getRecognitions(4, num_recogs)[2])
+            os.utime(self.csv_file, (mtime, mtime))
+            arrays = recog_csv.read()
+            self.assertEqual(recog_csv.getRows(arrays), self.getLiteralRows())
+            cache = np.load(recog_csv.getCacheFile())
+            self.assertEqual(float(cache["source_mtime"]), mtime)
+            self.assertEqual(int(cache["source_size"]), os.stat(self.csv_file).st_size)
+            cache.close()
+
+class TestRecognitionSimulator(unittest.TestCase):
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        
+    def testRunAsLearnFromFile(self):
+        """The simulator gives the results, the network and the occurrences of learnFromFile"""
+        for isOnline in [False, True]:
+            RB_learned = RecognitionMemory.RecogniserBN()
+            RB_learned.setSilentMode()
+            RB_learned.loadSentencesForRecognition()
+            RB_learned.setFilePaths(os.path.join(self.test_dir, str(isOnline)) + "/")
+            RB_learned.setOnlineLearning(isOnline)
+            os.makedirs(os.path.join(self.test_dir, str(isOnline)))
+            RB_learned.resetFiles()
+            RB_learned.loadBN(RB_learned.recog_file, RB_learned.recogniser_csv_file, RB_learned.initial_recognition_file)
+            learned_results = RB_learned.learnFromFile(*getRecognitions(6, 30))
+            RB_learned.flush()
+            
+            RB_simulated = RecognitionMemory.RecogniserBN()
+            RB_simulated.setSilentMode()
+            RB_simulated.setOnlineLearning(isOnline)
+            simulated_results = RecognitionMemory.RecognitionSimulator(RB_simulated).run(*getRecognitions(6, 30))
+            
+            self.assertEqual(simulated_results, learned_results)
+            self.assertEqual(RB_simulated.i_labels, RB_learned.i_labels)
+            self.assertEqual(RB_simulated.occurrences, RB_learned.occurrences)
+            self.assertEqual(RB_simulated.num_recognitions, RB_learned.num_recognitions)
+            self.assertTrue(np.allclose(RB_simulated.prior_I, RB_learned.prior_I, rtol = 0, atol = 1e-15))
+            for counter in range(0, 5):
+                self.assertTrue(np.allclose(RB_simulated.getLikelihoodMatrix(counter), RB_learned.getLikelihoodMatrix(counter), rtol = 0, atol = 1e-15))
+
+if __name__ == "__main__":
+    unittest.main()